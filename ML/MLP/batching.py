@@ -0,0 +1,114 @@
+import queue
+import threading
+from typing import Iterator, Optional, Sequence, Tuple
+
+import torch
+
+
+class TensorBatchLoader:
+    """
+    Batches straight from in-memory tensors, a drop-in for DataLoader.
+
+    Each epoch draws one permutation and gathers a whole batch with a
+    single index op per tensor in the main process, instead of indexing
+    samples one by one in workers and collating them again. Unshuffled
+    batches are contiguous slices and copy nothing. With prefetch the
+    next batch is gathered in a background thread; torch releases the GIL
+    while it copies, so this overlaps with the training step.
+    """
+
+    def __init__(
+        self,
+        tensors: Sequence[torch.Tensor],
+        batch_size: int,
+        shuffle: bool = False,
+        drop_last: bool = False,
+        prefetch: bool = False,
+        pin_memory: bool = False,
+        generator: Optional[torch.Generator] = None,
+    ):
+        if not tensors:
+            raise ValueError("At least one tensor is required")
+        n = len(tensors[0])
+        if any(len(t) != n for t in tensors):
+            raise ValueError("All tensors must have the same number of rows")
+        self.tensors = tuple(tensors)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.prefetch = prefetch
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+        self.generator = generator
+
+    @property
+    def num_rows(self) -> int:
+        return len(self.tensors[0])
+
+    def __len__(self) -> int:
+        if self.drop_last:
+            return self.num_rows // self.batch_size
+        return -(-self.num_rows // self.batch_size)
+
+    def __iter__(self) -> Iterator[Tuple[torch.Tensor, ...]]:
+        batches = self._batches()
+        if self.prefetch:
+            batches = self._prefetched(batches)
+        return batches
+
+    def _batches(self) -> Iterator[Tuple[torch.Tensor, ...]]:
+        order = None
+        if self.shuffle:
+            order = torch.randperm(self.num_rows, generator=self.generator)
+
+        for i in range(len(self)):
+            start = i * self.batch_size
+            end = min(start + self.batch_size, self.num_rows)
+            if order is None:
+                batch = tuple(t[start:end] for t in self.tensors)
+            else:
+                index = order[start:end]
+                batch = tuple(t.index_select(0, index) for t in self.tensors)
+            if self.pin_memory:
+                batch = tuple(t.pin_memory() for t in batch)
+            yield batch
+
+    def _prefetched(
+        self, batches: Iterator[Tuple[torch.Tensor, ...]]
+    ) -> Iterator[Tuple[torch.Tensor, ...]]:
+        # one batch ahead is enough to hide the gather behind a step
+        ready: queue.Queue = queue.Queue(maxsize=1)
+        stop = threading.Event()
+        done = object()
+
+        def offer(item) -> bool:
+            while not stop.is_set():
+                try:
+                    ready.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def produce():
+            try:
+                for batch in batches:
+                    if not offer(batch):
+                        return
+                offer(done)
+            except BaseException as e:
+                offer(e)
+
+        thread = threading.Thread(target=produce, name="batch-prefetch", daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = ready.get()
+                if item is done:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            # the consumer may stop early, e.g. limit_train_batches
+            stop.set()
+            thread.join()
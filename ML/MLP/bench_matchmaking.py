@@ -0,0 +1,93 @@
+"""
+Matchmaking throughput on CPU with synthetic players.
+
+    python bench_matchmaking.py --lobbies 2000 --dim 11
+
+Reports lobbies/sec for the exhaustive 126-split search with the rating
+scorer and an untrained MatchWinModel, with and without role assignment,
+and the latency of the local search for larger pools.
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from match_dataset import POSITIONS, player_transformer
+from match_model import MatchWinModel
+from matchmaking import Matchmaker, model_scorer, rating_scorer, role_costs
+
+
+def lobbies_per_second(matchmaker: Matchmaker, lobbies: np.ndarray) -> float:
+    start = time.perf_counter()
+    matchmaker.best_splits(lobbies)
+    return len(lobbies) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--players", type=int, default=10_000)
+    parser.add_argument("--lobbies", type=int, default=2_000)
+    parser.add_argument("--dim", type=int, default=11, help="player features")
+    parser.add_argument("--pools", default="20,50,100")
+    parser.add_argument("--budget", type=float, default=0.05, help="seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    torch.manual_seed(args.seed)
+    mu = rng.normal(25.0, 4.0, args.players)
+    sigma = rng.uniform(1.0, 8.0, args.players)
+    # pregame_features layout: embedding, decayed game count, position code
+    players = np.column_stack([
+        rng.normal(size=(args.players, args.dim)),
+        rng.gamma(2.0, 10.0, args.players),
+        np.full(args.players, -1.0),
+    ]).astype(np.float32)
+    # most players stick to one or two roles
+    counts = rng.poisson(3.0, (args.players, 5)) * (rng.random((args.players, 5)) < 0.4)
+    roles = role_costs(counts)
+    lobbies = np.stack([
+        rng.choice(args.players, 10, replace=False) for _ in range(args.lobbies)
+    ])
+
+    # with team_position, so the roles run write the position codes
+    transformer = player_transformer([f"f{i}" for i in range(args.dim)])
+    transformer.encode("team_position", POSITIONS)
+    model = MatchWinModel(transformer=transformer.to_dict())
+
+    scorers = {
+        "ratings": Matchmaker(rating_scorer(mu, sigma)),
+        "ratings + roles": Matchmaker(rating_scorer(mu, sigma), role_costs=roles),
+        "MatchWinModel": Matchmaker(model_scorer(model, players, transformer)),
+        "MatchWinModel + roles": Matchmaker(
+            model_scorer(model, players, transformer), role_costs=roles
+        ),
+    }
+    for name, matchmaker in scorers.items():
+        rate = lobbies_per_second(matchmaker, lobbies)
+        print(
+            f"{name:<22} 126 splits {rate:>10,.0f} lobbies/s"
+            f" {1000 / rate:>7.3f} ms/lobby"
+        )
+
+    for pool_size in (int(p) for p in args.pools.split(",")):
+        pool = rng.choice(args.players, pool_size, replace=False)
+        matchmaker = Matchmaker(
+            rating_scorer(mu[pool], sigma[pool]), role_costs=roles[pool]
+        )
+        start = time.perf_counter()
+        lobby = matchmaker.search(pool_size, budget=args.budget, seed=args.seed)
+        elapsed = time.perf_counter() - start
+        print(
+            f"pool {pool_size:<4} search {elapsed * 1000:>7.1f} ms,"
+            f" {lobby.evaluated:>7} lobbies scored, p = {lobby.p_first:.4f},"
+            f" role cost {lobby.role_cost:.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
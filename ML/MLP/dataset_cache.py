@@ -0,0 +1,288 @@
+"""
+On-disk feature cache built from the match database.
+
+    python dataset_cache.py --db_url postgresql://... --query_file train.sql \\
+        --path datasets/train
+
+Each version directory holds raw float32 features and labels, int64 match
+keys (platform code, game_id, participant_id) and meta.json with the
+schema, row count, the fitted feature transformer and per-platform game_id
+watermarks.
+Rebuilding with the same query only appends games newer than the
+watermarks; a changed query or layout starts a new version.
+"""
+import argparse
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import psycopg
+
+from features import FeatureTransformer
+from streaming import (
+    conninfo_from_url,
+    fill_chunk,
+    stream_rows,
+    transformer_from_columns,
+)
+
+FORMAT_VERSION = 2
+KEY_COLS = ("platform_name", "game_id", "participant_id")
+
+INCREMENTAL_QUERY = """
+    SELECT q.* FROM ({query}) AS q
+    LEFT JOIN unnest(%(platforms)s::text[], %(watermarks)s::bigint[])
+        AS w(platform_name, game_id)
+        ON w.platform_name = q.platform_name
+    WHERE w.game_id IS NULL OR q.game_id > w.game_id
+"""
+
+
+@dataclass
+class CachedDataset:
+    path: Path
+    meta: dict
+    # copy-on-write memmaps, so torch.from_numpy shares pages with the file
+    features: np.ndarray
+    labels: np.ndarray
+    keys: np.ndarray
+
+    @property
+    def transformer(self) -> FeatureTransformer:
+        return FeatureTransformer.from_dict(self.meta["transformer"])
+
+    @property
+    def feature_names(self) -> List[str]:
+        # raw columns, the model sees transformer.feature_names
+        return self.meta["feature_names"]
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+
+def query_hash(query: str) -> str:
+    normalised = " ".join(query.split())
+    return hashlib.sha256(normalised.encode()).hexdigest()[:16]
+
+
+def latest_version(path: Path) -> Optional[Path]:
+    try:
+        return path / (path / "LATEST").read_text().strip()
+    except FileNotFoundError:
+        return None
+
+
+def read_meta(version: Path) -> dict:
+    return json.loads((version / "meta.json").read_text())
+
+
+def write_meta(version: Path, meta: dict) -> None:
+    partial = version / "meta.json.tmp"
+    partial.write_text(json.dumps(meta, indent=1))
+    os.replace(partial, version / "meta.json")
+
+
+def new_version(path: Path, query: str, transformer: FeatureTransformer) -> Path:
+    previous = latest_version(path)
+    number = int(previous.name[1:]) + 1 if previous is not None else 1
+    version = path / f"v{number}"
+    version.mkdir(parents=True)
+    for name in ("features.f32", "labels.f32", "keys.i64"):
+        (version / name).touch()
+
+    now = datetime.now().isoformat()
+    write_meta(version, {
+        "format": FORMAT_VERSION,
+        "query": query,
+        "query_hash": query_hash(query),
+        "feature_names": transformer.raw_names,
+        "rows": 0,
+        "platforms": [],
+        "watermarks": {},
+        "transformer": transformer.to_dict(),
+        "created": now,
+        "updated": now,
+    })
+    (path / "LATEST").write_text(version.name)
+    return version
+
+
+def query_columns(conn: psycopg.Connection, query: str) -> List[str]:
+    cur = conn.execute(f"SELECT * FROM ({query}) AS q LIMIT 0")
+    return [column.name for column in cur.description]
+
+
+def append_rows(
+    conn: psycopg.Connection,
+    version: Path,
+    meta: dict,
+    chunk_rows: int,
+) -> int:
+    transformer = FeatureTransformer.from_dict(meta["transformer"])
+    dim = len(transformer.raw_names)
+    watermarks: Dict[str, int] = dict(meta["watermarks"])
+    platforms: List[str] = list(meta["platforms"])
+    platform_codes = {p: i for i, p in enumerate(platforms)}
+
+    params = {
+        "platforms": list(watermarks),
+        "watermarks": list(watermarks.values()),
+    }
+    query = INCREMENTAL_QUERY.format(query=meta["query"])
+
+    x_buf = np.empty((chunk_rows, dim), dtype=np.float32)
+    y_buf = np.empty(chunk_rows, dtype=np.float32)
+    keys_buf = np.empty((chunk_rows, len(KEY_COLS)), dtype=np.int64)
+
+    rows_before = meta["rows"]
+    files = {
+        name: open(version / name, "r+b")
+        for name in ("features.f32", "labels.f32", "keys.i64")
+    }
+    try:
+        # drop anything a crashed build wrote past the recorded row count
+        files["features.f32"].truncate(rows_before * dim * 4)
+        files["labels.f32"].truncate(rows_before * 4)
+        files["keys.i64"].truncate(rows_before * len(KEY_COLS) * 8)
+        for f in files.values():
+            f.seek(0, os.SEEK_END)
+
+        added = 0
+        for names, rows in stream_rows(conn, query, params, chunk_rows):
+            n = len(rows)
+            index = {name: i for i, name in enumerate(names)}
+            fill_chunk(rows, names, transformer, x_buf[:n], y_buf[:n])
+            transformer.update(x_buf[:n])
+
+            for row, out in zip(rows, keys_buf[:n]):
+                platform = row[index["platform_name"]]
+                code = platform_codes.get(platform)
+                if code is None:
+                    code = platform_codes[platform] = len(platforms)
+                    platforms.append(platform)
+                game_id = row[index["game_id"]]
+                participant_id = row[index["participant_id"]]
+                out[:] = (code, game_id, participant_id)
+                if game_id > watermarks.get(platform, -1):
+                    watermarks[platform] = game_id
+
+            x_buf[:n].tofile(files["features.f32"])
+            y_buf[:n].tofile(files["labels.f32"])
+            keys_buf[:n].tofile(files["keys.i64"])
+            added += n
+
+        for f in files.values():
+            f.flush()
+            os.fsync(f.fileno())
+    finally:
+        for f in files.values():
+            f.close()
+
+    # readers trust meta.json, so it only moves once the data is on disk
+    meta.update(
+        rows=rows_before + added,
+        platforms=platforms,
+        watermarks=watermarks,
+        transformer=transformer.to_dict(),
+        updated=datetime.now().isoformat(),
+    )
+    write_meta(version, meta)
+    return added
+
+
+def build_cache(
+    db_url: str,
+    query: str,
+    path: Path,
+    rebuild: bool = False,
+    chunk_rows: int = 50_000,
+    vocab_from: Optional[FeatureTransformer] = None,
+) -> Path:
+    """
+    Create or extend the cache at path and return its version directory.
+
+    game_ids are increasing per platform, so only games after the last
+    build's watermark are fetched. Matches backfilled with older game_ids
+    are only picked up by a rebuild. A new version starts from the
+    vocabularies of vocab_from, so a validation cache seeded with the
+    training transformer shares its category codes.
+    """
+    path = Path(path)
+    # the query is wrapped in subqueries
+    query = query.strip().rstrip(";")
+    with psycopg.connect(conninfo_from_url(db_url)) as conn:
+        conn.isolation_level = psycopg.IsolationLevel.REPEATABLE_READ
+        names = query_columns(conn, query)
+        missing = [c for c in KEY_COLS if c not in names]
+        if missing:
+            raise ValueError(f"Query must select {', '.join(missing)}")
+        transformer = transformer_from_columns(names)
+        if vocab_from is not None and vocab_from.same_layout(transformer):
+            transformer = vocab_from.empty_like()
+
+        version = latest_version(path)
+        meta = read_meta(version) if version is not None else None
+        if (
+            rebuild
+            or meta is None
+            or meta["format"] != FORMAT_VERSION
+            or meta["query_hash"] != query_hash(query)
+            or meta["feature_names"] != transformer.raw_names
+        ):
+            version = new_version(path, query, transformer)
+            meta = read_meta(version)
+
+        added = append_rows(conn, version, meta, chunk_rows)
+        print(f"Appended {added} rows to {version}, {meta['rows']} total")
+    return version
+
+
+def open_cache(path: Path) -> CachedDataset:
+    path = Path(path)
+    version = latest_version(path) or path
+    meta = read_meta(version)
+    rows = meta["rows"]
+    dim = len(meta["feature_names"])
+
+    def memmap(name: str, dtype, shape) -> np.ndarray:
+        if rows == 0:
+            return np.empty(shape, dtype=dtype)
+        return np.memmap(version / name, dtype=dtype, mode="c", shape=shape)
+
+    return CachedDataset(
+        path=version,
+        meta=meta,
+        features=memmap("features.f32", np.float32, (rows, dim)),
+        labels=memmap("labels.f32", np.float32, (rows,)),
+        keys=memmap("keys.i64", np.int64, (rows, len(KEY_COLS))),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--db_url", required=True)
+    parser.add_argument("--query_file", required=True, type=Path)
+    parser.add_argument("--path", required=True, type=Path)
+    parser.add_argument("--rebuild", action="store_true")
+    parser.add_argument("--chunk_rows", type=int, default=50_000)
+    args = parser.parse_args()
+
+    build_cache(
+        args.db_url,
+        args.query_file.read_text(),
+        args.path,
+        rebuild=args.rebuild,
+        chunk_rows=args.chunk_rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""
+Feature statistics and the transform applied to every batch.
+
+Raw feature arrays hold the numeric columns followed by one integer code
+per categorical column (-1 for NULL or unseen values). FeatureTransformer
+learns the column means, variances and category vocabularies in a single
+streaming pass, is saved as JSON next to the model and turns raw batches
+into normalised, one-hot encoded model inputs.
+"""
+import json
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+FORMAT_VERSION = 1
+
+
+@dataclass
+class RunningStats:
+    # Welford/Chan running moments in float64, NaNs are skipped per column
+    count: np.ndarray
+    mean: np.ndarray
+    m2: np.ndarray
+
+    @classmethod
+    def zeros(cls, dim: int) -> "RunningStats":
+        return cls(np.zeros(dim), np.zeros(dim), np.zeros(dim))
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "RunningStats":
+        keys = ("count", "mean", "m2")
+        return cls(*(np.array(data[k], dtype=np.float64) for k in keys))
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count.tolist(),
+            "mean": self.mean.tolist(),
+            "m2": self.m2.tolist(),
+        }
+
+    def update(self, chunk: np.ndarray) -> None:
+        # moments of the chunk on its own, then combined with Chan's formula
+        valid = ~np.isnan(chunk)
+        count = valid.sum(axis=0).astype(np.float64)
+        values = np.where(valid, chunk, 0).astype(np.float64)
+        mean = values.sum(axis=0) / np.maximum(count, 1)
+        centred = np.where(valid, values - mean, 0)
+        m2 = np.einsum("ij,ij->j", centred, centred)
+        self.merge_(RunningStats(count, mean, m2))
+
+    def merge_(self, other: "RunningStats") -> "RunningStats":
+        total = self.count + other.count
+        safe = np.maximum(total, 1)
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * other.count / safe
+        self.m2 = self.m2 + other.m2 + delta ** 2 * self.count * other.count / safe
+        self.count = total
+        return self
+
+    @property
+    def variance(self) -> np.ndarray:
+        # sample variance like pandas
+        return np.where(self.count > 1, self.m2 / np.maximum(self.count - 1, 1), 0)
+
+    @property
+    def std(self) -> np.ndarray:
+        # constant columns are left unscaled
+        std = np.sqrt(self.variance)
+        std[std == 0] = 1
+        return std
+
+
+@dataclass
+class FeatureTransformer:
+    numeric: List[str]
+    categorical: List[str]
+    vocab: Dict[str, List[str]] = field(default_factory=dict)
+    stats: Optional[RunningStats] = None
+
+    def __post_init__(self):
+        for column in self.categorical:
+            self.vocab.setdefault(column, [])
+        if self.stats is None:
+            self.stats = RunningStats.zeros(len(self.numeric))
+        self._codes = {
+            column: {value: i for i, value in enumerate(values)}
+            for column, values in self.vocab.items()
+        }
+
+    @property
+    def raw_names(self) -> List[str]:
+        # columns of the raw arrays the caches and loaders hold
+        return self.numeric + self.categorical
+
+    @property
+    def feature_names(self) -> List[str]:
+        # columns of the transformed batches the model sees
+        names = list(self.numeric)
+        for column in self.categorical:
+            names += [f"{column}_{value}" for value in self.vocab[column]]
+        return names
+
+    def same_layout(self, other: "FeatureTransformer") -> bool:
+        return self.numeric == other.numeric and self.categorical == other.categorical
+
+    def empty_like(self) -> "FeatureTransformer":
+        # the vocabulary carries over so codes stay comparable, stats do not
+        vocab = {column: list(values) for column, values in self.vocab.items()}
+        return FeatureTransformer(list(self.numeric), list(self.categorical), vocab)
+
+    def encode(self, column: str, values: Sequence, grow: bool = True) -> np.ndarray:
+        # vocabularies only ever append, so existing codes never change
+        codes = self._codes[column]
+        vocab = self.vocab[column]
+        out = np.empty(len(values), dtype=np.float32)
+        for i, value in enumerate(values):
+            if isinstance(value, bytes):
+                # unregistered enums arrive as bytes over binary transfer
+                value = value.decode()
+            code = codes.get(value)
+            if code is None:
+                if value is None or not grow:
+                    out[i] = -1
+                    continue
+                code = codes[value] = len(vocab)
+                vocab.append(value)
+            out[i] = code
+        return out
+
+    def update(self, raw: np.ndarray) -> None:
+        self.stats.update(raw[:, :len(self.numeric)])
+
+    def merge_(self, other: "FeatureTransformer") -> "FeatureTransformer":
+        # for partial transformers fitted in other processes; arrays encoded
+        # by other need recode_() before they are used with the merged vocab
+        if not self.same_layout(other):
+            raise ValueError("Cannot merge transformers with different columns")
+        self.stats.merge_(other.stats)
+        for column in self.categorical:
+            self.encode(column, other.vocab[column])
+        return self
+
+    def recode_(self, raw: np.ndarray, source: "FeatureTransformer") -> np.ndarray:
+        # rewrites categorical codes from source's vocabulary into ours
+        offset = len(self.numeric)
+        for j, column in enumerate(self.categorical):
+            mapping = self.encode(column, source.vocab[column], grow=False)
+            if np.array_equal(mapping, np.arange(len(mapping))):
+                continue
+            lookup = np.append(mapping, -1).astype(np.float32)
+            codes = raw[:, offset + j].astype(np.int64)
+            raw[:, offset + j] = lookup[np.where(codes >= 0, codes, -1)]
+        return raw
+
+    def to_dict(self) -> dict:
+        return {
+            "format": FORMAT_VERSION,
+            "numeric": self.numeric,
+            "categorical": self.categorical,
+            "vocab": self.vocab,
+            "stats": self.stats.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "FeatureTransformer":
+        if data.get("format") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported transformer format {data.get('format')}")
+        return cls(
+            list(data["numeric"]),
+            list(data["categorical"]),
+            {column: list(values) for column, values in data["vocab"].items()},
+            RunningStats.from_dict(data["stats"]),
+        )
+
+    def save(self, path: Path) -> None:
+        Path(path).write_text(json.dumps(self.to_dict(), indent=1))
+
+    @classmethod
+    def load(cls, path: Path) -> "FeatureTransformer":
+        return cls.from_dict(json.loads(Path(path).read_text()))
+
+    def module(self) -> "FeatureNormaliser":
+        return FeatureNormaliser(
+            self.stats.mean,
+            self.stats.std,
+            [len(self.vocab[column]) for column in self.categorical],
+        )
+
+
+class FeatureNormaliser(nn.Module):
+    """
+    Raw batch to model input, inside the model so checkpoints carry it.
+
+    Numeric columns are scaled with one fused multiply-add and NaNs become
+    the mean; each categorical code is one-hot encoded, -1 to all zeros.
+    """
+
+    def __init__(self, mean: np.ndarray, std: np.ndarray, vocab_sizes: List[int]):
+        super().__init__()
+        scale = 1.0 / np.asarray(std, dtype=np.float64)
+        shift = -np.asarray(mean, dtype=np.float64) * scale
+        self.register_buffer("scale", torch.tensor(scale, dtype=torch.float32))
+        self.register_buffer("shift", torch.tensor(shift, dtype=torch.float32))
+        self.n_numeric = len(scale)
+        self.vocab_sizes = list(vocab_sizes)
+        self.output_dim = self.n_numeric + sum(self.vocab_sizes)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        numeric = torch.addcmul(self.shift, x[..., :self.n_numeric], self.scale)
+        parts = [torch.nan_to_num(numeric, nan=0.0)]
+        for j, size in enumerate(self.vocab_sizes):
+            if size == 0:
+                continue
+            codes = x[..., self.n_numeric + j].long()
+            # shifted by one so unknown codes land in a dropped column
+            one_hot = F.one_hot((codes + 1).clamp(min=0), size + 1)[..., 1:]
+            parts.append(one_hot.to(x.dtype))
+        return torch.cat(parts, dim=-1)
@@ -0,0 +1,192 @@
+r"""
+Match-level tensors for the win-probability model.
+
+    python match_dataset.py --db_url postgresql://... --store stores/players \
+        --out datasets/matches.npz
+
+Every game becomes x[game, team, position, feature] with blue as team 0,
+red as team 1 and positions in team_position_enum order, and y[game] = 1
+when blue won. A player's features are their player_store embedding and
+decayed game count as they stood when the game started, followed by the
+team_position code, so nothing from the game itself or later ones leaks
+in. The store is replayed from scratch in game order at --store, which
+leaves it current for scoring new lobbies with pregame_features().
+
+The saved transformer holds the layout and the team_position vocabulary;
+match_model.py fits its statistics on the games it trains on, so the held
+out ones don't leak into the scaling.
+"""
+import argparse
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from features import FeatureTransformer
+from player_store import DEFAULT_FEATURES, PlayerStore, update_store
+
+TEAMS: List[str] = ["blue", "red"]
+# team_position_enum order
+POSITIONS: List[str] = ["top", "jungle", "middle", "bottom", "utility"]
+WEIGHT_FEATURE = "games"
+
+
+def _text(value) -> str:
+    # unregistered enums arrive as bytes over binary transfer
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def player_transformer(feature_names: Sequence[str]) -> FeatureTransformer:
+    # raw layout: embedding, decayed game count, team_position code
+    return FeatureTransformer(
+        list(feature_names) + [WEIGHT_FEATURE], ["team_position"]
+    )
+
+
+def pregame_features(
+    store: PlayerStore,
+    puuids: Sequence[str],
+    at: Optional[float] = None,
+) -> np.ndarray:
+    """
+    Raw features [players, d] of players about to play at epoch secs at.
+
+    Same layout as the training tensors, for matchmaking.model_scorer. The
+    team_position code is -1 (unknown) until a role is assigned.
+    """
+    at = time.time() if at is None else at
+    embeddings, weights = store.lookup(puuids, at=at)
+    positions = np.full(len(puuids), -1, dtype=np.float32)
+    return np.column_stack([embeddings, weights, positions])
+
+
+def build_match_tensors(
+    db_url: str,
+    store_path: Path,
+    features: Optional[Dict[str, str]] = None,
+    half_life_days: float = 30.0,
+    transformer: Optional[FeatureTransformer] = None,
+    chunk_rows: int = 50_000,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, FeatureTransformer]:
+    """
+    Replay the player store and collect every game into x [games, 2, 5, d]
+    and y [games].
+
+    Also returns the (platform_name, game_id) and start, in epoch secs, of
+    every game and the transformer, whose vocabulary grows unless one is
+    given; its statistics are left to the caller. Games that don't have
+    exactly one player per team and position (remakes with missing roles)
+    are dropped.
+    """
+    features = DEFAULT_FEATURES if features is None else features
+    grow = transformer is None
+    if grow:
+        transformer = player_transformer(list(features))
+    elif transformer.raw_names != player_transformer(list(features)).raw_names:
+        raise ValueError("Transformer does not match the store features")
+    slot = {
+        (team, position): (t, p)
+        for t, team in enumerate(TEAMS)
+        for p, position in enumerate(POSITIONS)
+    }
+
+    keys: List[Tuple[str, int]] = []
+    labels: List[float] = []
+    starts: List[float] = []
+    parts: List[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]] = []
+
+    def on_chunk(
+        names: List[str],
+        rows: List[tuple],
+        previous: np.ndarray,
+        previous_weight: np.ndarray,
+    ) -> None:
+        index = {name: i for i, name in enumerate(names)}
+        columns = list(zip(*rows))
+        positions = transformer.encode(
+            "team_position", columns[index["team_position"]], grow=grow
+        )
+        raw = np.column_stack([previous, previous_weight, positions])
+
+        # the replay is in game order, so a new key starts a new game
+        n = len(rows)
+        games = np.empty(n, dtype=np.int64)
+        teams = np.empty(n, dtype=np.int64)
+        slots = np.empty(n, dtype=np.int64)
+        for i, row in enumerate(rows):
+            key = (row[index["platform_name"]], row[index["game_id"]])
+            if not keys or keys[-1] != key:
+                keys.append(key)
+                labels.append(np.nan)
+                starts.append(row[index["started"]])
+            games[i] = len(keys) - 1
+            team = _text(row[index["team_id"]])
+            position = _text(row[index["team_position"]])
+            teams[i], slots[i] = slot.get((team, position), (-1, -1))
+            if team == TEAMS[0]:
+                labels[-1] = float(row[index["team_won"]])
+
+        known = teams >= 0
+        parts.append((games[known], teams[known], slots[known], raw[known]))
+
+    update_store(
+        db_url,
+        store_path,
+        features,
+        half_life_days,
+        rebuild=True,
+        chunk_rows=chunk_rows,
+        on_chunk=on_chunk,
+    )
+    if not keys:
+        raise ValueError("No games in the database")
+
+    n_games, dim = len(keys), len(transformer.raw_names)
+    x = np.full((n_games, 2, 5, dim), np.nan, dtype=np.float32)
+    seen = np.zeros((n_games, 2, 5), dtype=np.int16)
+    for g, t, p, raw in parts:
+        x[g, t, p] = raw
+        np.add.at(seen, (g, t, p), 1)
+    y = np.array(labels, dtype=np.float32)
+    started = np.array(starts, dtype=np.float64)
+
+    # exactly one player per slot, duplicates or gaps drop the game
+    complete = (seen == 1).all(axis=(1, 2)) & ~np.isnan(y)
+    game_keys = np.array(keys, dtype=object).reshape(-1, 2)[complete]
+    return x[complete], y[complete], game_keys, started[complete], transformer
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--db_url", required=True)
+    parser.add_argument("--store", required=True, type=Path, help="replayed")
+    parser.add_argument("--out", required=True, type=Path)
+    parser.add_argument("--half_life_days", type=float, default=30.0)
+    parser.add_argument("--chunk_rows", type=int, default=50_000)
+    args = parser.parse_args()
+
+    x, y, keys, started, transformer = build_match_tensors(
+        args.db_url,
+        args.store,
+        half_life_days=args.half_life_days,
+        chunk_rows=args.chunk_rows,
+    )
+    args.out.parent.mkdir(parents=True, exist_ok=True)
+    np.savez(
+        args.out,
+        x=x,
+        y=y,
+        platforms=keys[:, 0].astype(str),
+        games=keys[:, 1].astype(np.int64),
+        started=started,
+    )
+    transformer.save(args.out.with_suffix(".transformer.json"))
+    print(f"Wrote {len(y)} games with {x.shape[-1]} raw features to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
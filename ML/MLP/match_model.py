@@ -0,0 +1,181 @@
+"""
+Pre-game win probability for a whole lobby.
+
+    python match_model.py --data datasets/matches.npz
+
+The model takes x [batch, 2 teams, 5 players, d] of raw player features
+(see match_dataset.py) and returns the logit of team 0 winning. Each team
+is encoded with a DeepSets encoder, so player order within a team does
+not matter, and the head is antisymmetric: swapping the teams negates the
+logit, so p(blue) + p(red) = 1 exactly.
+"""
+import argparse
+from pathlib import Path
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torchmetrics
+
+import pytorch_lightning as pl
+from pytorch_lightning.loggers import MLFlowLogger
+
+from batching import TensorBatchLoader
+from features import FeatureTransformer
+
+
+class TeamEncoder(nn.Module):
+    # DeepSets: phi per player, permutation invariant pooling, then rho
+    def __init__(self, input_dim: int, hidden_dim: int, team_dim: int):
+        super().__init__()
+        self.phi = nn.Sequential(
+            nn.Linear(input_dim, hidden_dim),
+            nn.ReLU(),
+            nn.Linear(hidden_dim, hidden_dim),
+            nn.ReLU(),
+        )
+        self.rho = nn.Sequential(
+            nn.Linear(2 * hidden_dim, team_dim),
+            nn.ReLU(),
+            nn.Linear(team_dim, team_dim),
+        )
+
+    def forward(self, players: torch.Tensor) -> torch.Tensor:
+        # [..., players, d] -> [..., team_dim]
+        h = self.phi(players)
+        pooled = torch.cat([h.mean(dim=-2), h.amax(dim=-2)], dim=-1)
+        return self.rho(pooled)
+
+
+class MatchWinModel(pl.LightningModule):
+    def __init__(
+        self,
+        transformer: dict,
+        hidden_dim: int = 128,
+        team_dim: int = 64,
+        lr: float = 1e-3,
+    ):
+        super().__init__()
+        # the transformer state is a hyperparameter, so a checkpoint alone
+        # rebuilds the preprocessing used in training
+        self.save_hyperparameters()
+
+        self.normaliser = FeatureTransformer.from_dict(transformer).module()
+        self.encoder = TeamEncoder(self.normaliser.output_dim, hidden_dim, team_dim)
+        self.head = nn.Sequential(
+            nn.Linear(2 * team_dim, hidden_dim),
+            nn.ReLU(),
+            nn.Linear(hidden_dim, 1),
+        )
+
+        self.loss_fn = nn.BCEWithLogitsLoss()
+        self.train_acc = torchmetrics.classification.BinaryAccuracy()
+        self.val_acc = torchmetrics.classification.BinaryAccuracy()
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        # x [batch, 2, 5, raw d] -> logit of team 0 winning, [batch]
+        teams = self.encoder(self.normaliser(x))
+        ours, theirs = teams[:, 0], teams[:, 1]
+        direct = self.head(torch.cat([ours, theirs], dim=-1))
+        swapped = self.head(torch.cat([theirs, ours], dim=-1))
+        return (direct - swapped).squeeze(-1)
+
+    @torch.inference_mode()
+    def predict_proba(self, x: torch.Tensor, batch_size: int = 65_536) -> torch.Tensor:
+        """
+        p(team 0 wins) for every lobby in x, e.g. all candidate splits.
+
+        Runs as few forward passes as batch_size allows, on the model's
+        device, and returns probabilities on the CPU.
+        """
+        self.eval()
+        out = []
+        for start in range(0, len(x), batch_size):
+            chunk = x[start:start + batch_size].to(self.device, non_blocking=True)
+            out.append(torch.sigmoid(self(chunk)).cpu())
+        return torch.cat(out) if out else torch.empty(0)
+
+    def _step(self, batch, stage: str):
+        x, y = batch
+        logits = self(x)
+        loss = self.loss_fn(logits, y)
+        acc_metric = self.train_acc if stage == "train" else self.val_acc
+        acc_metric.update(torch.sigmoid(logits), y.long())
+        self.log(f"{stage}_loss", loss, prog_bar=True, on_epoch=True, on_step=False)
+        return loss
+
+    def training_step(self, batch, batch_idx):
+        return self._step(batch, "train")
+
+    def on_train_epoch_end(self):
+        self.log("train_acc", self.train_acc.compute(), prog_bar=True)
+        self.train_acc.reset()
+
+    def validation_step(self, batch, batch_idx):
+        self._step(batch, "val")
+
+    def on_validation_epoch_end(self):
+        self.log("val_acc", self.val_acc.compute(), prog_bar=True)
+        self.val_acc.reset()
+
+    def configure_optimizers(self):
+        return torch.optim.Adam(self.parameters(), lr=self.hparams.lr)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        "--data", required=True, type=Path, help="match_dataset.py output"
+    )
+    parser.add_argument("--val_fraction", type=float, default=0.1)
+    parser.add_argument("--batch_size", type=int, default=512)
+    parser.add_argument("--epochs", type=int, default=20)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--mlruns", default="./mlruns", help="MLflow tracking URI")
+    args = parser.parse_args()
+
+    data = np.load(args.data)
+    layout = FeatureTransformer.load(args.data.with_suffix(".transformer.json"))
+    x = torch.from_numpy(data["x"])
+    y = torch.from_numpy(data["y"])
+
+    # the games that started last are held out; game_ids only order games
+    # within a platform
+    order = torch.from_numpy(np.argsort(data["started"], kind="stable"))
+    n_val = int(len(order) * args.val_fraction)
+    train_idx, val_idx = order[: len(order) - n_val], order[len(order) - n_val:]
+
+    # statistics from the training games only
+    transformer = layout.empty_like()
+    transformer.update(data["x"][train_idx.numpy()].reshape(-1, x.shape[-1]))
+
+    train_loader = TensorBatchLoader(
+        (x[train_idx], y[train_idx]),
+        batch_size=args.batch_size,
+        shuffle=True,
+        prefetch=True,
+    )
+    val_loader = TensorBatchLoader((x[val_idx], y[val_idx]), batch_size=args.batch_size)
+
+    model = MatchWinModel(transformer=transformer.to_dict(), lr=args.lr)
+    mlf_logger = MLFlowLogger(
+        experiment_name="LoLMatchmaking",
+        tracking_uri=f"file:{args.mlruns}",
+    )
+    trainer = pl.Trainer(
+        max_epochs=args.epochs,
+        logger=mlf_logger,
+        log_every_n_steps=50,
+        accelerator="auto",
+    )
+    trainer.fit(model, train_loader, val_loader)
+    mlf_logger.experiment.log_dict(
+        mlf_logger.run_id, transformer.to_dict(), "feature_transformer.json"
+    )
+
+
+if __name__ == "__main__":
+    main()
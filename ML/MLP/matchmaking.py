@@ -0,0 +1,290 @@
+"""
+Balanced 5v5 lobbies from a pool of players.
+
+A scorer maps lobbies, int arrays [n, 2, 5] of indices into the pool, to
+p(team 0 wins), and is told whether the slots are in POSITIONS order;
+rating_scorer uses the TrueSkill ratings and model_scorer a trained
+MatchWinModel. Matchmaker looks for the lobby with
+p closest to 0.5: for ten players it scores all 126 splits in one call (and
+many lobbies at once with best_splits), for larger pools it runs a batched
+local search within a time budget.
+
+Given per-player role costs (from role history), every candidate team is
+also assigned top, jungle, middle, bottom and utility, solved exactly over
+all 120 assignments for every team at once, and the lobby cost adds the
+role fit to the fairness. Teams are then returned in position order.
+"""
+import time
+from dataclasses import dataclass
+from itertools import combinations, permutations
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import psycopg
+import torch
+
+from features import FeatureTransformer
+from match_dataset import POSITIONS
+from ratings import TEAM_SIZE, RatingConfig, norm_cdf
+from streaming import conninfo_from_url
+
+LOBBY_SIZE = 2 * TEAM_SIZE
+
+# (lobbies, assigned_roles) -> p(team 0 wins)
+Scorer = Callable[[np.ndarray, bool], np.ndarray]
+
+
+def rating_scorer(
+    mu: np.ndarray,
+    sigma: np.ndarray,
+    beta: float = RatingConfig.beta,
+) -> Scorer:
+    mu = np.asarray(mu, dtype=np.float64)
+    sigma2 = np.asarray(sigma, dtype=np.float64) ** 2
+
+    def score(lobbies: np.ndarray, assigned_roles: bool = False) -> np.ndarray:
+        # ratings don't depend on roles
+        team_mu = mu[lobbies].sum(axis=-1)
+        c = np.sqrt(sigma2[lobbies].sum(axis=(-2, -1)) + LOBBY_SIZE * beta ** 2)
+        return norm_cdf((team_mu[:, 0] - team_mu[:, 1]) / c)
+
+    return score
+
+
+def model_scorer(
+    model,
+    players: np.ndarray,
+    transformer: Optional[FeatureTransformer] = None,
+    batch_size: int = 65_536,
+) -> Scorer:
+    # players [pool, d] raw features from match_dataset.pregame_features,
+    # gathered into [n, 2, 5, d] per call
+    features = torch.as_tensor(players, dtype=torch.float32)
+    position_column = None
+    if transformer is not None and "team_position" in transformer.categorical:
+        # with assigned roles each slot's team_position code is set to the
+        # role it plays; otherwise slot order means nothing and the codes
+        # are left as given
+        position_column = transformer.raw_names.index("team_position")
+        codes = transformer.encode("team_position", POSITIONS, grow=False)
+        position_codes = torch.from_numpy(codes)
+
+    def score(lobbies: np.ndarray, assigned_roles: bool = False) -> np.ndarray:
+        x = features[torch.from_numpy(lobbies)]
+        if assigned_roles and position_column is not None:
+            x[..., position_column] = position_codes
+        return model.predict_proba(x, batch_size=batch_size).numpy()
+
+    return score
+
+
+ROLE_PERMUTATIONS = np.array(list(permutations(range(TEAM_SIZE))), dtype=np.int64)
+# [25, 120] indicator of (player, role) cells in each assignment, so all
+# assignment totals are one matrix product
+_ASSIGNMENT_CELLS = np.zeros(
+    (TEAM_SIZE * TEAM_SIZE, len(ROLE_PERMUTATIONS)), dtype=np.float32
+)
+for _k, _roles in enumerate(ROLE_PERMUTATIONS):
+    _ASSIGNMENT_CELLS[np.arange(TEAM_SIZE) * TEAM_SIZE + _roles, _k] = 1
+
+ROLE_COUNTS_SQL = """
+    SELECT puuid, team_position, count(*)
+    FROM match_participants
+    WHERE puuid = ANY(%s)
+    GROUP BY puuid, team_position
+"""
+
+
+def load_role_counts(db_url: str, puuids: Sequence[str]) -> np.ndarray:
+    """Games per position for every player, [players, 5] in POSITIONS order."""
+    row_of = {puuid: i for i, puuid in enumerate(puuids)}
+    column_of = {position: j for j, position in enumerate(POSITIONS)}
+    counts = np.zeros((len(puuids), TEAM_SIZE), dtype=np.float64)
+    with psycopg.connect(conninfo_from_url(db_url)) as conn:
+        for puuid, position, count in conn.execute(ROLE_COUNTS_SQL, (list(puuids),)):
+            counts[row_of[puuid], column_of[position]] = count
+    return counts
+
+
+def role_costs(counts: np.ndarray, prior: float = 1.0) -> np.ndarray:
+    # -log of each player's smoothed share of games in a role, so a main
+    # role costs ~0 and a role never played costs the most
+    counts = np.asarray(counts, dtype=np.float64)
+    shares = (counts + prior) / (counts.sum(axis=1, keepdims=True) + TEAM_SIZE * prior)
+    return -np.log(shares).astype(np.float32)
+
+
+def assign_roles(
+    costs: np.ndarray,
+    teams: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Cheapest role assignment for every team in teams [n, 5] at once.
+
+    costs is [pool, 5]. Five players and five roles leave 120 assignments,
+    so all of them are totalled with one matrix product and the exact
+    optimum picked, which is faster than a per-team Hungarian solve at
+    this size. Returns the teams reordered so slot r plays POSITIONS[r],
+    and their costs.
+    """
+    team_costs = costs[teams].reshape(len(teams), TEAM_SIZE * TEAM_SIZE)
+    # [n, 120]: player i takes role ROLE_PERMUTATIONS[k, i]
+    totals = team_costs @ _ASSIGNMENT_CELLS
+    best = np.argmin(totals, axis=1)
+    players_by_role = np.argsort(ROLE_PERMUTATIONS[best], axis=1)
+    ordered = np.take_along_axis(teams, players_by_role, axis=1)
+    return ordered, totals[np.arange(len(teams)), best]
+
+
+def team_splits() -> np.ndarray:
+    """
+    All 126 ways to split ten players into two teams of five, [126, 2, 5].
+
+    Player 0 always plays on team 0, so mirrored splits appear once.
+    """
+    splits = []
+    for rest in combinations(range(1, LOBBY_SIZE), TEAM_SIZE - 1):
+        first = (0,) + rest
+        second = tuple(i for i in range(LOBBY_SIZE) if i not in first)
+        splits.append((first, second))
+    return np.array(splits, dtype=np.int64)
+
+
+SPLITS = team_splits()
+
+
+def _swap_moves(pool_size: int) -> np.ndarray:
+    # [moves, 10]: the lobby slots of a pool permutation after swapping two
+    # positions, either across the teams or a lobby slot with the bench
+    pairs = [(a, b) for a in range(TEAM_SIZE) for b in range(TEAM_SIZE, LOBBY_SIZE)]
+    pairs += [(a, b) for a in range(LOBBY_SIZE) for b in range(LOBBY_SIZE, pool_size)]
+    moves = np.tile(np.arange(pool_size), (len(pairs), 1))
+    for k, (a, b) in enumerate(pairs):
+        moves[k, a], moves[k, b] = b, a
+    return moves
+
+
+@dataclass
+class Lobby:
+    # pool indices, teams[0] and teams[1]; in POSITIONS order with roles
+    teams: np.ndarray
+    p_first: float
+    cost: float
+    evaluated: int
+    role_cost: float = 0.0
+
+
+class Matchmaker:
+    def __init__(
+        self,
+        score: Scorer,
+        role_costs: Optional[np.ndarray] = None,
+        role_weight: float = 0.05,
+    ):
+        self.score = score
+        # [pool, 5], see role_costs(); None leaves roles unassigned
+        self.role_costs = role_costs
+        self.role_weight = role_weight
+
+    def cost(
+        self, lobbies: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Cost, p(team 0 wins), role cost and role-ordered lobbies."""
+        if self.role_costs is None:
+            p = self.score(lobbies, assigned_roles=False)
+            return np.abs(p - 0.5), p, np.zeros(len(p), dtype=np.float32), lobbies
+
+        ordered, fit = assign_roles(self.role_costs, lobbies.reshape(-1, TEAM_SIZE))
+        ordered = ordered.reshape(lobbies.shape)
+        fit = fit.reshape(-1, 2).sum(axis=1) / (2 * TEAM_SIZE)
+        p = self.score(ordered, assigned_roles=True)
+        return np.abs(p - 0.5) + self.role_weight * fit, p, fit, ordered
+
+    def _lobby(self, scored: tuple, i, evaluated: int) -> Lobby:
+        cost, p, fit, lobbies = scored
+        return Lobby(
+            lobbies[i].copy(), float(p[i]), float(cost[i]), evaluated, float(fit[i])
+        )
+
+    def best_split(self, players: Optional[np.ndarray] = None) -> Lobby:
+        """Best of all 126 splits of ten pool players, pool 0-9 by default."""
+        players = np.arange(LOBBY_SIZE) if players is None else np.asarray(players)
+        if len(players) != LOBBY_SIZE:
+            raise ValueError(f"A lobby needs exactly {LOBBY_SIZE} players")
+        scored = self.cost(players[SPLITS])
+        return self._lobby(scored, int(np.argmin(scored[0])), len(SPLITS))
+
+    def best_splits(self, players: np.ndarray) -> List[Lobby]:
+        """best_split for many lobbies [lobbies, 10], scored in one call."""
+        players = np.asarray(players)
+        scored = self.cost(players[:, SPLITS].reshape(-1, 2, TEAM_SIZE))
+        best = np.argmin(scored[0].reshape(len(players), -1), axis=1)
+        flat = np.arange(len(players)) * len(SPLITS) + best
+        return [self._lobby(scored, i, len(SPLITS)) for i in flat]
+
+    def search(
+        self,
+        pool_size: int,
+        budget: float = 0.05,
+        restarts: int = 8,
+        tolerance: float = 1e-3,
+        seed: Optional[int] = None,
+    ) -> Lobby:
+        """
+        Best lobby of ten from a larger pool within budget seconds.
+
+        Every restart is a permutation of the pool whose first ten players
+        form the lobby. Each step scores all single swaps of every restart
+        in one call and takes the best improving one; restarts stuck in a
+        local optimum are reshuffled. It stops early once the best lobby's p
+        is within tolerance of 0.5, whatever its role cost.
+        """
+        if pool_size == LOBBY_SIZE:
+            return self.best_split()
+        if pool_size < LOBBY_SIZE:
+            raise ValueError(f"A lobby needs {LOBBY_SIZE} players")
+
+        deadline = time.monotonic() + budget
+        rng = np.random.default_rng(seed)
+        moves = _swap_moves(pool_size)
+        lobby_moves = moves[:, :LOBBY_SIZE]
+
+        perms = np.argsort(rng.random((restarts, pool_size)), axis=1)
+        scored = self.cost(perms[:, :LOBBY_SIZE].reshape(-1, 2, TEAM_SIZE))
+        cost = scored[0]
+        evaluated = restarts
+        best_lobby = self._lobby(scored, int(np.argmin(cost)), 0)
+
+        # cost includes the role fit, which rarely gets near zero
+        while (
+            abs(best_lobby.p_first - 0.5) > tolerance
+            and time.monotonic() < deadline
+        ):
+            # [restarts, moves, 10], scored as one flat batch
+            neighbours = perms[:, lobby_moves]
+            scored = self.cost(neighbours.reshape(-1, 2, TEAM_SIZE))
+            n_cost = scored[0].reshape(restarts, -1)
+            evaluated += n_cost.size
+
+            step = np.argmin(n_cost, axis=1)
+            step_cost = n_cost[np.arange(restarts), step]
+            improved = step_cost < cost
+            rows = np.flatnonzero(improved)
+            perms[rows] = np.take_along_axis(perms[rows], moves[step[rows]], axis=1)
+            cost[rows] = step_cost[rows]
+
+            r = int(np.argmin(step_cost))
+            if step_cost[r] < best_lobby.cost:
+                best_lobby = self._lobby(scored, r * n_cost.shape[1] + step[r], 0)
+
+            stuck = np.flatnonzero(~improved)
+            if len(stuck):
+                perms[stuck] = np.argsort(rng.random((len(stuck), pool_size)), axis=1)
+                cost[stuck] = self.cost(
+                    perms[stuck, :LOBBY_SIZE].reshape(-1, 2, TEAM_SIZE)
+                )[0]
+                evaluated += len(stuck)
+
+        best_lobby.evaluated = evaluated
+        return best_lobby
+
@@ -0,0 +1,480 @@
+"""
+Per-player embeddings kept up to date from the match database.
+
+    python player_store.py --db_url postgresql://... --path stores/players
+
+A player's embedding is the exponentially decayed mean of their per-game
+features, with a half-life in days of game time, plus the decayed game
+count as its weight.
+
+The first run folds in every stored game in start time order. Later runs
+page through matches.ingested_at, so games the collector backfills for a
+player's older history are folded in as well: the decayed mean does not
+depend on the order of the games, so a game older than the player's latest
+one is weighted by its age instead of decaying the rest. Matches ingested
+in the last few minutes are left for the next run, so writers that have
+not committed yet are not skipped.
+
+The store is a directory of flat files, memory-mapped on open:
+
+    ids.bin            puuids, fixed-width bytes, one per row
+    embeddings.f32     [capacity, d] decayed feature means
+    weights.f32        [capacity] decayed game counts
+    last_seen.f64      [capacity] start of the player's latest game, epoch secs
+    last_ingested.f64  [capacity] latest ingested_at of the player's games
+    meta.json          features, half-life, row count, cursor
+
+Updates are idempotent: a game that is neither newer than the player's
+latest game nor ingested after their latest ingested one has been folded
+in already, so rerunning an interrupted update doesn't count it twice.
+"""
+import argparse
+import json
+import os
+import shutil
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import psycopg
+
+from streaming import conninfo_from_url, stream_rows
+
+FORMAT_VERSION = 2
+# riot puuids are always 78 characters
+PUUID_BYTES = 78
+DAY_SECONDS = 86_400.0
+# inserts still in flight when a run starts are older than this
+SETTLE = timedelta(minutes=10)
+
+# name -> SQL expression over the aliases in UPDATE_QUERY
+DEFAULT_FEATURES: Dict[str, str] = {
+    "win": "t.win::int",
+    "kills": "ps.kills",
+    "deaths": "ps.deaths",
+    "assists": "ps.assists",
+    "kda": "pc.kda",
+    "kill_participation": "pc.kill_participation",
+    "damage_per_minute": "pc.damage_per_minute",
+    "gold_per_minute": "pc.gold_per_minute",
+    "vision_score_per_minute": "pc.vision_score_per_minute",
+    "team_damage_pct": "pc.team_damage_pct",
+    "cs_per_minute": (
+        "(ps.total_minions_killed + ps.neutral_minions_killed)"
+        " * 60.0 / greatest(m.game_duration, 1)"
+    ),
+}
+
+UPDATE_QUERY = """
+    SELECT
+        mp.platform_name, mp.game_id, mp.puuid,
+        mp.team_id, mp.team_position, t.win AS team_won,
+        m.game_start_timestamp, m.ingested_at,
+        extract(epoch FROM m.game_start_timestamp)::float8 AS started,
+        extract(epoch FROM m.ingested_at)::float8 AS ingested,
+        {features}
+    FROM match_participants mp
+    JOIN matches m
+        ON m.platform_name = mp.platform_name AND m.game_id = mp.game_id
+    JOIN teams t
+        ON t.platform_name = mp.platform_name AND t.game_id = mp.game_id
+        AND t.team_id = mp.team_id
+    JOIN participant_stats ps
+        ON ps.platform_name = mp.platform_name AND ps.game_id = mp.game_id
+        AND ps.participant_id = mp.participant_id
+    JOIN participant_challenges pc
+        ON pc.platform_name = mp.platform_name AND pc.game_id = mp.game_id
+        AND pc.participant_id = mp.participant_id
+    WHERE m.ingested_at < %(until)s
+        AND (
+            %(after)s::timestamptz IS NULL
+            OR ({order})
+                > (%(after)s::timestamptz, %(platform)s::text, %(game_id)s::bigint)
+        )
+    ORDER BY {order}
+"""
+# the first run replays in game order, later ones page by ingestion
+BUILD_ORDER = "m.game_start_timestamp, m.platform_name, m.game_id"
+INGEST_ORDER = "m.ingested_at, m.platform_name, m.game_id"
+
+
+def _occurrence_rank(rows: np.ndarray) -> np.ndarray:
+    # 0 for a player's first row in the chunk, 1 for the second, ...
+    order = np.argsort(rows, kind="stable")
+    sorted_rows = rows[order]
+    starts = np.r_[True, sorted_rows[1:] != sorted_rows[:-1]]
+    positions = np.arange(len(rows))
+    group_start = np.maximum.accumulate(np.where(starts, positions, 0))
+    rank = np.empty(len(rows), dtype=np.int64)
+    rank[order] = positions - group_start
+    return rank
+
+
+class PlayerIndex:
+    # sorted copy of the ids, so a batch of lookups is one searchsorted
+    def __init__(self, ids: np.ndarray):
+        self.order = np.argsort(ids, kind="stable")
+        self.sorted_ids = np.asarray(ids)[self.order]
+
+    def __len__(self) -> int:
+        return len(self.sorted_ids)
+
+    def rows_for(self, keys: np.ndarray) -> np.ndarray:
+        if len(self.sorted_ids) == 0:
+            return np.full(len(keys), -1, dtype=np.int64)
+        pos = np.searchsorted(self.sorted_ids, keys)
+        pos = np.minimum(pos, len(self.sorted_ids) - 1)
+        found = self.sorted_ids[pos] == keys
+        return np.where(found, self.order[pos], -1).astype(np.int64)
+
+    def add(self, keys: np.ndarray, rows: np.ndarray) -> None:
+        # keys are sorted, so they merge in without a full sort
+        at = np.searchsorted(self.sorted_ids, keys)
+        self.sorted_ids = np.insert(self.sorted_ids, at, keys)
+        self.order = np.insert(self.order, at, rows)
+
+
+def puuid_keys(puuids: Sequence[str]) -> np.ndarray:
+    return np.asarray(puuids, dtype=f"S{PUUID_BYTES}")
+
+
+# file -> bytes per row; embeddings depend on the feature count
+DATA_FILES = {
+    "ids.bin": PUUID_BYTES,
+    "embeddings.f32": 0,
+    "weights.f32": 4,
+    "last_seen.f64": 8,
+    "last_ingested.f64": 8,
+}
+
+
+class PlayerStore:
+    def __init__(self, path: Path, writable: bool = False):
+        self.path = Path(path)
+        self.writable = writable
+        self.meta = json.loads((self.path / "meta.json").read_text())
+        if self.meta["format"] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported store format {self.meta['format']}")
+        self._map()
+        self.index = PlayerIndex(self.ids[: len(self)])
+
+    @classmethod
+    def create(
+        cls,
+        path: Path,
+        features: Dict[str, str],
+        half_life_days: float,
+    ) -> "PlayerStore":
+        path = Path(path)
+        path.mkdir(parents=True)
+        for name in DATA_FILES:
+            (path / name).touch()
+        meta = {
+            "format": FORMAT_VERSION,
+            "features": features,
+            "half_life_days": half_life_days,
+            "rows": 0,
+            "capacity": 0,
+            "cursor": None,
+            "updated": None,
+        }
+        (path / "meta.json").write_text(json.dumps(meta, indent=1))
+        return cls(path, writable=True)
+
+    @property
+    def feature_names(self) -> List[str]:
+        return list(self.meta["features"])
+
+    @property
+    def dim(self) -> int:
+        return len(self.meta["features"])
+
+    def __len__(self) -> int:
+        return self.meta["rows"]
+
+    def _map(self) -> None:
+        capacity = self.meta["capacity"]
+        mode = "r+" if self.writable else "r"
+
+        def memmap(name: str, dtype, shape) -> np.ndarray:
+            if capacity == 0:
+                return np.empty(shape, dtype=dtype)
+            return np.memmap(self.path / name, dtype=dtype, mode=mode, shape=shape)
+
+        self.ids = memmap("ids.bin", f"S{PUUID_BYTES}", (capacity,))
+        self.embeddings = memmap("embeddings.f32", np.float32, (capacity, self.dim))
+        self.weights = memmap("weights.f32", np.float32, (capacity,))
+        self.last_seen = memmap("last_seen.f64", np.float64, (capacity,))
+        self.last_ingested = memmap("last_ingested.f64", np.float64, (capacity,))
+
+    def rows_for(self, puuids: Sequence[str]) -> np.ndarray:
+        """Store rows of the given players, -1 for players not in the store."""
+        return self.index.rows_for(puuid_keys(puuids))
+
+    def lookup(
+        self,
+        puuids: Sequence[str],
+        at: Optional[float] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Embeddings and weights of the given players, in order.
+
+        Unknown players get NaN embeddings, which the feature transformer
+        imputes with the mean, and weight 0. With at, in epoch secs, the
+        weights are decayed to that time, as update reports them before a
+        game starting then.
+        """
+        rows = self.rows_for(puuids)
+        known = rows >= 0
+        embeddings = np.full((len(rows), self.dim), np.nan, dtype=np.float32)
+        weights = np.zeros(len(rows), dtype=np.float32)
+        embeddings[known] = self.embeddings[rows[known]]
+        weights[known] = self.weights[rows[known]]
+        if at is not None:
+            half_life = self.meta["half_life_days"] * DAY_SECONDS
+            age = np.maximum(at - self.last_seen[rows[known]], 0) / half_life
+            weights[known] *= np.exp2(-age).astype(np.float32)
+        return embeddings, weights
+
+    def _append(self, keys: np.ndarray) -> np.ndarray:
+        rows = len(self)
+        needed = rows + len(keys)
+        if needed > self.meta["capacity"]:
+            self.flush()
+            capacity = max(needed, 2 * self.meta["capacity"], 1024)
+            sizes = dict(DATA_FILES, **{"embeddings.f32": 4 * self.dim})
+            for name, row_bytes in sizes.items():
+                with open(self.path / name, "r+b") as f:
+                    f.truncate(capacity * row_bytes)
+            self.meta["capacity"] = capacity
+            self._map()
+
+        new_rows = np.arange(rows, needed)
+        self.ids[new_rows] = keys
+        self.embeddings[new_rows] = 0
+        self.weights[new_rows] = 0
+        self.last_seen[new_rows] = -np.inf
+        self.last_ingested[new_rows] = -np.inf
+        self.meta["rows"] = needed
+        self.index.add(keys, new_rows)
+        return new_rows
+
+    def update(
+        self,
+        puuids: Sequence[str],
+        started: np.ndarray,
+        ingested: np.ndarray,
+        features: np.ndarray,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Fold one chunk of games into the store.
+
+        Returns every row's embedding and weight as they were before that
+        game, which is what a pre-game model may see, the weight decayed to
+        the game's start. A player's first game has a NaN embedding and
+        weight 0; games older than one already folded in get NaN for both,
+        as their pre-game state is no longer known.
+        """
+        if not self.writable:
+            raise RuntimeError("Store was opened read-only")
+        keys = puuid_keys(puuids)
+        rows = self.index.rows_for(keys)
+        missing = rows < 0
+        if missing.any():
+            new_keys = np.unique(keys[missing])
+            new_rows = self._append(new_keys)
+            rows[missing] = new_rows[np.searchsorted(new_keys, keys[missing])]
+
+        half_life = self.meta["half_life_days"] * DAY_SECONDS
+        previous = np.full(features.shape, np.nan, dtype=np.float32)
+        previous_weight = np.full(len(rows), np.nan, dtype=np.float32)
+        # a player appears at most once per wave, so each wave is one
+        # vectorised update and later games see the earlier ones
+        rank = _occurrence_rank(rows)
+        for wave in range(int(rank.max(initial=-1)) + 1):
+            sel = np.flatnonzero(rank == wave)
+            r = rows[sel]
+            # anything else was folded in by an earlier, interrupted run
+            fresh = (started[sel] > self.last_seen[r]) | (
+                ingested[sel] > self.last_ingested[r]
+            )
+            sel, r = sel[fresh], r[fresh]
+            weight = self.weights[r]
+            embedding = self.embeddings[r]
+            newest = started[sel] > self.last_seen[r]
+            seen = newest & (weight > 0)
+            previous[sel[seen]] = embedding[seen]
+
+            # the mean is taken at the newest game: a newer game decays the
+            # old weight, an older game is itself decayed by its age
+            age = (started[sel] - self.last_seen[r]) / half_life
+            weight = np.where(newest, weight * np.exp2(-np.maximum(age, 0)), weight)
+            previous_weight[sel[newest]] = weight[newest]
+            game_weight = np.where(newest, 1.0, np.exp2(np.minimum(age, 0)))
+            new_weight = weight + game_weight
+            # decayed running mean, a missing feature keeps its old value
+            values = features[sel]
+            values = np.where(np.isnan(values), embedding, values)
+            step = (game_weight / new_weight)[:, None]
+            embedding += step.astype(np.float32) * (values - embedding)
+
+            self.embeddings[r] = embedding
+            self.weights[r] = new_weight
+            self.last_seen[r] = np.maximum(self.last_seen[r], started[sel])
+            self.last_ingested[r] = np.maximum(self.last_ingested[r], ingested[sel])
+        return previous, previous_weight
+
+    def flush(self) -> None:
+        for array in (
+            self.ids,
+            self.embeddings,
+            self.weights,
+            self.last_seen,
+            self.last_ingested,
+        ):
+            if isinstance(array, np.memmap):
+                array.flush()
+
+    def commit(self, cursor: dict) -> None:
+        # readers trust meta.json, so it only moves once the data is on disk
+        self.flush()
+        self.meta["cursor"] = cursor
+        self.meta["updated"] = datetime.now().isoformat()
+        partial = self.path / "meta.json.tmp"
+        partial.write_text(json.dumps(self.meta, indent=1))
+        os.replace(partial, self.path / "meta.json")
+
+
+def open_store(path: Path) -> PlayerStore:
+    return PlayerStore(path, writable=False)
+
+
+def _position(row: tuple, index: Dict[str, int], order_column: str) -> dict:
+    # cursor after the row's game in the order the current phase reads in
+    return {
+        "at": row[index[order_column]].isoformat(),
+        "platform_name": row[index["platform_name"]],
+        "game_id": row[index["game_id"]],
+    }
+
+
+def update_store(
+    db_url: str,
+    path: Path,
+    features: Optional[Dict[str, str]] = None,
+    half_life_days: float = 30.0,
+    rebuild: bool = False,
+    chunk_rows: int = 50_000,
+    on_chunk: Optional[
+        Callable[[List[str], List[tuple], np.ndarray, np.ndarray], None]
+    ] = None,
+) -> PlayerStore:
+    """
+    Create or extend the store at path with the games ingested since its cursor.
+
+    on_chunk, if given, is called with each chunk's column names and rows
+    and the players' pre-game embeddings and weights for those rows (see
+    PlayerStore.update), e.g. to write training data.
+    """
+    path = Path(path)
+    features = DEFAULT_FEATURES if features is None else features
+    if rebuild and (path / "meta.json").exists():
+        shutil.rmtree(path)
+    if (path / "meta.json").exists():
+        store = PlayerStore(path, writable=True)
+        if (
+            store.meta["features"] != features
+            or store.meta["half_life_days"] != half_life_days
+        ):
+            raise ValueError("Store was built with other settings, use rebuild")
+    else:
+        store = PlayerStore.create(path, features, half_life_days)
+
+    select = ",\n        ".join(f"{sql} AS {name}" for name, sql in features.items())
+    added = 0
+    with psycopg.connect(conninfo_from_url(db_url)) as conn:
+        conn.isolation_level = psycopg.IsolationLevel.REPEATABLE_READ
+        cursor = store.meta["cursor"]
+        if cursor is None:
+            until = conn.execute("SELECT now() - %s", (SETTLE,)).fetchone()[0]
+            cursor = {"phase": "build", "until": until.isoformat(), "after": None}
+        if cursor["phase"] == "build":
+            order, order_column = BUILD_ORDER, "game_start_timestamp"
+            until = datetime.fromisoformat(cursor["until"])
+        else:
+            order, order_column = INGEST_ORDER, "ingested_at"
+            until = conn.execute("SELECT now() - %s", (SETTLE,)).fetchone()[0]
+
+        after = cursor["after"]
+        params = {
+            "until": until,
+            "after": datetime.fromisoformat(after["at"]) if after else None,
+            "platform": after["platform_name"] if after else None,
+            "game_id": after["game_id"] if after else None,
+        }
+        query = UPDATE_QUERY.format(features=select, order=order)
+        last = None
+        for names, rows in stream_rows(conn, query, params, chunk_rows):
+            columns = list(zip(*rows))
+            index = {name: i for i, name in enumerate(names)}
+            values = np.column_stack([
+                np.array(columns[index[name]], dtype=np.float32)
+                for name in features
+            ])
+            started = np.array(columns[index["started"]], dtype=np.float64)
+            ingested = np.array(columns[index["ingested"]], dtype=np.float64)
+            previous, previous_weight = store.update(
+                columns[index["puuid"]], started, ingested, values
+            )
+            if on_chunk is not None:
+                on_chunk(names, rows, previous, previous_weight)
+
+            # the last game may continue in the next chunk, so the cursor
+            # stops before it; rereading its folded rows is a no-op
+            last = rows[-1]
+            game = index["platform_name"], index["game_id"]
+            for row in reversed(rows):
+                if (row[game[0]], row[game[1]]) != (last[game[0]], last[game[1]]):
+                    cursor["after"] = _position(row, index, order_column)
+                    break
+            store.commit(cursor)
+            added += len(rows)
+
+        if last is not None:
+            cursor["after"] = _position(last, index, order_column)
+        if cursor["phase"] == "build":
+            # from here on, page by ingestion from where the build stopped
+            cursor = {
+                "phase": "ingest",
+                "after": {"at": until.isoformat(), "platform_name": "", "game_id": -1},
+            }
+        store.commit(cursor)
+
+    print(f"Folded {added} player games into {path}, {len(store)} players")
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--db_url", required=True)
+    parser.add_argument("--path", required=True, type=Path)
+    parser.add_argument("--half_life_days", type=float, default=30.0)
+    parser.add_argument("--rebuild", action="store_true")
+    parser.add_argument("--chunk_rows", type=int, default=50_000)
+    args = parser.parse_args()
+
+    update_store(
+        args.db_url,
+        args.path,
+        half_life_days=args.half_life_days,
+        rebuild=args.rebuild,
+        chunk_rows=args.chunk_rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
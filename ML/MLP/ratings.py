@@ -0,0 +1,453 @@
+"""
+TrueSkill-style ratings replayed from the match database.
+
+    python ratings.py --db_url postgresql://... --checkpoint stores/ratings.npz
+
+The first run streams matches in game_start_timestamp order. Each player
+is a Gaussian skill (mu, sigma); a match updates all ten players from the
+team sums, without draws. Matches in a chunk are grouped into waves in
+which no player appears twice, so a whole wave is updated with a few
+array ops while every player still sees their games in order.
+
+The checkpoint holds the player arrays and the last replayed match. It is
+saved after every chunk, once the changed ratings are upserted into
+player_ratings, so an interrupted run resumes where it stopped. Later runs
+page through matches.ingested_at like player_store and leave the last few
+minutes for the next run, so matches the collector backfills from older
+history are folded in too. Ratings depend on game order, so such late
+matches are applied when they arrive and counted. The pre-game win
+probabilities of replayed matches are scored as a baseline for the
+learned models.
+"""
+import argparse
+import json
+import math
+import os
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+import psycopg
+
+from player_store import BUILD_ORDER, INGEST_ORDER, SETTLE, PlayerIndex, puuid_keys
+from streaming import conninfo_from_url, stream_rows
+
+FORMAT_VERSION = 2
+TEAM_SIZE = 5
+# shorter games are remakes
+MIN_GAME_SECONDS = 300
+
+MATCH_QUERY = """
+    SELECT
+        m.platform_name, m.game_id, m.game_start_timestamp,
+        mp.team_id, mp.puuid, t.win, m.ingested_at
+    FROM matches m
+    JOIN match_participants mp
+        ON mp.platform_name = m.platform_name AND mp.game_id = m.game_id
+    JOIN teams t
+        ON t.platform_name = mp.platform_name AND t.game_id = mp.game_id
+        AND t.team_id = mp.team_id
+    WHERE m.game_duration >= %(min_duration)s
+        AND m.ingested_at < %(until)s
+        AND (
+            %(after)s::timestamptz IS NULL
+            OR ({order})
+                > (%(after)s::timestamptz, %(platform)s::text, %(game_id)s::bigint)
+        )
+    ORDER BY {order}, mp.team_id, mp.participant_id
+"""
+# positions in MATCH_QUERY rows
+STARTED, INGESTED = 2, 6
+
+UPSERT_SQL = """
+    INSERT INTO player_ratings (puuid, mu, sigma, games, last_played)
+    SELECT puuid, mu, sigma, games, to_timestamp(last_played)
+    FROM rating_updates
+    ON CONFLICT (puuid) DO UPDATE SET
+        mu = EXCLUDED.mu,
+        sigma = EXCLUDED.sigma,
+        games = EXCLUDED.games,
+        last_played = EXCLUDED.last_played,
+        updated_at = NOW()
+"""
+
+_erfc = np.frompyfunc(math.erfc, 1, 1)
+
+
+def norm_cdf(x: np.ndarray) -> np.ndarray:
+    return 0.5 * _erfc(-x / math.sqrt(2)).astype(np.float64)
+
+
+def norm_pdf(x: np.ndarray) -> np.ndarray:
+    return np.exp(-0.5 * x * x) / math.sqrt(2 * math.pi)
+
+
+@dataclass
+class RatingConfig:
+    mu: float = 25.0
+    sigma: float = 25.0 / 3
+    # performance noise per player and skill drift per game
+    beta: float = 25.0 / 6
+    tau: float = 25.0 / 300
+
+
+def match_waves(rows: np.ndarray) -> np.ndarray:
+    """
+    Wave of every match in rows [matches, 10], in chronological order.
+
+    A match runs one wave after the latest earlier match that shares a
+    player, the longest-path level in the graph of shared players.
+    """
+    n_matches = len(rows)
+    players = rows.ravel()
+    matches = np.repeat(np.arange(n_matches), rows.shape[1])
+    order = np.lexsort((matches, players))
+    players, matches = players[order], matches[order]
+    # consecutive games of the same player
+    same = players[1:] == players[:-1]
+    before, after = matches[:-1][same], matches[1:][same]
+
+    wave = np.zeros(n_matches, dtype=np.int64)
+    while True:
+        relaxed = wave.copy()
+        np.maximum.at(relaxed, after, wave[before] + 1)
+        if np.array_equal(relaxed, wave):
+            return wave
+        wave = relaxed
+
+
+class RatingEngine:
+    def __init__(self, config: RatingConfig):
+        self.config = config
+        self.size = 0
+        self.ids = np.empty(0, dtype=puuid_keys([]).dtype)
+        self.mu = np.empty(0)
+        self.sigma2 = np.empty(0)
+        self.games = np.empty(0, dtype=np.int32)
+        self.last_played = np.empty(0)
+        # rows changed since the last write to player_ratings
+        self.dirty = np.empty(0, dtype=bool)
+        self.index = PlayerIndex(self.ids)
+
+    def _grow(self, needed: int) -> None:
+        capacity = max(needed, 2 * len(self.mu), 1024)
+        for name in ("ids", "mu", "sigma2", "games", "last_played", "dirty"):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[: self.size] = old[: self.size]
+            setattr(self, name, new)
+
+    def rows_for(self, keys: np.ndarray, add: bool = False) -> np.ndarray:
+        rows = self.index.rows_for(keys)
+        missing = rows < 0
+        if not add or not missing.any():
+            return rows
+
+        new_keys = np.unique(keys[missing])
+        needed = self.size + len(new_keys)
+        if needed > len(self.mu):
+            self._grow(needed)
+        new_rows = np.arange(self.size, needed)
+        self.ids[new_rows] = new_keys
+        self.mu[new_rows] = self.config.mu
+        self.sigma2[new_rows] = self.config.sigma ** 2
+        self.games[new_rows] = 0
+        self.last_played[new_rows] = -np.inf
+        self.size = needed
+        self.index.add(new_keys, new_rows)
+        rows[missing] = new_rows[np.searchsorted(new_keys, keys[missing])]
+        return rows
+
+    def lookup(self, puuids) -> Tuple[np.ndarray, np.ndarray]:
+        """mu and sigma of the given players, the prior for unknown ones."""
+        rows = self.rows_for(puuid_keys(puuids))
+        known = rows >= 0
+        mu = np.full(len(rows), self.config.mu)
+        sigma = np.full(len(rows), self.config.sigma)
+        mu[known] = self.mu[rows[known]]
+        sigma[known] = np.sqrt(self.sigma2[rows[known]])
+        return mu, sigma
+
+    def win_probability(self, rows: np.ndarray) -> np.ndarray:
+        """p(first five win) for rows [matches, 10] of store rows."""
+        mu = self.mu[rows].reshape(-1, 2, TEAM_SIZE).sum(axis=-1)
+        sigma2 = self.sigma2[rows].sum(axis=-1)
+        c = np.sqrt(sigma2 + 2 * TEAM_SIZE * self.config.beta ** 2)
+        return norm_cdf((mu[:, 0] - mu[:, 1]) / c)
+
+    def update(
+        self,
+        rows: np.ndarray,
+        first_won: np.ndarray,
+        started: np.ndarray,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Replay matches rows [matches, 10], first five players one team.
+
+        Returns each match's pre-game p(first team wins) and whether it
+        started before a game already rated for one of its players.
+        """
+        p_first = np.empty(len(rows))
+        late = np.zeros(len(rows), dtype=bool)
+        waves = match_waves(rows)
+        for wave in range(int(waves.max(initial=-1)) + 1):
+            sel = np.flatnonzero(waves == wave)
+            p_first[sel], late[sel] = self._update_wave(
+                rows[sel], first_won[sel], started[sel]
+            )
+        return p_first, late
+
+    def _update_wave(
+        self,
+        rows: np.ndarray,
+        first_won: np.ndarray,
+        started: np.ndarray,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        cfg = self.config
+        late = (self.last_played[rows] > started[:, None]).any(axis=1)
+        mu = self.mu[rows]
+        sigma2 = self.sigma2[rows] + cfg.tau ** 2
+
+        team_mu = mu.reshape(-1, 2, TEAM_SIZE).sum(axis=-1)
+        c2 = sigma2.sum(axis=-1) + 2 * TEAM_SIZE * cfg.beta ** 2
+        c = np.sqrt(c2)
+        diff = (team_mu[:, 0] - team_mu[:, 1]) / c
+        p_first = norm_cdf(diff)
+
+        # winner's margin over the loser, the truncated Gaussian update
+        sign = np.where(first_won, 1.0, -1.0)
+        t = sign * diff
+        cdf = norm_cdf(t)
+        v = np.where(cdf > 1e-300, norm_pdf(t) / np.maximum(cdf, 1e-300), -t)
+        w = np.clip(v * (v + t), 0.0, 1.0 - 1e-9)
+
+        side = np.repeat([1.0, -1.0], TEAM_SIZE)
+        direction = side[None, :] * sign[:, None]
+        mu += direction * sigma2 / c[:, None] * v[:, None]
+        sigma2 *= 1.0 - sigma2 / c2[:, None] * w[:, None]
+
+        self.mu[rows] = mu
+        self.sigma2[rows] = sigma2
+        self.games[rows] += 1
+        self.last_played[rows] = np.maximum(self.last_played[rows], started[:, None])
+        self.dirty[rows] = True
+        return p_first, late
+
+    def save(self, path: Path, meta: dict) -> None:
+        # one file, replaced atomically, so arrays and cursor always agree
+        path = Path(path)
+        partial = path.with_name(path.name + ".tmp")
+        n = self.size
+        with open(partial, "wb") as f:
+            np.savez(
+                f,
+                meta=np.array(json.dumps(meta)),
+                ids=self.ids[:n],
+                mu=self.mu[:n],
+                sigma2=self.sigma2[:n],
+                games=self.games[:n],
+                last_played=self.last_played[:n],
+            )
+        os.replace(partial, path)
+
+    @classmethod
+    def load(cls, path: Path) -> Tuple["RatingEngine", dict]:
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            if meta["format"] != FORMAT_VERSION:
+                raise ValueError(f"Unsupported checkpoint format {meta['format']}")
+            engine = cls(RatingConfig(**meta["config"]))
+            n = len(data["mu"])
+            engine._grow(n)
+            engine.size = n
+            for name in ("ids", "mu", "sigma2", "games", "last_played"):
+                getattr(engine, name)[:n] = data[name]
+        engine.index = PlayerIndex(engine.ids[:n])
+        return engine, meta
+
+
+def _assemble(rows: List[tuple]) -> Tuple[List[List[tuple]], List[tuple]]:
+    # groups rows by match; the last match may continue in the next chunk
+    matches: List[List[tuple]] = []
+    for row in rows:
+        if matches and matches[-1][0][:2] == row[:2]:
+            matches[-1].append(row)
+        else:
+            matches.append([row])
+    if not matches:
+        return [], []
+    return matches[:-1], matches[-1]
+
+
+def write_ratings(conn: psycopg.Connection, engine: RatingEngine) -> int:
+    rows = np.flatnonzero(engine.dirty[: engine.size])
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            CREATE TEMP TABLE rating_updates (
+                puuid TEXT, mu REAL, sigma REAL, games INT, last_played FLOAT8
+            ) ON COMMIT DROP
+            """
+        )
+        with cur.copy(
+            "COPY rating_updates (puuid, mu, sigma, games, last_played)"
+            " FROM STDIN"
+        ) as copy:
+            ids = engine.ids[rows]
+            sigma = np.sqrt(engine.sigma2[rows])
+            for i, row in enumerate(rows):
+                copy.write_row((
+                    ids[i].decode(),
+                    float(engine.mu[row]),
+                    float(sigma[i]),
+                    int(engine.games[row]),
+                    float(engine.last_played[row]),
+                ))
+        cur.execute(UPSERT_SQL)
+    conn.commit()
+    engine.dirty[rows] = False
+    return len(rows)
+
+
+def _position(match: List[tuple], column: int) -> dict:
+    # cursor after the match in the order the current phase reads in
+    first = match[0]
+    return {
+        "at": first[column].isoformat(),
+        "platform_name": first[0],
+        "game_id": first[1],
+    }
+
+
+def replay(
+    db_url: str,
+    checkpoint: Path,
+    config: Optional[RatingConfig] = None,
+    rebuild: bool = False,
+    chunk_rows: int = 100_000,
+) -> RatingEngine:
+    checkpoint = Path(checkpoint)
+    if checkpoint.exists() and not rebuild:
+        engine, meta = RatingEngine.load(checkpoint)
+        if config is not None and asdict(config) != meta["config"]:
+            raise ValueError("Checkpoint was built with another config, use rebuild")
+    else:
+        engine = RatingEngine(config or RatingConfig())
+        meta = {"format": FORMAT_VERSION, "config": asdict(engine.config)}
+        meta.update(cursor=None, matches=0)
+
+    replayed = 0
+    late = 0
+    written = 0
+    log_loss = 0.0
+    correct = 0
+    conninfo = conninfo_from_url(db_url)
+    with psycopg.connect(conninfo) as conn, psycopg.connect(conninfo) as write_conn:
+        conn.isolation_level = psycopg.IsolationLevel.REPEATABLE_READ
+        cursor = meta["cursor"]
+        if cursor is None:
+            until = conn.execute("SELECT now() - %s", (SETTLE,)).fetchone()[0]
+            cursor = {"phase": "build", "until": until.isoformat(), "after": None}
+        if cursor["phase"] == "build":
+            order, column = BUILD_ORDER, STARTED
+            until = datetime.fromisoformat(cursor["until"])
+        else:
+            order, column = INGEST_ORDER, INGESTED
+            until = conn.execute("SELECT now() - %s", (SETTLE,)).fetchone()[0]
+
+        after = cursor["after"]
+        params = {
+            "min_duration": MIN_GAME_SECONDS,
+            "until": until,
+            "after": datetime.fromisoformat(after["at"]) if after else None,
+            "platform": after["platform_name"] if after else None,
+            "game_id": after["game_id"] if after else None,
+        }
+        pending: List[tuple] = []
+        stream = stream_rows(conn, MATCH_QUERY.format(order=order), params, chunk_rows)
+        while True:
+            chunk = next(stream, None)
+            if chunk is not None:
+                matches, tail = _assemble(pending + chunk[1])
+                pending = tail
+            else:
+                # the stream ended, so the held back match is complete
+                matches, pending = ([pending] if pending else []), []
+
+            # blue sorts before red, and ten players split five and five
+            full = [
+                m for m in matches
+                if len(m) == 2 * TEAM_SIZE
+                and m[0][3] != m[-1][3]
+                and m[TEAM_SIZE - 1][3] == m[0][3]
+                and m[TEAM_SIZE][3] != m[TEAM_SIZE - 1][3]
+            ]
+            if full:
+                keys = puuid_keys([row[4] for m in full for row in m])
+                rows = engine.rows_for(keys, add=True).reshape(-1, 2 * TEAM_SIZE)
+                first_won = np.array([bool(m[0][5]) for m in full])
+                started = np.array([m[0][STARTED].timestamp() for m in full])
+                p_first, backfilled = engine.update(rows, first_won, started)
+                late += int(backfilled.sum())
+
+                p_won = np.clip(np.where(first_won, p_first, 1 - p_first), 1e-12, 1)
+                log_loss -= float(np.log(p_won).sum())
+                correct += int((p_won > 0.5).sum())
+                replayed += len(full)
+            if matches:
+                cursor["after"] = _position(matches[-1], column)
+                # the table first, so a crash in between only repeats work
+                written += write_ratings(write_conn, engine)
+                meta.update(
+                    cursor=cursor,
+                    matches=meta["matches"] + len(full),
+                    updated=datetime.now().isoformat(),
+                )
+                engine.save(checkpoint, meta)
+            if chunk is None:
+                break
+
+        if cursor["phase"] == "build":
+            # from here on, page by ingestion from where the build stopped
+            cursor = {
+                "phase": "ingest",
+                "after": {"at": until.isoformat(), "platform_name": "", "game_id": -1},
+            }
+            meta.update(cursor=cursor, updated=datetime.now().isoformat())
+            engine.save(checkpoint, meta)
+
+    print(f"Replayed {replayed} matches, {engine.size} players, {written} written")
+    if late:
+        print(f"{late} matches were older than a player's latest rated game")
+    if replayed:
+        print(
+            f"Pre-game baseline: log loss {log_loss / replayed:.4f},"
+            f" accuracy {correct / replayed:.4f}"
+        )
+    return engine
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--db_url", required=True)
+    parser.add_argument("--checkpoint", required=True, type=Path)
+    parser.add_argument("--rebuild", action="store_true")
+    parser.add_argument("--chunk_rows", type=int, default=100_000)
+    args = parser.parse_args()
+
+    args.checkpoint.parent.mkdir(parents=True, exist_ok=True)
+    replay(
+        args.db_url,
+        args.checkpoint,
+        rebuild=args.rebuild,
+        chunk_rows=args.chunk_rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import re
+import uuid
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import psycopg
+
+from features import FeatureTransformer
+
+EXCLUDED_COLS: List[str] = [
+    "match_id", "participant_id", "team_id", "puuid",
+    "platform_name", "game_id",
+    "champion_id", "champion_name",
+    "item0", "item1", "item2", "item3", "item4", "item5", "item6"
+]
+TARGET_COL = "win"
+# encoded as vocabulary codes and one-hot encoded per batch
+CATEGORICAL_COLS: List[str] = ["team_position"]
+
+
+def conninfo_from_url(db_url: str) -> str:
+    # SQLAlchemy URLs carry the driver, libpq does not understand it
+    return re.sub(r"^postgresql\+\w+://", "postgresql://", db_url)
+
+
+def transformer_from_columns(names: Sequence[str]) -> FeatureTransformer:
+    skip = set(EXCLUDED_COLS) | {TARGET_COL} | set(CATEGORICAL_COLS)
+    numeric = [name for name in names if name not in skip]
+    categorical = [name for name in CATEGORICAL_COLS if name in names]
+    return FeatureTransformer(numeric, categorical)
+
+
+def count_rows(
+    conn: psycopg.Connection,
+    query: str,
+    params: Optional[dict] = None,
+) -> int:
+    row = conn.execute(f"SELECT count(*) FROM ({query}) AS q", params).fetchone()
+    return row[0]
+
+
+def stream_rows(
+    conn: psycopg.Connection,
+    query: str,
+    params: Optional[dict] = None,
+    chunk_rows: int = 50_000,
+) -> Iterator[Tuple[List[str], List[tuple]]]:
+    # named cursors live on the server, only chunk_rows rows cross the wire
+    # at a time; binary transfer skips text parsing of every number
+    name = f"stream_{uuid.uuid4().hex}"
+    with conn.cursor(name=name, binary=True) as cur:
+        cur.itersize = chunk_rows
+        cur.execute(query, params)
+        while True:
+            rows = cur.fetchmany(chunk_rows)
+            if not rows:
+                return
+            names = [column.name for column in cur.description]
+            yield names, rows
+
+
+def fill_chunk(
+    rows: List[tuple],
+    names: List[str],
+    transformer: FeatureTransformer,
+    x_out: np.ndarray,
+    y_out: np.ndarray,
+    grow: bool = True,
+) -> None:
+    index = {name: i for i, name in enumerate(names)}
+    columns = list(zip(*rows))
+
+    for j, name in enumerate(transformer.numeric):
+        # NULL becomes NaN and is imputed when batches are transformed
+        x_out[:, j] = np.array(columns[index[name]], dtype=np.float32)
+
+    offset = len(transformer.numeric)
+    for j, name in enumerate(transformer.categorical):
+        x_out[:, offset + j] = transformer.encode(name, columns[index[name]], grow)
+
+    if TARGET_COL in index:
+        y_out[:] = np.array(columns[index[TARGET_COL]], dtype=np.float32)
+
+
+def load_features(
+    db_url: str,
+    query: str,
+    transformer: Optional[FeatureTransformer] = None,
+    chunk_rows: int = 50_000,
+) -> Tuple[np.ndarray, np.ndarray, FeatureTransformer]:
+    """
+    Stream a query into preallocated raw float32 arrays.
+
+    Peak memory is the final X and y plus one chunk of rows. Without a
+    transformer one is fitted in the same pass; pass the training
+    transformer when loading validation data so columns and codes line up.
+    """
+    fit = transformer is None
+    with psycopg.connect(conninfo_from_url(db_url)) as conn:
+        # the count and the cursor must see the same snapshot
+        conn.isolation_level = psycopg.IsolationLevel.REPEATABLE_READ
+        n_rows = count_rows(conn, query)
+        x = y = None
+        start = 0
+        for names, rows in stream_rows(conn, query, chunk_rows=chunk_rows):
+            if x is None:
+                if transformer is None:
+                    transformer = transformer_from_columns(names)
+                dim = len(transformer.raw_names)
+                x = np.empty((n_rows, dim), dtype=np.float32)
+                y = np.empty(n_rows, dtype=np.float32)
+
+            end = min(start + len(rows), n_rows)
+            rows = rows[: end - start]
+            fill_chunk(rows, names, transformer, x[start:end], y[start:end], fit)
+            if fit:
+                transformer.update(x[start:end])
+            start = end
+            if start == n_rows:
+                break
+
+    if x is None:
+        raise ValueError("Query returned no rows")
+    return x[:start], y[:start], transformer
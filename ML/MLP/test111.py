@@ -1,22 +1,19 @@
 import argparse
-from typing import List
+from pathlib import Path
+from typing import Optional
 
-import pandas as pd
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import torchmetrics
-from torch.utils.data import TensorDataset, DataLoader
 
-from sqlalchemy import create_engine
 import pytorch_lightning as pl
 from pytorch_lightning.loggers import MLFlowLogger
 
-EXCLUDED_COLS: List[str] = [
-    "match_id", "participant_id", "team_id", "puuid",
-    "champion_id", "champion_name",
-    "item0", "item1", "item2", "item3", "item4", "item5", "item6"
-]
+from batching import TensorBatchLoader
+from dataset_cache import build_cache, open_cache
+from features import FeatureTransformer
+from streaming import load_features
 
 
 class LoLPlayerDataModule(pl.LightningDataModule):
@@ -26,72 +23,95 @@ class LoLPlayerDataModule(pl.LightningDataModule):
         train_query: str,
         val_query: str,
         batch_size: int = 256,
+        cache_dir: Optional[str] = None,
     ):
         super().__init__()
         self.db_url = db_url
         self.train_query = train_query
         self.val_query = val_query
         self.batch_size = batch_size
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        # fitted on the training rows, the model applies it to raw batches
+        self.transformer: Optional[FeatureTransformer] = None
 
     def prepare_data(self):
-        engine = create_engine(self.db_url)
-
-        self.train_df = pd.read_sql(self.train_query, engine)
-        self.val_df = pd.read_sql(self.val_query, engine)
-
-        self.train_df.drop(columns=[c for c in EXCLUDED_COLS if c in self.train_df.columns],
-                           inplace=True, errors="ignore")
-        self.val_df.drop(columns=[c for c in EXCLUDED_COLS if c in self.val_df.columns],
-                         inplace=True, errors="ignore")
-
-        train_pos = pd.get_dummies(self.train_df["team_position"], prefix="pos")
-        val_pos = pd.get_dummies(self.val_df["team_position"], prefix="pos")
-        val_pos = val_pos.reindex(columns=train_pos.columns, fill_value=0)
-
-        self.train_df = pd.concat(
-            [self.train_df.drop(columns=["team_position"]), train_pos], axis=1
+        # main() loads the data to build the model, fit() calls this again
+        if self.transformer is not None:
+            return
+        if self.cache_dir is not None:
+            # only fetches games newer than the last build
+            build_cache(self.db_url, self.train_query, self.cache_dir / "train")
+            # seeded with the training vocabularies so category codes agree
+            transformer = open_cache(self.cache_dir / "train").transformer
+            build_cache(
+                self.db_url,
+                self.val_query,
+                self.cache_dir / "val",
+                vocab_from=transformer,
+            )
+            return
+
+        X_train, y_train, transformer = load_features(self.db_url, self.train_query)
+        X_val, y_val, _ = load_features(
+            self.db_url, self.val_query, transformer=transformer
         )
-        self.val_df = pd.concat(
-            [self.val_df.drop(columns=["team_position"]), val_pos], axis=1
-        )
-
-        y_train = self.train_df["win"].astype(float).values
-        y_val = self.val_df["win"].astype(float).values
-        X_train = self.train_df.drop(columns=["win"])
-        X_val = self.val_df.drop(columns=["win"])
 
-        self.mean = X_train.mean()
-        self.std = X_train.std().replace(0, 1)
+        self.transformer = transformer
+        self.feature_names = transformer.feature_names
 
-        X_train_norm = (X_train - self.mean) / self.std
-        X_val_norm = (X_val - self.mean) / self.std
-
-        self.X_train = torch.tensor(X_train_norm.values, dtype=torch.float32)
-        self.y_train = torch.tensor(y_train, dtype=torch.float32)
-        self.X_val = torch.tensor(X_val_norm.values, dtype=torch.float32)
-        self.y_val = torch.tensor(y_val, dtype=torch.float32)
+        # raw features, the tensors share memory with the arrays
+        self.X_train = torch.from_numpy(X_train)
+        self.y_train = torch.from_numpy(y_train)
+        self.X_val = torch.from_numpy(X_val)
+        self.y_val = torch.from_numpy(y_val)
 
     def setup(self, stage=None):
-        self.train_dataset = TensorDataset(self.X_train, self.y_train)
-        self.val_dataset = TensorDataset(self.X_val, self.y_val)
+        if self.cache_dir is not None and self.transformer is None:
+            self._setup_from_cache()
+
+    def _setup_from_cache(self):
+        train = open_cache(self.cache_dir / "train")
+        val = open_cache(self.cache_dir / "val")
+        if val.feature_names != train.feature_names:
+            raise ValueError("Train and validation caches have different features")
+
+        self.transformer = train.transformer
+        self.feature_names = self.transformer.feature_names
+        # no-op unless the training vocabulary grew after val was built,
+        # in which case val's features are copied off the memmap
+        val_features = self.transformer.recode_(val.features, val.transformer)
+
+        # zero copy, pages are read from the memmaps as batches need them
+        self.X_train = torch.from_numpy(train.features)
+        self.y_train = torch.from_numpy(train.labels)
+        self.X_val = torch.from_numpy(val_features)
+        self.y_val = torch.from_numpy(val.labels)
 
     def train_dataloader(self):
-        return DataLoader(
-            self.train_dataset, batch_size=self.batch_size, shuffle=True, num_workers=4
+        # whole batches are gathered from the tensors, no worker processes
+        return TensorBatchLoader(
+            (self.X_train, self.y_train),
+            batch_size=self.batch_size,
+            shuffle=True,
+            prefetch=True,
+            pin_memory=True,
         )
 
     def val_dataloader(self):
-        return DataLoader(
-            self.val_dataset, batch_size=self.batch_size, shuffle=False, num_workers=4
+        return TensorBatchLoader(
+            (self.X_val, self.y_val), batch_size=self.batch_size, pin_memory=True
         )
 
 class EvaluateMLP(pl.LightningModule):
-    def __init__(self, input_dim: int, lr: float = 1e-3):
+    def __init__(self, transformer: dict, lr: float = 1e-3):
         super().__init__()
+        # the transformer state is a hyperparameter, so a checkpoint alone
+        # rebuilds the preprocessing used in training
         self.save_hyperparameters()
 
+        self.normaliser = FeatureTransformer.from_dict(transformer).module()
         self.net = nn.Sequential(
-            nn.Linear(input_dim, 128),
+            nn.Linear(self.normaliser.output_dim, 128),
             nn.ReLU(),
             nn.Linear(128, 64),
             nn.ReLU(),
@@ -109,7 +129,8 @@ class EvaluateMLP(pl.LightningModule):
         )
 
     def forward(self, x):
-        return self.net(x)
+        # x holds raw features, as stored by the loaders and caches
+        return self.net(self.normaliser(x))
 
     def _step(self, batch, stage: str):
         x, y = batch
@@ -145,6 +166,7 @@ def main():
     parser.add_argument("--epochs", type=int, default=20)
     parser.add_argument("--lr", type=float, default=1e-3)
     parser.add_argument("--mlruns", default="./mlruns", help="MLflow tracking URI")
+    parser.add_argument("--cache_dir", help="memory-mapped dataset cache directory")
     args = parser.parse_args()
 
 
@@ -160,11 +182,12 @@ def main():
         train_query=train_sql,
         val_query=val_sql,
         batch_size=args.batch_size,
+        cache_dir=args.cache_dir,
     )
     dm.prepare_data()
     dm.setup()
 
-    model = PlayerSkillMLP(input_dim=dm.X_train.shape[1], lr=args.lr)
+    model = EvaluateMLP(transformer=dm.transformer.to_dict(), lr=args.lr)
 
     mlf_logger = MLFlowLogger(
         experiment_name="LoLMatchmaking",
@@ -178,6 +201,10 @@ def main():
         accelerator="auto",
     )
     trainer.fit(model, datamodule=dm)
+    # also as a standalone artifact for inference outside Lightning
+    mlf_logger.experiment.log_dict(
+        mlf_logger.run_id, dm.transformer.to_dict(), "feature_transformer.json"
+    )
 
 
 if __name__ == "__main__":
@@ -1,62 +1,492 @@
+"""
+Query structlog JSON logs written by the collectors.
+
+Run from the collector directory:
+
+    # server side 429s per route per minute
+    python -m analysis.analysis logs --msg "Server side rate limit" \\
+        --group-by route --bucket 60
+
+    # response latency percentiles per method
+    python -m analysis.analysis logs --msg "Processing job result" \\
+        --group-by method --agg count --agg p50:latency --agg p99:latency
+
+    # matching rows
+    python -m analysis.analysis logs --level critical --select timestamp,component,msg
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Callable, Optional
+import argparse
 import json
-from typing import Optional
-
-
-def filter_logs(
-    file_path: str,
-    *,
-    level: Optional[str] = None,
-    event: Optional[str] = None,
-    contains: Optional[dict] = None,
-):
-    """
-    Filter structlog JSON logs.
-
-    Args:
-        file_path (str): Path to log file.
-        level (str): Log level to filter by (e.g., "info", "debug").
-        event (str): Event name to filter by.
-        contains (dict): Dictionary of key-value pairs that must be present in the log.
-
-    Yields:
-        dict: Log entries matching filters.
-    """
-    with open(file_path) as f:
-        for line in f:
+import operator
+import os
+import re
+
+import numpy as np
+
+from analysis.columnar import NAT, Frame, prune_cache, read_frame
+
+CONDITION_PATTERN = re.compile(r"^([\w.]+)(!=|>=|<=|=|>|<|~)(.*)$")
+NUMERIC_OPERATORS: dict[str, Callable] = {
+    "=": operator.eq,
+    "!=": operator.ne,
+    ">": operator.gt,
+    "<": operator.lt,
+    ">=": operator.ge,
+    "<=": operator.le,
+}
+AGGREGATIONS = ("count", "sum", "mean", "min", "max")
+# index times come from the log record, timestamps from structlog
+SEGMENT_SLACK_US = 1_000_000
+
+
+@dataclass(frozen=True)
+class Condition:
+    column: str
+    op: str
+    value: str
+
+    @classmethod
+    def parse(cls, text: str) -> "Condition":
+        match = CONDITION_PATTERN.match(text)
+        if match is None:
+            raise argparse.ArgumentTypeError(f"Invalid condition: {text}")
+        return cls(*match.groups())
+
+    def string_predicate(self) -> Callable[[str], bool]:
+        if self.op == "~":
+            return lambda value: self.value in value
+        if self.op == "=":
+            return lambda value: value == self.value
+        if self.op == "!=":
+            return lambda value: value != self.value
+
+        compare = NUMERIC_OPERATORS[self.op]
+        threshold = float(self.value)
+
+        def predicate(value: str) -> bool:
             try:
-                log = json.loads(line)
-                if level and log.get("level") != level:
-                    continue
-                if event and log.get("event") != event:
-                    continue
-                if contains and not all(log.get(k) == v for k, v in contains.items()):
+                return compare(float(value), threshold)
+            except ValueError:
+                return False
+
+        return predicate
+
+
+@dataclass(frozen=True)
+class Query:
+    levels: tuple[str, ...] = ()
+    msg: Optional[str] = None
+    conditions: tuple[Condition, ...] = ()
+    # microseconds since epoch
+    since: Optional[int] = None
+    until: Optional[int] = None
+    columns: frozenset[str] = field(default_factory=frozenset)
+
+
+@dataclass(frozen=True)
+class Aggregation:
+    func: str
+    column: Optional[str] = None
+
+    @classmethod
+    def parse(cls, text: str) -> "Aggregation":
+        func, _, column = text.partition(":")
+        valid = func in AGGREGATIONS or re.fullmatch(r"p\d{1,2}(\.\d+)?", func)
+        if not valid or (func != "count" and not column):
+            raise argparse.ArgumentTypeError(f"Invalid aggregation: {text}")
+        return cls(func, column or None)
+
+    @property
+    def name(self) -> str:
+        return f"{self.func}:{self.column}" if self.column else self.func
+
+    def apply(self, values: Optional[np.ndarray], rows: int) -> float:
+        if self.func == "count":
+            return rows
+        assert values is not None
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return np.nan
+        if self.func == "sum":
+            return float(values.sum())
+        if self.func == "mean":
+            return float(values.mean())
+        if self.func == "min":
+            return float(values.min())
+        if self.func == "max":
+            return float(values.max())
+        return float(np.percentile(values, float(self.func[1:])))
+
+
+def string_mask(frame: Frame, column: str, predicate: Callable[[str], bool]):
+    codes = frame.strings.get(column)
+    if codes is None:
+        return np.zeros(frame.length, dtype=bool)
+    # predicates run once per distinct value, not once per row
+    matching = [i for i, value in enumerate(frame.vocab[column]) if predicate(value)]
+    return np.isin(codes, matching)
+
+
+def condition_mask(frame: Frame, condition: Condition) -> np.ndarray:
+    values = frame.numeric.get(condition.column)
+    if values is None or condition.op == "~":
+        return string_mask(frame, condition.column, condition.string_predicate())
+
+    try:
+        threshold = float(condition.value)
+    except ValueError:
+        return np.zeros(frame.length, dtype=bool)
+    with np.errstate(invalid="ignore"):
+        return NUMERIC_OPERATORS[condition.op](values, threshold)
+
+
+def scan_file(path: Path, cache_dir: Optional[Path], query: Query) -> Frame:
+    frame = read_frame(path, cache_dir)
+    mask = np.ones(frame.length, dtype=bool)
+
+    if query.levels:
+        mask &= string_mask(frame, "level", lambda level: level in query.levels)
+    if query.msg is not None:
+        msg = query.msg
+        mask &= string_mask(frame, "msg", lambda value: msg in value)
+    for condition in query.conditions:
+        mask &= condition_mask(frame, condition)
+    if frame.timestamp is not None:
+        if query.since is not None:
+            mask &= frame.timestamp >= query.since
+        if query.until is not None:
+            mask &= frame.timestamp < query.until
+    elif query.since is not None or query.until is not None:
+        mask[:] = False
+
+    # only ship the columns the query needs back to the parent process
+    return frame.take(mask, set(query.columns))
+
+
+def concat(frames: list[Frame], columns: set[str]) -> Frame:
+    merged = Frame(sum(frame.length for frame in frames))
+    string_columns = {c for frame in frames for c in frame.strings} & columns
+    numeric_columns = {c for frame in frames for c in frame.numeric} & columns
+    numeric_columns -= string_columns
+
+    for name in string_columns:
+        index: dict[str, int] = {}
+        parts = []
+        for frame in frames:
+            codes = frame.strings.get(name)
+            if codes is None:
+                values = frame.numeric.get(name)
+                if values is None:
+                    parts.append(np.full(frame.length, -1, dtype=np.int32))
                     continue
-                yield log
-            except json.JSONDecodeError:
-                continue
+                # same field logged as a number in some files
+                vocab = [format_number(v) for v in values]
+                codes = np.arange(frame.length, dtype=np.int32)
+            else:
+                vocab = frame.vocab[name]
+            # remap file local codes to the merged vocabulary, -1 stays -1
+            mapping = np.array(
+                [index.setdefault(value, len(index)) for value in vocab] + [-1],
+                dtype=np.int32,
+            )
+            parts.append(mapping[codes])
+        merged.strings[name] = np.concatenate(parts) if parts else np.empty(0)
+        merged.vocab[name] = list(index)
+
+    for name in numeric_columns:
+        merged.numeric[name] = np.concatenate(
+            [
+                frame.numeric.get(name, np.full(frame.length, np.nan))
+                for frame in frames
+            ]
+        )
 
+    stamps = [
+        frame.timestamp
+        if frame.timestamp is not None
+        else np.full(frame.length, NAT, dtype=np.int64)
+        for frame in frames
+    ]
+    merged.timestamp = np.concatenate(stamps) if stamps else np.empty(0, np.int64)
+    return merged
 
-def get_platform_logs(log_file, platform):
-    for log in filter_logs(log_file):
-        if log.get("platform", "") != platform:
+
+def format_number(value: float) -> str:
+    if np.isnan(value):
+        return "-"
+    return str(int(value)) if float(value).is_integer() else f"{value:.4f}"
+
+
+def format_timestamp(value: int) -> str:
+    if value == NAT:
+        return "-"
+    return str(np.datetime64(int(value), "us"))
+
+
+def group_key(frame: Frame, column: str, bucket: Optional[int]):
+    # returns integer codes per row and a function mapping a code to a label
+    if column == "time":
+        assert frame.timestamp is not None and bucket is not None
+        step = bucket * 1_000_000
+        codes = np.where(frame.timestamp == NAT, NAT, frame.timestamp // step)
+        return codes, lambda code: format_timestamp(code * step if code != NAT else NAT)
+    if column in frame.strings:
+        vocab = frame.vocab[column]
+        return frame.strings[column], lambda code: vocab[code] if code >= 0 else "-"
+    if column in frame.numeric:
+        uniques, codes = np.unique(frame.numeric[column], return_inverse=True)
+        return codes.reshape(-1), lambda code: format_number(uniques[code])
+    return np.zeros(frame.length, dtype=np.int64), lambda code: "-"
+
+
+def aggregate(
+    frame: Frame,
+    group_by: list[str],
+    aggregations: list[Aggregation],
+    bucket: Optional[int],
+) -> list[dict[str, object]]:
+    if not frame.length:
+        return []
+
+    keys = [group_key(frame, column, bucket) for column in group_by]
+    if keys:
+        matrix = np.stack([codes.astype(np.int64) for codes, _ in keys], axis=1)
+        groups, inverse = np.unique(matrix, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+    else:
+        groups = np.zeros((1, 0), dtype=np.int64)
+        inverse = np.zeros(frame.length, dtype=np.int64)
+
+    # sort rows by group once, then every group is a contiguous slice
+    order = np.argsort(inverse, kind="stable")
+    bounds = np.concatenate([[0], np.cumsum(np.bincount(inverse))])
+    columns = {
+        agg.column: frame.numeric.get(agg.column, np.full(frame.length, np.nan))[order]
+        for agg in aggregations
+        if agg.column is not None
+    }
+
+    rows = []
+    for i, group in enumerate(groups):
+        start, end = bounds[i], bounds[i + 1]
+        row: dict[str, object] = {
+            column: label(code)
+            for column, (_, label), code in zip(group_by, keys, group)
+        }
+        for agg in aggregations:
+            values = columns[agg.column][start:end] if agg.column else None
+            row[agg.name] = agg.apply(values, int(end - start))
+        rows.append(row)
+    return rows
+
+
+def select_rows(frame: Frame, columns: list[str], limit: int):
+    order = np.argsort(frame.timestamp, kind="stable")[:limit]
+    for i in order:
+        row: dict[str, object] = {}
+        for column in columns:
+            if column == "timestamp":
+                row[column] = format_timestamp(frame.timestamp[i])
+            elif column in frame.strings:
+                code = frame.strings[column][i]
+                row[column] = frame.vocab[column][code] if code >= 0 else None
+            elif column in frame.numeric:
+                value = frame.numeric[column][i]
+                row[column] = None if np.isnan(value) else float(value)
+            else:
+                row[column] = None
+        yield row
+
+
+def print_table(rows: list[dict[str, object]]) -> None:
+    if not rows:
+        print("No matching log events")
+        return
+
+    headers = list(rows[0])
+    cells = [
+        [
+            format_number(v) if isinstance(v, float) else "-" if v is None else str(v)
+            for v in row.values()
+        ]
+        for row in rows
+    ]
+    widths = [
+        max(len(header), *(len(line[i]) for line in cells))
+        for i, header in enumerate(headers)
+    ]
+    print("  ".join(h.ljust(w) for h, w in zip(headers, widths)))
+    for line in cells:
+        print("  ".join(c.ljust(w) for c, w in zip(line, widths)))
+
+
+def find_log_files(log_dir: Path, entry: str, component: str) -> list[Path]:
+    patterns = [
+        f"{entry}.{component}.log*",
+        # compressed segments, named by their start time
+        f"{entry}.{component}.*.log.gz",
+    ]
+    paths = {
+        path
+        for pattern in patterns
+        for path in log_dir.glob(pattern)
+        # critical records are already in their component files
+        if ".critical_" not in path.name
+        and not path.name.endswith(".tmp")
+        and path.is_file()
+    }
+    # largest first keeps the process pool evenly loaded
+    return sorted(paths, key=lambda path: path.stat().st_size, reverse=True)
+
+
+def segment_ranges(log_dir: Path) -> dict[str, tuple[int, int]]:
+    # time range of each compressed segment, from the rotation indexes
+    ranges = {}
+    for index in log_dir.glob("*.segments.json"):
+        try:
+            segments = json.loads(index.read_text())
+        except (OSError, ValueError):
+            continue
+        for segment in segments:
+            ranges[segment["file"]] = (segment["start_us"], segment["end_us"])
+    return ranges
+
+
+def overlapping(paths: list[Path], since: Optional[int], until: Optional[int]):
+    # skip segments entirely outside the window, files without an index
+    # entry are always scanned
+    ranges = segment_ranges(paths[0].parent) if paths else {}
+    slack = SEGMENT_SLACK_US
+    for path in paths:
+        start, end = ranges.get(path.name, (None, None))
+        if start is not None and until is not None and start - slack >= until:
+            continue
+        if end is not None and since is not None and end + slack < since:
             continue
+        yield path
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def parse_time(value: str) -> int:
+    # log timestamps are UTC, so a time without an offset is taken as UTC
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return (parsed - EPOCH) // timedelta(microseconds=1)
+
+
+def sort_key(value) -> tuple:
+    # missing aggregates sort last; group-by columns hold strings
+    missing = value is None or (isinstance(value, float) and np.isnan(value))
+    return (not missing, 0 if missing else value)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Filter and aggregate collector JSON logs",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__,
+    )
+    parser.add_argument("log_dir", nargs="?", default=".", type=Path)
+    parser.add_argument("--entry", default="*", help="entry script, e.g. query_match")
+    parser.add_argument("--component", default="*", help="glob, e.g. 'worker_*'")
+    parser.add_argument("--level", action="append", default=[])
+    parser.add_argument("--msg", help="substring of the log message")
+    parser.add_argument(
+        "--where",
+        action="append",
+        default=[],
+        type=Condition.parse,
+        help="column=value, !=, >, <, >=, <= or ~ (substring)",
+    )
+    parser.add_argument("--since", type=parse_time, help="ISO time, UTC unless offset")
+    parser.add_argument("--until", type=parse_time, help="ISO time, UTC unless offset")
+    parser.add_argument(
+        "--group-by",
+        default="",
+        help="comma separated columns; 'time' groups by --bucket",
+    )
+    parser.add_argument("--bucket", type=int, help="time bucket in seconds")
+    parser.add_argument(
+        "--agg",
+        action="append",
+        default=[],
+        type=Aggregation.parse,
+        help="count, sum:col, mean:col, min:col, max:col or p<q>:col",
+    )
+    parser.add_argument("--sort", help="aggregate to sort by, descending")
+    parser.add_argument("--select", help="comma separated columns to print per row")
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--json", action="store_true", help="print JSON lines")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count())
+    parser.add_argument("--cache-dir", type=Path)
+    parser.add_argument("--no-cache", action="store_true")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+
+    group_by = [column for column in args.group_by.split(",") if column]
+    if args.bucket and "time" not in group_by:
+        group_by.insert(0, "time")
+    if "time" in group_by and not args.bucket:
+        args.bucket = 60
+    aggregations = args.agg or [Aggregation("count")]
+    select = args.select.split(",") if args.select else []
+
+    columns = set(group_by) | set(select)
+    columns |= {agg.column for agg in aggregations if agg.column}
+    query = Query(
+        levels=tuple(args.level),
+        msg=args.msg,
+        conditions=tuple(args.where),
+        since=args.since,
+        until=args.until,
+        columns=frozenset(columns),
+    )
+
+    cache_dir = None
+    if not args.no_cache:
+        cache_dir = args.cache_dir or args.log_dir / ".log_cache"
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        prune_cache(cache_dir, find_log_files(args.log_dir, "*", "*"))
 
-        yield log
+    paths = find_log_files(args.log_dir, args.entry, args.component)
+    if args.since is not None or args.until is not None:
+        paths = list(overlapping(paths, args.since, args.until))
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        frames = list(
+            executor.map(
+                scan_file,
+                paths,
+                [cache_dir] * len(paths),
+                [query] * len(paths),
+            )
+        )
+    frame = concat(frames, columns)
 
+    if select:
+        rows = list(select_rows(frame, select, args.limit))
+    else:
+        rows = aggregate(frame, group_by, aggregations, args.bucket)
+        if args.sort:
+            rows.sort(key=lambda row: sort_key(row[args.sort]), reverse=True)
+        rows = rows[: args.limit]
 
-log_file = "app.log"
+    if args.json:
+        for row in rows:
+            print(json.dumps(row, default=str))
+    else:
+        print_table(rows)
 
-# rate_limit_exceeded_servers = set()
-# for log in filter_logs(log_file, level="critical"):
-#     if log.get("platform", "")[:3] == "ph2" or log.get("platform", "")[:3] == "th2":
-#         continue
-#     if log.get("msg", "").startswith("Server side rate limit exceeded."):
-#         rate_limit_exceeded_servers.add(log.get("platform", ""))
-#     print(json.dumps(log, indent=2))
-# print(rate_limit_exceeded_servers)
 
-platform = "jp1.api.riotgames.com"
-for log in get_platform_logs(log_file, platform):
-    if log.get("msg", "").startswith(("Worker started", "Added Rate Limit")):
-        continue
-    print(json.dumps(log, indent=2))
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Iterator, Optional
+import gzip
+import json
+import os
+
+import numpy as np
+
+try:
+    import orjson
+
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+
+CACHE_VERSION = 1
+NAT = np.iinfo(np.int64).min
+
+
+@dataclass
+class Frame:
+    length: int
+    # float64 with NaN for missing values
+    numeric: dict[str, np.ndarray] = field(default_factory=dict)
+    # int32 codes into vocab, -1 for missing values
+    strings: dict[str, np.ndarray] = field(default_factory=dict)
+    vocab: dict[str, list[str]] = field(default_factory=dict)
+    # microseconds since epoch, NAT for missing values
+    timestamp: Optional[np.ndarray] = None
+
+    def columns(self) -> set[str]:
+        return set(self.numeric) | set(self.strings)
+
+    def take(self, mask: np.ndarray, columns: set[str]) -> "Frame":
+        frame = Frame(int(mask.sum()))
+        for name in columns & set(self.numeric):
+            frame.numeric[name] = self.numeric[name][mask]
+        for name in columns & set(self.strings):
+            frame.strings[name] = self.strings[name][mask]
+            frame.vocab[name] = self.vocab[name]
+        if self.timestamp is not None:
+            frame.timestamp = self.timestamp[mask]
+        return frame
+
+
+def read_records(path: Path) -> Iterator[dict[str, Any]]:
+    # rolled segments are gzipped when compressed rotation is on
+    opener = gzip.open if path.suffix == ".gz" else open
+    with opener(path, "rb") as f:
+        for line in f:
+            # skip the run headers written by PerComponentFileRouter
+            if not line.startswith(b"{"):
+                continue
+            try:
+                yield loads(line)
+            except ValueError:
+                continue
+
+
+def encode_strings(values: list[Any]) -> tuple[np.ndarray, list[str]]:
+    index: dict[str, int] = {}
+    codes = np.empty(len(values), dtype=np.int32)
+    for i, value in enumerate(values):
+        if value is None:
+            codes[i] = -1
+            continue
+        value = str(value)
+        code = index.get(value)
+        if code is None:
+            code = len(index)
+            index[value] = code
+        codes[i] = code
+    return codes, list(index)
+
+
+def parse_file(path: Path) -> Frame:
+    records = list(read_records(path))
+    frame = Frame(len(records))
+
+    keys: dict[str, None] = {}
+    for record in records:
+        keys.update(dict.fromkeys(record))
+
+    for key in keys:
+        values = [record.get(key) for record in records]
+        present = [value for value in values if value is not None]
+        # nested values (job reprs, headers) are too bulky to keep
+        if any(isinstance(value, (dict, list)) for value in present):
+            continue
+
+        if key == "timestamp":
+            # numpy warns on the "Z" suffix, every stamp is UTC anyway
+            stamps = np.array(
+                [
+                    value.removesuffix("Z") if isinstance(value, str) else "NaT"
+                    for value in values
+                ],
+                dtype="datetime64[us]",
+            )
+            frame.timestamp = stamps.astype(np.int64)
+        elif all(
+            isinstance(value, (int, float)) and not isinstance(value, bool)
+            for value in present
+        ):
+            frame.numeric[key] = np.array(
+                [np.nan if value is None else value for value in values],
+                dtype=np.float64,
+            )
+        else:
+            frame.strings[key], frame.vocab[key] = encode_strings(values)
+
+    return frame
+
+
+def pack_json(value: Any) -> np.ndarray:
+    return np.frombuffer(json.dumps(value).encode(), dtype=np.uint8)
+
+
+def unpack_json(array: np.ndarray) -> Any:
+    return json.loads(array.tobytes().decode())
+
+
+def cache_path(cache_dir: Path, stat: os.stat_result) -> Path:
+    # keyed by inode, so a cached file survives being renamed by rotation
+    return cache_dir / f"{stat.st_dev}_{stat.st_ino}.npz"
+
+
+def source_key(stat: os.stat_result) -> dict[str, int]:
+    return {
+        "version": CACHE_VERSION,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+    }
+
+
+def save_frame(path: Path, frame: Frame, key: dict[str, int]) -> None:
+    arrays = {
+        "meta": pack_json({**key, "length": frame.length}),
+    }
+    for name, values in frame.numeric.items():
+        arrays[f"n:{name}"] = values
+    for name, codes in frame.strings.items():
+        arrays[f"s:{name}"] = codes
+        arrays[f"v:{name}"] = pack_json(frame.vocab[name])
+    if frame.timestamp is not None:
+        arrays["timestamp"] = frame.timestamp
+
+    # write then rename so a concurrent reader never sees a partial file
+    tmp_path = path.with_suffix(".tmp.npz")
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_frame(path: Path, key: dict[str, int]) -> Optional[Frame]:
+    try:
+        with np.load(path) as data:
+            meta = unpack_json(data["meta"])
+            if any(meta.get(k) != v for k, v in key.items()):
+                return None
+
+            frame = Frame(meta["length"])
+            for name in data.files:
+                kind, _, column = name.partition(":")
+                if kind == "n":
+                    frame.numeric[column] = data[name]
+                elif kind == "s":
+                    frame.strings[column] = data[name]
+                    frame.vocab[column] = unpack_json(data[f"v:{column}"])
+            if "timestamp" in data.files:
+                frame.timestamp = data["timestamp"]
+            return frame
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def read_frame(path: Path, cache_dir: Optional[Path]) -> Frame:
+    if cache_dir is None:
+        return parse_file(path)
+
+    stat = path.stat()
+    key = source_key(stat)
+    cached = cache_path(cache_dir, stat)
+    frame = load_frame(cached, key)
+    if frame is None:
+        frame = parse_file(path)
+        save_frame(cached, frame, key)
+    return frame
+
+
+def prune_cache(cache_dir: Path, paths: list[Path]) -> None:
+    # drop entries of log files that rotated out of existence
+    live = {cache_path(cache_dir, path.stat()).name for path in paths}
+    for entry in cache_dir.glob("*.npz"):
+        if entry.name not in live:
+            entry.unlink(missing_ok=True)
@@ -0,0 +1,454 @@
+"""
+Ingest benchmark for the storage layer.
+
+    python -m benchmarks.ingest                         # throwaway docker postgres
+    python -m benchmarks.ingest --save-baseline         # record new numbers
+    python -m benchmarks.ingest --disposable-dsn postgresql://...
+
+Each concurrency level writes its own slice of the corpus, so levels don't
+conflict. The run fails when throughput, p99 latency or WAL volume regress
+past --tolerance against the baseline file (exit 1), or when there is no
+baseline to compare against (exit 2).
+"""
+
+from dataclasses import asdict, dataclass
+from datetime import timedelta
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Optional
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+import numpy as np
+import psycopg
+import psycopg_pool
+
+from riot_api.types.request import RoutePlatform, RouteRegion
+
+from benchmarks.postgres import disposable_postgres
+from db.matches import claim_matches, insert_match, insert_match_ids
+from db.simplified_match_dto import MatchDTO
+from db.users import claim_users, insert_user
+from simulator.fixtures import (
+    CHAMPION_IDS,
+    STAT_PERKS,
+    build_match,
+    make_puuid,
+    match_id_for,
+)
+from simulator.server import REGION_PLATFORMS
+
+BASELINE_PATH = Path(__file__).with_name("ingest_baseline.json")
+ID_BATCH_SIZE = 100
+USER_BATCH_SIZE = 205
+CLAIM_BATCH_SIZE = 20
+
+Call = Callable[[psycopg_pool.AsyncConnectionPool], Awaitable[int]]
+
+
+@dataclass
+class Result:
+    scenario: str
+    concurrency: int
+    items: int
+    rows: int
+    seconds: float
+    p50_ms: float
+    p99_ms: float
+    wal_bytes: int
+
+    @property
+    def key(self) -> str:
+        return f"{self.scenario}@{self.concurrency}"
+
+    @property
+    def items_per_sec(self) -> float:
+        return self.items / self.seconds if self.seconds else 0.0
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    @property
+    def wal_bytes_per_item(self) -> float:
+        return self.wal_bytes / self.items if self.items else 0.0
+
+    def summary(self) -> dict[str, float]:
+        return {
+            "items_per_sec": round(self.items_per_sec, 2),
+            "rows_per_sec": round(self.rows_per_sec, 2),
+            "p50_ms": round(self.p50_ms, 3),
+            "p99_ms": round(self.p99_ms, 3),
+            "wal_bytes_per_item": round(self.wal_bytes_per_item, 1),
+        }
+
+
+@dataclass
+class CorpusMatch:
+    raw: dict[str, Any]
+    dto: MatchDTO
+
+    @property
+    def rows(self) -> int:
+        info = self.dto.info
+        bans = sum(len(team.bans) for team in info.teams)
+        # match, teams, bans, then participants, stats, challenges and perks
+        return 1 + len(info.teams) + bans + 4 * len(info.participants)
+
+
+def region_of(platform: str) -> RouteRegion:
+    for region, platforms in REGION_PLATFORMS.items():
+        if platform in platforms:
+            return RouteRegion[region]
+    raise ValueError(f"Unknown platform {platform}")
+
+
+def load_corpus(corpus_dir: Optional[Path], size: int, seed: str) -> list[CorpusMatch]:
+    # recorded payloads when given, generated fixtures otherwise
+    if corpus_dir is not None:
+        payloads = [
+            json.loads(path.read_text())
+            for path in sorted(corpus_dir.glob("*.json"))[:size]
+        ]
+    else:
+        players = [make_puuid("NA1", i) for i in range(size * 2)]
+        payloads = [
+            build_match(match_id_for("NA1", seed, i), players) for i in range(size)
+        ]
+    return [CorpusMatch(raw, MatchDTO.model_validate(raw)) for raw in payloads]
+
+
+async def seed_static_data(dsn: str, corpus: list[CorpusMatch]) -> None:
+    # champions and perks are loaded from data dragon in production
+    champions = set(CHAMPION_IDS)
+    perks = set(STAT_PERKS.values())
+    for match in corpus:
+        for participant in match.raw["info"]["participants"]:
+            champions.add(participant["championId"])
+            perks.update(participant["perks"]["statPerks"].values())
+            for style in participant["perks"]["styles"]:
+                perks.update(sel["perk"] for sel in style["selections"])
+        for team in match.raw["info"]["teams"]:
+            champions.update(ban["championId"] for ban in team["bans"])
+    perks.discard(0)
+
+    async with await psycopg.AsyncConnection.connect(dsn) as conn:
+        async with conn.cursor() as cur:
+            await cur.executemany(
+                """
+                INSERT INTO champions (champion_id, champion_name)
+                VALUES (%s, %s)
+                ON CONFLICT DO NOTHING
+                """,
+                [(champion, f"champion_{champion}") for champion in champions],
+            )
+            await cur.executemany(
+                """
+                INSERT INTO perks (perk_id, perk_name)
+                VALUES (%s, %s)
+                ON CONFLICT DO NOTHING
+                """,
+                [(perk, f"perk_{perk}") for perk in perks],
+            )
+
+
+async def wal_lsn(conn: psycopg.AsyncConnection) -> str:
+    cur = await conn.execute("SELECT pg_current_wal_lsn()::text")
+    row = await cur.fetchone()
+    assert row is not None
+    return row[0]
+
+
+async def wal_diff(conn: psycopg.AsyncConnection, before: str) -> int:
+    cur = await conn.execute(
+        "SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), %s::pg_lsn)::bigint", (before,)
+    )
+    row = await cur.fetchone()
+    assert row is not None
+    return row[0]
+
+
+async def run_scenario(
+    dsn: str,
+    scenario: str,
+    concurrency: int,
+    calls: list[Call],
+    repeat_until_empty: bool = False,
+    rows_per_item: int = 1,
+) -> Result:
+    pool = psycopg_pool.AsyncConnectionPool(
+        dsn, min_size=concurrency, max_size=concurrency, open=False
+    )
+    await pool.open(wait=True)
+
+    queue: asyncio.Queue[Call] = asyncio.Queue()
+    for call in calls:
+        queue.put_nowait(call)
+    latencies: list[float] = []
+    items = 0
+
+    async def run_worker():
+        nonlocal items
+        while not queue.empty():
+            call = queue.get_nowait()
+            started = time.perf_counter()
+            count = await call(pool)
+            latencies.append(time.perf_counter() - started)
+            items += count
+            # claims keep going until the backlog is drained
+            if repeat_until_empty and count:
+                queue.put_nowait(call)
+
+    async with await psycopg.AsyncConnection.connect(dsn, autocommit=True) as conn:
+        before = await wal_lsn(conn)
+        started = time.perf_counter()
+        await asyncio.gather(*(run_worker() for _ in range(concurrency)))
+        seconds = time.perf_counter() - started
+        wal_bytes = await wal_diff(conn, before)
+    await pool.close()
+
+    latencies_ms = np.array(latencies) * 1000 if latencies else np.zeros(1)
+    return Result(
+        scenario=scenario,
+        concurrency=concurrency,
+        items=items,
+        rows=items * rows_per_item,
+        seconds=seconds,
+        p50_ms=float(np.percentile(latencies_ms, 50)),
+        p99_ms=float(np.percentile(latencies_ms, 99)),
+        wal_bytes=wal_bytes,
+    )
+
+
+def chunks(items: list, size: int) -> list[list]:
+    return [items[i : i + size] for i in range(0, len(items), size)]
+
+
+async def run_level(
+    dsn: str,
+    concurrency: int,
+    matches: list[CorpusMatch],
+    ids_per_level: int,
+    users_per_level: int,
+    seed: str,
+) -> list[Result]:
+    results = []
+    platform = RoutePlatform.NA1
+    region = RouteRegion.AMERICAS
+
+    # match ids, padded with synthetic ids so there is enough work per worker
+    padding = [
+        match_id_for(platform.name, f"{seed}:{concurrency}:pad", i)
+        for i in range(ids_per_level)
+    ]
+    ids_by_region: dict[RouteRegion, list[str]] = {region: padding}
+    for match in matches:
+        match_region = region_of(match.dto.info.platformId)
+        ids_by_region.setdefault(match_region, []).append(match.dto.metadata.matchId)
+
+    def insert_ids_call(id_region: RouteRegion, batch: list[str]) -> Call:
+        async def call(pool):
+            await insert_match_ids(pool, id_region, batch)
+            return len(batch)
+
+        return call
+
+    calls = [
+        insert_ids_call(id_region, batch)
+        for id_region, ids in ids_by_region.items()
+        for batch in chunks(ids, ID_BATCH_SIZE)
+    ]
+    results.append(await run_scenario(dsn, "insert_match_ids", concurrency, calls))
+
+    # users
+    puuids = [
+        make_puuid(f"{seed}:{concurrency}", i) for i in range(users_per_level)
+    ]
+
+    def insert_users_call(batch: list[str]) -> Call:
+        async def call(pool):
+            await insert_user(pool, platform, batch)
+            return len(batch)
+
+        return call
+
+    calls = [insert_users_call(batch) for batch in chunks(puuids, USER_BATCH_SIZE)]
+    results.append(await run_scenario(dsn, "insert_user", concurrency, calls))
+
+    # claims drain everything claimable in the route; earlier levels' rows
+    # are still leased, so each level only sees its own rows
+    async def claim_matches_call(pool):
+        claimed = await claim_matches(
+            pool, region, CLAIM_BATCH_SIZE, timedelta(minutes=30)
+        )
+        return len(claimed)
+
+    async def claim_users_call(pool):
+        claimed = await claim_users(
+            pool,
+            platform,
+            CLAIM_BATCH_SIZE,
+            timedelta(days=100),
+            timedelta(minutes=30),
+        )
+        return len(claimed)
+
+    results.append(
+        await run_scenario(
+            dsn,
+            "claim_matches",
+            concurrency,
+            [claim_matches_call] * concurrency,
+            repeat_until_empty=True,
+        )
+    )
+    results.append(
+        await run_scenario(
+            dsn,
+            "claim_users",
+            concurrency,
+            [claim_users_call] * concurrency,
+            repeat_until_empty=True,
+        )
+    )
+
+    # full matches
+    def insert_match_call(match: CorpusMatch) -> Call:
+        async def call(pool):
+            await insert_match(pool, match.dto)
+            return 1
+
+        return call
+
+    results.append(
+        await run_scenario(
+            dsn,
+            "insert_match",
+            concurrency,
+            [insert_match_call(match) for match in matches],
+            rows_per_item=matches[0].rows if matches else 0,
+        )
+    )
+    return results
+
+
+def compare(
+    results: list[Result], baseline: dict[str, dict[str, float]], tolerance: float
+) -> list[str]:
+    regressions = []
+    for result in results:
+        base = baseline.get(result.key)
+        if base is None:
+            continue
+        current = result.summary()
+        if current["items_per_sec"] < base["items_per_sec"] * (1 - tolerance):
+            regressions.append(
+                f"{result.key}: {current['items_per_sec']} items/s, "
+                f"baseline {base['items_per_sec']}"
+            )
+        if current["p99_ms"] > base["p99_ms"] * (1 + tolerance):
+            regressions.append(
+                f"{result.key}: p99 {current['p99_ms']}ms, baseline {base['p99_ms']}ms"
+            )
+        if current["wal_bytes_per_item"] > base["wal_bytes_per_item"] * (1 + tolerance):
+            regressions.append(
+                f"{result.key}: {current['wal_bytes_per_item']} WAL bytes/item, "
+                f"baseline {base['wal_bytes_per_item']}"
+            )
+    return regressions
+
+
+def print_results(results: list[Result]) -> None:
+    headers = ["scenario", "items/s", "rows/s", "p50 ms", "p99 ms", "WAL B/item"]
+    print("  ".join(f"{h:>12}" if i else f"{h:<22}" for i, h in enumerate(headers)))
+    for result in results:
+        summary = result.summary()
+        print(
+            f"{result.key:<22}"
+            f"  {summary['items_per_sec']:>12}"
+            f"  {summary['rows_per_sec']:>12}"
+            f"  {summary['p50_ms']:>12}"
+            f"  {summary['p99_ms']:>12}"
+            f"  {summary['wal_bytes_per_item']:>12}"
+        )
+
+
+async def run(args: argparse.Namespace, dsn: str) -> list[Result]:
+    levels = [int(level) for level in args.concurrency.split(",")]
+    seed = args.seed or f"bench-{time.time_ns()}"
+    corpus = load_corpus(args.corpus, args.matches_per_level * len(levels), seed)
+    await seed_static_data(dsn, corpus)
+
+    results = []
+    for i, concurrency in enumerate(levels):
+        matches = corpus[i * args.matches_per_level : (i + 1) * args.matches_per_level]
+        results.extend(
+            await run_level(
+                dsn,
+                concurrency,
+                matches,
+                args.ids_per_level,
+                args.users_per_level,
+                seed,
+            )
+        )
+    return results
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        "--disposable-dsn",
+        help="database to write into instead of a docker container; "
+        "claims lease every claimable row, so never point this at real data",
+    )
+    parser.add_argument("--concurrency", default="1,4,8,16")
+    parser.add_argument("--matches-per-level", type=int, default=250)
+    parser.add_argument("--ids-per-level", type=int, default=10_000)
+    parser.add_argument("--users-per-level", type=int, default=10_000)
+    parser.add_argument("--corpus", type=Path, help="directory of MatchDTO JSON files")
+    parser.add_argument("--seed", help="fixture seed, unique per run by default")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--output", type=Path, help="write results as JSON")
+    return parser.parse_args()
+
+
+async def main() -> int:
+    args = parse_args()
+    if args.disposable_dsn:
+        results = await run(args, args.disposable_dsn)
+    else:
+        async with disposable_postgres() as dsn:
+            results = await run(args, dsn)
+
+    print_results(results)
+    summaries = {result.key: result.summary() for result in results}
+    if args.output:
+        raw = [{**asdict(result), **result.summary()} for result in results]
+        args.output.write_text(json.dumps(raw, indent=2))
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(summaries, indent=2) + "\n")
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+
+    if not args.baseline.exists():
+        print(f"No baseline at {args.baseline}, run with --save-baseline first")
+        return 2
+
+    baseline = json.loads(args.baseline.read_text())
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
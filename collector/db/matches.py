@@ -1,5 +1,7 @@
 from datetime import timedelta
+from typing import Any
 import psycopg_pool
+from psycopg.types.json import Jsonb
 
 from riot_api.types.request import RouteRegion
 
@@ -74,6 +76,104 @@ async def claim_matches(
             return [row[0] for row in rows]
 
 
+async def renew_match_leases(
+    pool: psycopg_pool.AsyncConnectionPool,
+    match_ids: list[str],
+    lease_duration: timedelta = timedelta(minutes=30),
+):
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                UPDATE match_ids
+                SET lease_until = NOW() + %(lease_duration)s
+                WHERE match_id = ANY(%(match_ids)s)
+                    AND queried = False
+                    AND lease_until <> 'infinity'
+                """,
+                {
+                    "match_ids": match_ids,
+                    "lease_duration": lease_duration,
+                },
+            )
+
+
+async def release_matches(
+    pool: psycopg_pool.AsyncConnectionPool,
+    match_ids: list[str],
+):
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                UPDATE match_ids
+                SET lease_until = 'epoch'
+                WHERE match_id = ANY(%(match_ids)s)
+                    AND queried = False
+                    AND lease_until <> 'infinity'
+                """,
+                {"match_ids": match_ids},
+            )
+
+
+async def record_match_failure(
+    pool: psycopg_pool.AsyncConnectionPool,
+    match_id: str,
+) -> int:
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                UPDATE match_ids
+                SET attempts = attempts + 1
+                WHERE match_id = %(match_id)s
+                RETURNING attempts
+                """,
+                {"match_id": match_id},
+            )
+            row = await cur.fetchone()
+            if row is None:
+                raise ValueError(f"Unknown match id {match_id}")
+            return row[0]
+
+
+async def dead_letter_match(
+    pool: psycopg_pool.AsyncConnectionPool,
+    match_id: str,
+    method_name: str,
+    params: dict[str, Any],
+    error: dict[str, Any],
+    attempts: int,
+):
+    # an infinite lease keeps the row out of claim_matches for good
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                WITH dead AS (
+                    UPDATE match_ids
+                    SET lease_until = 'infinity'
+                    WHERE match_id = %(match_id)s
+                    RETURNING match_id, region_name
+                )
+                INSERT INTO dead_letters (
+                    job_kind, job_key, route_name, method_name, params, error, attempts
+                )
+                SELECT
+                    'match', match_id, region_name,
+                    %(method_name)s, %(params)s, %(error)s, %(attempts)s
+                FROM dead
+                """,
+                {
+                    "match_id": match_id,
+                    "method_name": method_name,
+                    "params": Jsonb(params),
+                    "error": Jsonb(error),
+                    "attempts": attempts,
+                },
+            )
+
+
 PERK_VAR_MAP = {
     8004: [],  # The Brazen Perfect
     8005: [1, 2],  # Press the Attack
@@ -297,6 +397,7 @@ async def insert_match(
             "teamId": team_id,
             "teamPosition": participant.teamPosition.name.lower(),
             "participantId": participant_id,
+            "puuid": participant.puuid,
             "championId": participant.championId,
             "summoner1Id": participant.summoner1Id.value,
             "summoner2Id": participant.summoner2Id.value,
@@ -308,6 +409,7 @@ async def insert_match(
             exclude={
                 "teamId",
                 "teamPosition",
+                "puuid",
                 "championId",
                 "summoner1Id",
                 "summoner2Id",
@@ -409,8 +511,25 @@ async def set_match_id_queried(pool: psycopg_pool.AsyncConnectionPool, match_id:
             await cur.execute(
                 """
                 UPDATE match_ids
-                SET queried = true
+                SET queried = true, attempts = 0
                 WHERE match_id = %(match_id)s
                 """,
                 {"match_id": match_id},
             )
+
+
+async def count_match_backlog(pool: psycopg_pool.AsyncConnectionPool) -> dict[str, int]:
+    # answered from idx_match_ids_region_queried_lease_until_match_id
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                SELECT region_name, count(*)
+                FROM match_ids
+                WHERE queried = False
+                    AND lease_until <> 'infinity'
+                GROUP BY region_name
+                """
+            )
+            rows = await cur.fetchall()
+            return {region_name: count for region_name, count in rows}
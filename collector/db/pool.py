@@ -1,34 +1,154 @@
-from typing import Optional
+from collections import deque
+from typing import Callable, Optional
+import asyncio
+import time
+
 import structlog
 import psycopg_pool
 
 logger = structlog.get_logger()
 
-_pool: Optional[psycopg_pool.AsyncConnectionPool] = None
+# claims and lease bookkeeping get their own pool so a burst of bulk writes
+# can't starve them
+CLAIM_POOL = "claim"
+WRITE_POOL = "write"
+DEFAULT_POOL = "default"
 
+_pools: dict[str, "InstrumentedPool"] = {}
 
-async def init_pool(dsn: str, max_size: int = 20) -> None:
-    global _pool
-    if _pool is not None:
-        return
 
-    _pool = psycopg_pool.AsyncConnectionPool(dsn, max_size=max_size)
-    logger.debug("Opening psycopg pool")
-    await _pool.open()
-    logger.info(f"Created psycopg pool with max_size {_pool.max_size}")
+class InstrumentedPool(psycopg_pool.AsyncConnectionPool):
+    def __init__(self, *args, **kwargs) -> None:
+        # called with (pool name, seconds), wired to metrics by the collectors
+        self.on_wait: Optional[Callable[[str, float], None]] = None
+        self.on_usage: Optional[Callable[[str, float], None]] = None
+        # recent acquire waits and the busiest moment since the last resize
+        self.recent_waits: deque[float] = deque(maxlen=4096)
+        self.in_use = 0
+        self.peak_in_use = 0
+        self._checked_out: dict[int, float] = {}
+        super().__init__(*args, **kwargs)
 
+    async def getconn(self, timeout: Optional[float] = None):
+        started = time.monotonic()
+        conn = await super().getconn(timeout)
+        now = time.monotonic()
+        wait = now - started
 
-def get_pool() -> psycopg_pool.AsyncConnectionPool:
-    if _pool is None:
-        raise RuntimeError("Connection pool not initialized. Call init_pool() first.")
-    return _pool
+        self._checked_out[id(conn)] = now
+        self.in_use += 1
+        self.peak_in_use = max(self.peak_in_use, self.in_use)
+        self.recent_waits.append(wait)
+        if self.on_wait is not None:
+            self.on_wait(self.name, wait)
+        return conn
 
+    async def putconn(self, conn) -> None:
+        checked_out = self._checked_out.pop(id(conn), None)
+        await super().putconn(conn)
+        if checked_out is None:
+            return
 
-async def close_pool():
-    global _pool
-    if _pool is None:
+        self.in_use -= 1
+        if self.on_usage is not None:
+            self.on_usage(self.name, time.monotonic() - checked_out)
+
+
+class PoolSizer:
+    def __init__(
+        self,
+        pool: InstrumentedPool,
+        min_size: int,
+        max_size: int,
+        interval: float = 30.0,
+        grow_wait: float = 0.05,
+        shrink_wait: float = 0.005,
+        step: int = 2,
+    ) -> None:
+        self.pool = pool
+        self.min_size = min_size
+        self.max_size = max_size
+        self.interval = interval
+        self.grow_wait = grow_wait
+        self.shrink_wait = shrink_wait
+        self.step = step
+        self.logger = structlog.get_logger("collector").bind(
+            component=f"pool_sizer_{pool.name}"
+        )
+
+    def target(self) -> int:
+        waits = sorted(self.pool.recent_waits)
+        self.pool.recent_waits.clear()
+        peak = self.pool.peak_in_use
+        self.pool.peak_in_use = self.pool.in_use
+
+        current = self.pool.max_size
+        p90 = waits[int(0.9 * (len(waits) - 1))] if waits else 0.0
+        # grow while callers queue for connections, shrink only when nobody
+        # waited and the pool never came close to full
+        if p90 > self.grow_wait:
+            target = current + self.step
+        elif p90 < self.shrink_wait and peak <= current - self.step:
+            target = current - self.step
+        else:
+            target = current
+        target = max(self.min_size, min(self.max_size, target))
+
+        log = self.logger.info if target != current else self.logger.debug
+        log(
+            "Pool sizing decision",
+            pool=self.pool.name,
+            max_size=current,
+            target=target,
+            wait_p90=round(p90, 4),
+            peak_in_use=peak,
+        )
+        return target
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                target = self.target()
+                if target != self.pool.max_size:
+                    min_size = min(self.pool.min_size, target)
+                    await self.pool.resize(min_size, target)
+            except Exception as e:
+                self.logger.warning("Pool sizing failed", exc_info=True, exception=e)
+
+
+async def init_pool(
+    dsn: str,
+    max_size: int = 20,
+    name: str = DEFAULT_POOL,
+    min_size: int = 4,
+) -> None:
+    if name in _pools:
         return
 
-    logger.debug("Closing psycopg pool")
-    await _pool.close()
-    _pool = None
+    pool = InstrumentedPool(
+        dsn,
+        min_size=min(min_size, max_size),
+        max_size=max_size,
+        name=name,
+        open=False,
+    )
+    logger.debug("Opening psycopg pool", pool=name)
+    await pool.open()
+    _pools[name] = pool
+    logger.info(f"Created psycopg pool {name} with max_size {pool.max_size}")
+
+
+def get_pool(name: str = DEFAULT_POOL) -> InstrumentedPool:
+    pool = _pools.get(name)
+    if pool is None:
+        raise RuntimeError(
+            f"Connection pool {name} not initialized. Call init_pool() first."
+        )
+    return pool
+
+
+async def close_pool():
+    for name in list(_pools):
+        logger.debug("Closing psycopg pool", pool=name)
+        await _pools.pop(name).close()
@@ -9,6 +9,7 @@ from riot_api.types.enums import ChampionId
 from riot_api.types.enums import Participant, Team, Position, KaynTransform
 from riot_api.types.base_types import (
     Count,
+    Puuid,
     AmountInt,
     AmountFloat,
     Percentage,
@@ -148,7 +149,7 @@ class ParticipantDTO(BaseModel):
     # playerSubteamId: int
     pushPings: Count
     # profileIcon: int
-    # puuid: Puuid
+    puuid: Puuid
     quadraKills: Count
     # riotIdGameName: str
     # riotIdTagline: str
@@ -531,6 +532,7 @@ INSERT INTO match_participants (
     team_id,
     team_position,
     participant_id,
+    puuid,
     champion_id,
     summoner1_id,
     summoner2_id,
@@ -540,6 +542,7 @@ INSERT INTO match_participants (
     %(teamId)s,
     %(teamPosition)s,
     %(participantId)s,
+    %(puuid)s,
     %(championId)s,
     %(summoner1Id)s,
     %(summoner2Id)s,
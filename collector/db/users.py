@@ -1,5 +1,7 @@
 from datetime import timedelta
+from typing import Any
 import psycopg_pool
+from psycopg.types.json import Jsonb
 from riot_api.types.request import RoutePlatform
 from riot_api.types.base_types import Puuid
 
@@ -59,6 +61,102 @@ async def claim_users(
             return [row[0] for row in rows]
 
 
+async def renew_user_leases(
+    pool: psycopg_pool.AsyncConnectionPool,
+    puuids: list[Puuid],
+    lease_duration: timedelta = timedelta(minutes=30),
+):
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                UPDATE users
+                SET lease_until = NOW() + %(lease_duration)s
+                WHERE puuid = ANY(%(puuids)s)
+                    AND lease_until <> 'infinity'
+                """,
+                {
+                    "puuids": puuids,
+                    "lease_duration": lease_duration,
+                },
+            )
+
+
+async def release_users(
+    pool: psycopg_pool.AsyncConnectionPool,
+    puuids: list[Puuid],
+):
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                UPDATE users
+                SET lease_until = 'epoch'
+                WHERE puuid = ANY(%(puuids)s)
+                    AND lease_until <> 'infinity'
+                """,
+                {"puuids": puuids},
+            )
+
+
+async def record_user_failure(
+    pool: psycopg_pool.AsyncConnectionPool,
+    puuid: Puuid,
+) -> int:
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                UPDATE users
+                SET attempts = attempts + 1
+                WHERE puuid = %(puuid)s
+                RETURNING attempts
+                """,
+                {"puuid": puuid},
+            )
+            row = await cur.fetchone()
+            if row is None:
+                raise ValueError(f"Unknown puuid {puuid}")
+            return row[0]
+
+
+async def dead_letter_user(
+    pool: psycopg_pool.AsyncConnectionPool,
+    puuid: Puuid,
+    method_name: str,
+    params: dict[str, Any],
+    error: dict[str, Any],
+    attempts: int,
+):
+    # an infinite lease keeps the row out of claim_users for good
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                WITH dead AS (
+                    UPDATE users
+                    SET lease_until = 'infinity'
+                    WHERE puuid = %(puuid)s
+                    RETURNING puuid, platform_name
+                )
+                INSERT INTO dead_letters (
+                    job_kind, job_key, route_name, method_name, params, error, attempts
+                )
+                SELECT
+                    'user', puuid, platform_name,
+                    %(method_name)s, %(params)s, %(error)s, %(attempts)s
+                FROM dead
+                """,
+                {
+                    "puuid": puuid,
+                    "method_name": method_name,
+                    "params": Jsonb(params),
+                    "error": Jsonb(error),
+                    "attempts": attempts,
+                },
+            )
+
+
 async def update_match_id_query_date(
     pool: psycopg_pool.AsyncConnectionPool,
     puuid: Puuid,
@@ -68,8 +166,29 @@ async def update_match_id_query_date(
             await cur.execute(
                 """
                 UPDATE users
-                SET match_id_queried = CURRENT_DATE
+                SET match_id_queried = CURRENT_DATE, attempts = 0
                 WHERE puuid = %(puuid)s
                 """,
                 {"puuid": puuid},
             )
+
+
+async def count_user_backlog(
+    pool: psycopg_pool.AsyncConnectionPool,
+    last_queried: timedelta = timedelta(days=100),
+) -> dict[str, int]:
+    # answered from idx_users_platform_matchq
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                SELECT platform_name, count(*)
+                FROM users
+                WHERE match_id_queried < NOW() - %(last_queried)s
+                    AND lease_until <> 'infinity'
+                GROUP BY platform_name
+                """,
+                {"last_queried": last_queried},
+            )
+            rows = await cur.fetchall()
+            return {platform_name: count for platform_name, count in rows}
@@ -0,0 +1,158 @@
+from typing import Awaitable, Callable, Iterator, Optional
+import asyncio
+import math
+import time
+
+from riot_api import RateLimitClient
+import structlog
+
+
+class WorkerPool:
+    def __init__(
+        self,
+        name: str,
+        spawn: Callable[..., Awaitable[None]],
+        worker_ids: Iterator[int],
+        min_workers: int = 1,
+        max_workers: int = 8,
+        latency_alpha: float = 0.2,
+    ) -> None:
+        self.name = name
+        self.spawn = spawn
+        self.worker_ids = worker_ids
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.latency_alpha = latency_alpha
+
+        # exponentially weighted mean of response latency in seconds
+        self.latency: Optional[float] = None
+        self._workers: dict[asyncio.Task, asyncio.Event] = {}
+        self._started = False
+        self.logger = structlog.get_logger("collector").bind(
+            component=f"worker_pool_{name}"
+        )
+
+    def __len__(self) -> int:
+        # workers asked to stop are still finishing their current job
+        return sum(not stop.is_set() for stop in self._workers.values())
+
+    @property
+    def finished(self) -> bool:
+        return self._started and not self._workers
+
+    def observe_latency(self, seconds: float) -> None:
+        if self.latency is None:
+            self.latency = seconds
+        else:
+            self.latency += self.latency_alpha * (seconds - self.latency)
+
+    def scale_to(self, target: int) -> None:
+        # workers that ran out of jobs are not brought back
+        if self.finished:
+            return
+        target = max(self.min_workers, min(self.max_workers, target))
+
+        active = [task for task, stop in self._workers.items() if not stop.is_set()]
+        for _ in range(target - len(active)):
+            stop_worker = asyncio.Event()
+            task = asyncio.create_task(
+                self.spawn(
+                    worker_id=next(self.worker_ids),
+                    stop_worker=stop_worker,
+                    observe_latency=self.observe_latency,
+                )
+            )
+            task.add_done_callback(self._on_done)
+            self._workers[task] = stop_worker
+            self._started = True
+
+        # stop the newest workers first
+        for task in reversed(active[target:]):
+            self._workers[task].set()
+
+        if target != len(active):
+            self.logger.debug(f"Scaled from {len(active)} to {target} workers")
+
+    def _on_done(self, task: asyncio.Task) -> None:
+        self._workers.pop(task, None)
+
+    async def wait(self) -> None:
+        while self._workers:
+            await asyncio.wait(list(self._workers))
+
+    async def cancel(self) -> None:
+        tasks = list(self._workers)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class Autoscaler:
+    def __init__(
+        self,
+        pool: WorkerPool,
+        client: RateLimitClient,
+        limit_keys: list[tuple[str, str]],
+        interval: float = 10.0,
+        utilization: float = 0.9,
+    ) -> None:
+        self.pool = pool
+        # the client the workers send through, so its limiter sees their usage
+        self.client = client
+        self.limit_keys = limit_keys
+        self.interval = interval
+        self.utilization = utilization
+
+        # last decision, kept around for metrics
+        self.budget_rate: Optional[float] = None
+        self.target: int = pool.min_workers
+        self.logger = structlog.get_logger("collector").bind(
+            component=f"autoscaler_{pool.name}"
+        )
+
+    async def get_budget_rate(self) -> float:
+        # requests/sec that would spend the remaining budget of the tightest
+        # window exactly by its reset
+        now = time.time()
+        rate = math.inf
+        for key in self.limit_keys:
+            limit = self.client.limits[key]
+            window = await self.client.limiter.get_window_stats(limit, *key)
+            reset_in = max(window.reset_time - now, 1.0)
+            rate = min(rate, window.remaining / reset_in)
+        return rate
+
+    async def decide(self) -> None:
+        latency = self.pool.latency
+        if latency is None:
+            return
+
+        # little's law: in-flight requests = throughput * latency
+        self.budget_rate = await self.get_budget_rate()
+        target = math.ceil(self.budget_rate * latency * self.utilization)
+        target = max(self.pool.min_workers, min(self.pool.max_workers, target))
+
+        current = len(self.pool)
+        log = self.logger.info if target != current else self.logger.debug
+        log(
+            "Autoscaler decision",
+            route=self.pool.name,
+            workers=current,
+            target=target,
+            latency=round(latency, 4),
+            budget_rate=round(self.budget_rate, 3),
+        )
+        self.target = target
+        self.pool.scale_to(target)
+
+    async def run(self) -> None:
+        while not self.pool.finished:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.decide()
+            except Exception as e:
+                self.logger.critical(
+                    "Autoscaler failed to decide",
+                    exc_info=True,
+                    exception=e,
+                )
@@ -0,0 +1,151 @@
+from collections import deque
+from enum import Enum
+from typing import Awaitable, Callable, Optional
+import asyncio
+import time
+
+import structlog
+
+from execution.lease import LeaseTracker
+from execution.query_job import QueryJob
+from execution.retry import RetryScheduler
+
+
+class BreakerState(Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: float = 0.5,
+        min_requests: int = 10,
+        window: float = 60.0,
+        open_duration: float = 30.0,
+        max_open_duration: float = 600.0,
+        on_open: Optional[Callable[[], Awaitable[None]]] = None,
+    ) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.min_requests = min_requests
+        self.window = window
+        self.base_open_duration = open_duration
+        self.max_open_duration = max_open_duration
+        self.on_open = on_open
+
+        self._state = BreakerState.CLOSED
+        self._outcomes: deque[tuple[float, bool]] = deque()
+        self._open_duration = open_duration
+        self._opened_until = 0.0
+        self._probing = False
+        self._tasks: set[asyncio.Task] = set()
+        self.logger = structlog.get_logger("collector").bind(
+            component=f"breaker_{name}"
+        )
+
+    @property
+    def state(self) -> BreakerState:
+        if (
+            self._state is BreakerState.OPEN
+            and time.monotonic() >= self._opened_until
+        ):
+            self._state = BreakerState.HALF_OPEN
+            self._probing = False
+            self.logger.info("Circuit half-open, probing with a single request")
+        return self._state
+
+    def is_open(self) -> bool:
+        return self.state is BreakerState.OPEN
+
+    def accepts_jobs(self) -> bool:
+        state = self.state
+        if state is BreakerState.HALF_OPEN:
+            return not self._probing
+        return state is BreakerState.CLOSED
+
+    def try_acquire(self) -> bool:
+        state = self.state
+        if state is BreakerState.CLOSED:
+            return True
+        if state is BreakerState.HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def release(self) -> None:
+        # the probe was dropped without an answer, let another request probe
+        if self._state is BreakerState.HALF_OPEN:
+            self._probing = False
+
+    def record_success(self) -> None:
+        if self._state is BreakerState.HALF_OPEN:
+            self._close()
+            return
+        if self._state is BreakerState.OPEN:
+            return
+
+        self._record(False)
+
+    def record_failure(self) -> None:
+        if self._state is BreakerState.HALF_OPEN:
+            self._open_duration = min(self._open_duration * 2, self.max_open_duration)
+            self._open()
+            return
+        if self._state is BreakerState.OPEN:
+            return
+
+        self._record(True)
+        failures = sum(failed for _, failed in self._outcomes)
+        if (
+            len(self._outcomes) >= self.min_requests
+            and failures / len(self._outcomes) >= self.failure_threshold
+        ):
+            self._open()
+
+    def _record(self, failed: bool) -> None:
+        now = time.monotonic()
+        self._outcomes.append((now, failed))
+        while self._outcomes and self._outcomes[0][0] < now - self.window:
+            self._outcomes.popleft()
+
+    def _open(self) -> None:
+        self._state = BreakerState.OPEN
+        self._opened_until = time.monotonic() + self._open_duration
+        self._probing = False
+        self._outcomes.clear()
+        self.logger.critical(
+            f"Circuit opened for {self._open_duration:.0f}s, pausing route",
+            open_duration=self._open_duration,
+        )
+
+        if self.on_open is not None:
+            task = asyncio.get_running_loop().create_task(self.on_open())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def _close(self) -> None:
+        self._state = BreakerState.CLOSED
+        self._open_duration = self.base_open_duration
+        self._probing = False
+        self._outcomes.clear()
+        self.logger.info("Circuit closed, resuming route")
+
+
+async def release_route_work(
+    job_queue: asyncio.Queue[QueryJob],
+    retry_scheduler: RetryScheduler,
+    leases: LeaseTracker,
+) -> None:
+    # drop everything queued or waiting for a retry; the rows themselves are
+    # handed back to the database and claimed again once the route recovers.
+    # Jobs in flight keep their leases until they complete or abandon them,
+    # so no other collector claims a row that is still being worked on
+    drained = retry_scheduler.cancel_all()
+    while not job_queue.empty():
+        drained.append(job_queue.get_nowait())
+    await leases.abandon_many(
+        [job.lease for job in drained if job.lease is not None]
+    )
@@ -0,0 +1,42 @@
+from typing import Optional
+
+import httpx
+from riot_api import RateLimitClient
+
+
+class Redirect:
+    # request event hook sending every request to base_url; the Host header
+    # still names the original platform or region, which is how the
+    # simulator routes them. Hooks run before httpx picks the transport.
+    def __init__(self, base_url: str):
+        self.base_url = httpx.URL(base_url)
+
+    def url(self, url: httpx.URL) -> httpx.URL:
+        return url.copy_with(
+            scheme=self.base_url.scheme,
+            host=self.base_url.host,
+            port=self.base_url.port,
+        )
+
+    async def __call__(self, request: httpx.Request) -> None:
+        request.url = self.url(request.url)
+
+
+def create_client(api_key: str, base_url: Optional[str] = None) -> RateLimitClient:
+    client = RateLimitClient(api_key)
+    if not base_url:
+        return client
+
+    redirect = Redirect(base_url)
+    http_clients = [
+        value for value in vars(client).values() if isinstance(value, httpx.AsyncClient)
+    ]
+    if not http_clients:
+        raise RuntimeError("RateLimitClient has no httpx.AsyncClient to redirect")
+    for http_client in http_clients:
+        # event_hooks is public httpx API, unlike the client's transport
+        hooks = http_client.event_hooks
+        http_client.event_hooks = {**hooks, "request": [*hooks["request"], redirect]}
+        if redirect not in http_client.event_hooks["request"]:
+            raise RuntimeError("Failed to install the RIOT_API_BASE_URL redirect")
+    return client
@@ -0,0 +1,114 @@
+from datetime import timedelta
+from typing import Awaitable, Callable, Optional
+import asyncio
+
+import structlog
+
+
+class Lease:
+    def __init__(self, tracker: "LeaseTracker", key: str) -> None:
+        self.tracker = tracker
+        self.key = key
+        # number of queued or running jobs that still need this lease
+        self.holders = 0
+        self.abandoned = False
+
+    async def complete(self) -> None:
+        """Drop one holder; the row is done so the lease is left to expire."""
+        await self.tracker.drop(self, release=False)
+
+    async def abandon(self) -> None:
+        """Drop one holder; the row is released once no job holds it anymore."""
+        self.abandoned = True
+        await self.tracker.drop(self, release=True)
+
+
+class LeaseTracker:
+    def __init__(
+        self,
+        name: str,
+        release: Callable[[list[str]], Awaitable[None]],
+        renew: Callable[[list[str], timedelta], Awaitable[None]],
+        lease_duration: timedelta,
+    ) -> None:
+        self.name = name
+        self.release = release
+        self.renew = renew
+        self.lease_duration = lease_duration
+        self._leases: dict[str, Lease] = {}
+        self.logger = structlog.get_logger("collector").bind(
+            component=f"lease_{name}"
+        )
+
+    def __len__(self) -> int:
+        return len(self._leases)
+
+    def acquire(self, key: str) -> Lease:
+        lease = self._leases.get(key)
+        if lease is None:
+            lease = Lease(self, key)
+            self._leases[key] = lease
+        lease.holders += 1
+        return lease
+
+    def _drop_holder(self, lease: Lease) -> bool:
+        # True once the last holder is gone; the lease may already be gone
+        # after release_all
+        if self._leases.get(lease.key) is not lease:
+            return False
+
+        lease.holders -= 1
+        if lease.holders > 0:
+            return False
+
+        del self._leases[lease.key]
+        return True
+
+    async def drop(self, lease: Lease, release: bool) -> None:
+        if self._drop_holder(lease) and (release or lease.abandoned):
+            await self.release([lease.key])
+            self.logger.debug("Released lease", key=lease.key)
+
+    async def abandon_many(self, leases: list[Lease]) -> None:
+        """Lease.abandon for many jobs, with one release for the freed rows."""
+        keys = []
+        for lease in leases:
+            lease.abandoned = True
+            if self._drop_holder(lease):
+                keys.append(lease.key)
+        if not keys:
+            return
+
+        await self.release(keys)
+        self.logger.info(f"Released {len(keys)} leases")
+
+    async def release_all(self) -> None:
+        keys = list(self._leases)
+        self._leases.clear()
+        if not keys:
+            return
+
+        await self.release(keys)
+        self.logger.info(f"Released {len(keys)} leases")
+
+    async def heartbeat(self, interval: Optional[timedelta] = None) -> None:
+        # renew well before expiry so a slow renewal can't lose the lease
+        if interval is None:
+            interval = self.lease_duration / 3
+
+        while True:
+            await asyncio.sleep(interval.total_seconds())
+
+            keys = list(self._leases)
+            if not keys:
+                continue
+
+            try:
+                await self.renew(keys, self.lease_duration)
+                self.logger.debug(f"Renewed {len(keys)} leases")
+            except Exception as e:
+                self.logger.critical(
+                    "Failed to renew leases",
+                    exc_info=True,
+                    exception=e,
+                )
@@ -0,0 +1,284 @@
+from collections import Counter, deque
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Optional
+import __main__
+import asyncio
+import json
+import signal
+import sys
+import threading
+import time
+
+import structlog
+
+from metrics.server import add_route
+
+_profiler: Optional["Profiler"] = None
+
+
+def frame_name(code) -> str:
+    return f"{code.co_qualname} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+
+
+def callback_name(callback) -> str:
+    # task steps are reported under the coroutine they resume
+    task = getattr(callback, "__self__", None)
+    if isinstance(task, asyncio.Task):
+        coro = task.get_coro()
+        return getattr(coro, "__qualname__", task.get_name())
+    return getattr(callback, "__qualname__", repr(callback))
+
+
+def count_tasks() -> dict[str, int]:
+    counts = Counter(
+        getattr(task.get_coro(), "__qualname__", task.get_name())
+        for task in asyncio.all_tasks()
+    )
+    return dict(counts.most_common())
+
+
+class Profiler:
+    def __init__(
+        self,
+        profile_dir: str = ".",
+        interval: float = 0.005,
+        slow_callback: float = 0.1,
+        max_duration: float = 300.0,
+    ) -> None:
+        self.profile_dir = Path(profile_dir)
+        self.interval = interval
+        self.slow_callback = slow_callback
+        self.max_duration = max_duration
+
+        # the event loop thread, stacks of other threads are ignored
+        self.thread_id = threading.get_ident()
+        self.started: Optional[float] = None
+        self._started_at: Optional[datetime] = None
+        self._sampler: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._deadline: Optional[asyncio.TimerHandle] = None
+        self._pending: set[asyncio.Task] = set()
+        self._original_run = None
+
+        self._stacks: Counter[tuple[str, ...]] = Counter()
+        self._callback_time: Counter[str] = Counter()
+        self._callback_calls: Counter[str] = Counter()
+        self._slow: deque[tuple[str, float, float]] = deque(maxlen=1000)
+        self._tasks_at_start: dict[str, int] = {}
+        self.logger = structlog.get_logger("collector").bind(component="profiling")
+
+    @property
+    def active(self) -> bool:
+        return self.started is not None
+
+    def _sample(self) -> None:
+        current_frames = sys._current_frames
+        while not self._stopping.wait(self.interval):
+            frame = current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame_name(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self._stacks[tuple(reversed(stack))] += 1
+
+    def _patch_handles(self) -> None:
+        # time every callback the loop runs, restored when profiling stops
+        original = asyncio.events.Handle._run
+        profiler = self
+
+        def _run(handle):
+            started = time.perf_counter()
+            try:
+                original(handle)
+            finally:
+                elapsed = time.perf_counter() - started
+                name = callback_name(handle._callback)
+                profiler._callback_time[name] += elapsed
+                profiler._callback_calls[name] += 1
+                if elapsed >= profiler.slow_callback:
+                    profiler._slow.append((name, elapsed, time.time()))
+
+        self._original_run = original
+        asyncio.events.Handle._run = _run
+
+    def _unpatch_handles(self) -> None:
+        if self._original_run is not None:
+            asyncio.events.Handle._run = self._original_run
+            self._original_run = None
+
+    def start(self) -> bool:
+        if self.active:
+            return False
+
+        self._stacks.clear()
+        self._callback_time.clear()
+        self._callback_calls.clear()
+        self._slow.clear()
+        self._tasks_at_start = count_tasks()
+        self._patch_handles()
+
+        self._stopping.clear()
+        self._sampler = threading.Thread(
+            target=self._sample, name="profiler", daemon=True
+        )
+        self._sampler.start()
+        self.started = time.monotonic()
+        self._started_at = datetime.now()
+
+        # a forgotten profile must not run forever
+        loop = asyncio.get_running_loop()
+        self._deadline = loop.call_later(self.max_duration, self.toggle)
+        self.logger.info(
+            "Profiling started",
+            interval=self.interval,
+            slow_callback=self.slow_callback,
+            max_duration=self.max_duration,
+        )
+        return True
+
+    async def stop(self) -> Optional[tuple[Path, Path]]:
+        if self.started is None:
+            return None
+
+        duration = time.monotonic() - self.started
+        self.started = None
+        if self._deadline is not None:
+            self._deadline.cancel()
+            self._deadline = None
+        self._unpatch_handles()
+        self._stopping.set()
+        if self._sampler is not None:
+            await asyncio.to_thread(self._sampler.join)
+            self._sampler = None
+
+        report = self.report(duration)
+        stacks = dict(self._stacks)
+        paths = await asyncio.to_thread(self.write, report, stacks)
+        self.logger.info(
+            "Profiling stopped",
+            duration=round(duration, 2),
+            samples=report["samples"],
+            slow_callbacks=len(report["slow_callbacks"]),
+            report=str(paths[0]),
+            stacks=str(paths[1]),
+        )
+        return paths
+
+    def toggle(self) -> None:
+        # signal handlers and timers are plain callbacks, stop needs a task
+        if not self.active:
+            self.start()
+            return
+        task = asyncio.get_running_loop().create_task(self.stop())
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    def report(self, duration: float, top: int = 50) -> dict[str, Any]:
+        samples = sum(self._stacks.values())
+        own: Counter[str] = Counter()
+        total: Counter[str] = Counter()
+        for stack, count in self._stacks.items():
+            own[stack[-1]] += count
+            # recursion counts once per sample
+            for name in set(stack):
+                total[name] += count
+
+        def share(count: int) -> float:
+            return round(count / samples, 4) if samples else 0.0
+
+        return {
+            "started": self._started_at.isoformat() if self._started_at else None,
+            "duration": round(duration, 3),
+            "interval": self.interval,
+            "samples": samples,
+            "self": [
+                {"function": name, "samples": count, "share": share(count)}
+                for name, count in own.most_common(top)
+            ],
+            "total": [
+                {"function": name, "samples": count, "share": share(count)}
+                for name, count in total.most_common(top)
+            ],
+            "callbacks": [
+                {
+                    "name": name,
+                    "calls": self._callback_calls[name],
+                    "seconds": round(seconds, 4),
+                }
+                for name, seconds in self._callback_time.most_common(top)
+            ],
+            "slow_callbacks": [
+                {
+                    "name": name,
+                    "seconds": round(seconds, 4),
+                    "at": datetime.fromtimestamp(at).isoformat(),
+                }
+                for name, seconds, at in self._slow
+            ],
+            "tasks_at_start": self._tasks_at_start,
+            "tasks_at_stop": count_tasks(),
+        }
+
+    def write(
+        self, report: dict[str, Any], stacks: dict[tuple[str, ...], int]
+    ) -> tuple[Path, Path]:
+        entry_name = Path(__main__.__file__).stem
+        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        report_path = self.profile_dir / f"{entry_name}.profile_{timestamp}.json"
+        report_path.write_text(json.dumps(report, indent=2))
+
+        # collapsed stacks, readable by flamegraph.pl and speedscope
+        stacks_path = self.profile_dir / f"{entry_name}.profile_{timestamp}.folded"
+        with stacks_path.open("w") as f:
+            for stack, count in stacks.items():
+                f.write(f"{';'.join(stack)} {count}\n")
+        return report_path, stacks_path
+
+
+async def profile_start() -> tuple[str, bytes]:
+    assert _profiler is not None
+    started = _profiler.start()
+    return "application/json", json.dumps({"started": started}).encode()
+
+
+async def profile_stop() -> tuple[str, bytes]:
+    assert _profiler is not None
+    paths = await _profiler.stop()
+    body = {"stopped": paths is not None}
+    if paths is not None:
+        body.update(report=str(paths[0]), stacks=str(paths[1]))
+    return "application/json", json.dumps(body).encode()
+
+
+async def tasks() -> tuple[str, bytes]:
+    return "application/json", json.dumps(count_tasks()).encode()
+
+
+def configure_profiling(
+    *,
+    profile_dir: str = ".",
+    interval: float = 0.005,
+    slow_callback: float = 0.1,
+    max_duration: float = 300.0,
+) -> None:
+    # must run on the event loop thread; SIGUSR1 toggles the profiler and the
+    # metrics server exposes the same controls
+    global _profiler
+    _profiler = Profiler(
+        profile_dir=profile_dir,
+        interval=interval,
+        slow_callback=slow_callback,
+        max_duration=max_duration,
+    )
+    loop = asyncio.get_running_loop()
+    if hasattr(signal, "SIGUSR1"):
+        loop.add_signal_handler(signal.SIGUSR1, _profiler.toggle)
+    add_route("/profile/start", profile_start)
+    add_route("/profile/stop", profile_stop)
+    add_route("/tasks", tasks)
+
+
+def get_profiler() -> Optional[Profiler]:
+    return _profiler
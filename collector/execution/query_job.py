@@ -4,11 +4,17 @@ from abc import ABC, abstractmethod
 import asyncio
 
 from riot_api import RateLimitClient
+from pydantic import BaseModel, RootModel
 import httpx
 import structlog
 
+from execution.lease import Lease
+
 T = TypeVar("T")
 
+# what the client validates a body into when the job decodes it itself
+RawResponse = RootModel[dict[str, Any]]
+
 
 def default_increment(
     logger: structlog.BoundLogger,
@@ -49,6 +55,29 @@ async def default_on_completion(
     pass
 
 
+async def default_record_failure(
+    logger: structlog.BoundLogger,
+    query_job: "QueryJob[T]",
+    exc: Exception,
+) -> int:
+    return query_job.attempt + 1
+
+
+async def default_on_dead_letter(
+    logger: structlog.BoundLogger,
+    query_job: "QueryJob[T]",
+    exc: Exception,
+    attempts: int,
+):
+    logger.critical(
+        "Query job gave up after retries",
+        method=query_job.method_name,
+        params=query_job.params,
+        attempts=attempts,
+        error=str(exc),
+    )
+
+
 @dataclass(frozen=True)
 class QueryJob(Generic[T]):
     method_name: str
@@ -86,12 +115,50 @@ class QueryJob(Generic[T]):
         ],
         Awaitable[None],
     ] = field(default=default_on_completion, repr=False)
+    record_failure: Callable[
+        [
+            structlog.BoundLogger,
+            "QueryJob[T]",
+            Exception,
+        ],
+        Awaitable[int],
+    ] = field(default=default_record_failure, repr=False)
+    on_dead_letter: Callable[
+        [
+            structlog.BoundLogger,
+            "QueryJob[T]",
+            Exception,
+            int,
+        ],
+        Awaitable[None],
+    ] = field(default=default_on_dead_letter, repr=False)
+    lease: Optional[Lease] = field(default=None, repr=False)
+    # validated by the worker instead of the client, see decode()
+    response_model: Optional[type[BaseModel]] = field(default=None, repr=False)
+    attempt: int = 0
+
+    @property
+    def route_name(self) -> str:
+        route = self.params.get("region") or self.params.get("platform")
+        if route is None:
+            raise ValueError
+        return route.name
 
     def get_method(self, client: RateLimitClient) -> Callable[..., Awaitable[T]]:
         return getattr(client, self.method_name)
 
     async def execute(self, client: RateLimitClient) -> T:
-        return await self.get_method(client)(**self.params)
+        if self.response_model is None:
+            return await self.get_method(client)(**self.params)
+        return await self.get_method(client)(
+            **self.params, response_model=RawResponse
+        )
+
+    def decode(self, result: Any) -> T:
+        # the client only checked that the body is a JSON object
+        if self.response_model is None:
+            return result
+        return self.response_model.model_validate(result.root)
 
     def next(
         self,
@@ -119,6 +186,29 @@ class QueryJob(Generic[T]):
     async def run_on_completion(self, logger: structlog.BoundLogger) -> None:
         await self.on_completion(logger, self)
 
+    async def run_record_failure(
+        self,
+        logger: structlog.BoundLogger,
+        exc: Exception,
+    ) -> int:
+        return await self.record_failure(logger, self, exc)
+
+    async def run_on_dead_letter(
+        self,
+        logger: structlog.BoundLogger,
+        exc: Exception,
+        attempts: int,
+    ) -> None:
+        await self.on_dead_letter(logger, self, exc, attempts)
+
+    async def complete_lease(self) -> None:
+        if self.lease is not None:
+            await self.lease.complete()
+
+    async def abandon_lease(self) -> None:
+        if self.lease is not None:
+            await self.lease.abandon()
+
 
 class BaseJobFactory(ABC, Generic[T]):
     @abstractmethod
@@ -131,11 +221,13 @@ async def refill_queue(
     queue: asyncio.Queue[QueryJob[T]],
     threshold: int,
     sleep_time: float = 0.1,
+    paused: Optional[Callable[[], bool]] = None,
 ):
     logger = structlog.get_logger("collector").bind(component="refill_queue")
 
     while True:
-        while queue.qsize() >= threshold:
+        # don't claim more work while the route is paused
+        while queue.qsize() >= threshold or (paused is not None and paused()):
             await asyncio.sleep(sleep_time)
 
         job_list = await factory.produce()
@@ -0,0 +1,100 @@
+from dataclasses import dataclass
+from enum import Enum
+from typing import Any
+import asyncio
+import random
+
+import httpx
+from riot_api.exceptions import (
+    BadRequestError,
+    ForbiddenError,
+    NotFoundError,
+    ServerError,
+)
+
+from execution.query_job import QueryJob
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    max_attempts: int
+    base_delay: float = 1.0
+    max_delay: float = 60.0
+
+    def backoff(self, attempts: int) -> float:
+        # exponential backoff with equal jitter, so retries of jobs that failed
+        # together don't hit the server together again
+        delay = min(self.max_delay, self.base_delay * 2 ** max(attempts - 1, 0))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+
+# checked in order, first matching class wins
+RETRY_POLICIES: list[tuple[type[Exception], RetryPolicy]] = [
+    (ServerError, RetryPolicy(max_attempts=5, base_delay=10, max_delay=300)),
+    (httpx.HTTPError, RetryPolicy(max_attempts=5, base_delay=2, max_delay=120)),
+    # recently finished matches can 404 for a short while
+    (NotFoundError, RetryPolicy(max_attempts=3, base_delay=60, max_delay=600)),
+    (BadRequestError, RetryPolicy(max_attempts=1)),
+    (ForbiddenError, RetryPolicy(max_attempts=1)),
+    (Exception, RetryPolicy(max_attempts=3, base_delay=5, max_delay=60)),
+]
+
+
+def get_retry_policy(exc: Exception) -> RetryPolicy:
+    for exc_type, policy in RETRY_POLICIES:
+        if isinstance(exc, exc_type):
+            return policy
+    raise ValueError(f"No retry policy for {type(exc).__name__}")
+
+
+def error_payload(exc: Exception) -> dict[str, Any]:
+    payload: dict[str, Any] = {
+        "type": type(exc).__name__,
+        "message": str(exc),
+    }
+    for attr in ("status_code", "body"):
+        value = getattr(exc, attr, None)
+        if value is not None:
+            payload[attr] = value if isinstance(value, (int, str)) else str(value)
+    return payload
+
+
+def params_payload(params: dict[str, Any]) -> dict[str, Any]:
+    payload = {}
+    for key, value in params.items():
+        if isinstance(value, Enum):
+            value = value.name
+        elif isinstance(value, type):
+            value = value.__name__
+        payload[key] = value
+    return payload
+
+
+class RetryScheduler:
+    def __init__(self, job_queue: asyncio.Queue[QueryJob]) -> None:
+        self.job_queue = job_queue
+        self._pending: dict[asyncio.TimerHandle, QueryJob] = {}
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def schedule(self, query_job: QueryJob, delay: float) -> None:
+        # requeue later instead of sleeping, so the worker keeps serving
+        # other jobs meanwhile
+        loop = asyncio.get_running_loop()
+        handle: asyncio.TimerHandle
+
+        def requeue():
+            del self._pending[handle]
+            self.job_queue.put_nowait(query_job)
+
+        handle = loop.call_later(delay, requeue)
+        self._pending[handle] = query_job
+
+    def cancel_all(self) -> list[QueryJob]:
+        for handle in self._pending:
+            handle.cancel()
+        jobs = list(self._pending.values())
+        self._pending.clear()
+        return jobs
@@ -0,0 +1,197 @@
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+from typing import ContextManager, Iterator, Optional
+import __main__
+import asyncio
+import itertools
+import json
+import random
+import time
+
+import structlog
+
+_tracer: Optional["Tracer"] = None
+_current: ContextVar[Optional["JobTrace"]] = ContextVar("job_trace", default=None)
+_NULL = nullcontext()
+
+
+class JobTrace:
+    def __init__(self, trace_id: int, route: str, method: str, sampled: bool):
+        self.trace_id = trace_id
+        self.route = route
+        self.method = method
+        self.sampled = sampled
+        self.started = time.monotonic()
+        self.duration = 0.0
+        # exclusive time per stage, children are subtracted from their parent
+        self.stages: dict[str, float] = {}
+        # time spent in children of each open span
+        self._children: list[float] = [0.0]
+        # (stage, start, duration) for sampled jobs
+        self.events: list[tuple[str, float, float]] = []
+
+    @contextmanager
+    def span(self, stage: str) -> Iterator[None]:
+        self._children.append(0.0)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            duration = time.monotonic() - started
+            children = self._children.pop()
+            self._children[-1] += duration
+            self.stages[stage] = self.stages.get(stage, 0.0) + duration - children
+            if self.sampled:
+                self.events.append((stage, started, duration))
+
+
+def percentile(ordered: list[float], q: float) -> float:
+    # nearest rank
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Tracer:
+    def __init__(
+        self,
+        interval: float = 60.0,
+        sample_rate: float = 0.0,
+        trace_dir: str = ".",
+        buffer_size: int = 4096,
+        max_sampled: int = 1000,
+    ) -> None:
+        self.interval = interval
+        self.sample_rate = sample_rate
+        self.trace_dir = Path(trace_dir)
+        self.buffer_size = buffer_size
+
+        # ring buffers of exclusive stage durations, reset every summary
+        self._durations: dict[tuple[str, str, str], deque[float]] = {}
+        self._sampled: deque[JobTrace] = deque(maxlen=max_sampled)
+        self._ids = itertools.count()
+        self.logger = structlog.get_logger("collector").bind(component="tracing")
+
+    def _record(self, key: tuple[str, str, str], duration: float) -> None:
+        durations = self._durations.get(key)
+        if durations is None:
+            durations = deque(maxlen=self.buffer_size)
+            self._durations[key] = durations
+        durations.append(duration)
+
+    @contextmanager
+    def job(self, route: str, method: str) -> Iterator[JobTrace]:
+        sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        trace = JobTrace(next(self._ids), route, method, sampled)
+        token = _current.set(trace)
+        try:
+            yield trace
+        finally:
+            _current.reset(token)
+            trace.duration = time.monotonic() - trace.started
+            self._record((route, method, "total"), trace.duration)
+            for stage, duration in trace.stages.items():
+                self._record((route, method, stage), duration)
+            if sampled:
+                self._sampled.append(trace)
+
+    def summarise(self) -> None:
+        for (route, method, stage), durations in self._durations.items():
+            if not durations:
+                continue
+            ordered = sorted(durations)
+            self.logger.info(
+                "Stage latency summary",
+                route=route,
+                method=method,
+                stage=stage,
+                count=len(ordered),
+                p50=round(percentile(ordered, 0.5), 4),
+                p90=round(percentile(ordered, 0.9), 4),
+                p99=round(percentile(ordered, 0.99), 4),
+                max=round(ordered[-1], 4),
+            )
+            durations.clear()
+
+    def export_sampled(self, traces: list[JobTrace]) -> Optional[Path]:
+        # chrome trace event format, opens in chrome://tracing and Perfetto
+        if not traces:
+            return None
+
+        events = []
+        for trace in traces:
+            args = {"route": trace.route, "method": trace.method}
+            events.append(
+                {
+                    "name": f"{trace.route} {trace.method}",
+                    "ph": "X",
+                    "ts": trace.started * 1e6,
+                    "dur": trace.duration * 1e6,
+                    "pid": 1,
+                    "tid": trace.trace_id,
+                    "args": args,
+                }
+            )
+            for stage, started, duration in trace.events:
+                events.append(
+                    {
+                        "name": stage,
+                        "ph": "X",
+                        "ts": started * 1e6,
+                        "dur": duration * 1e6,
+                        "pid": 1,
+                        "tid": trace.trace_id,
+                        "args": args,
+                    }
+                )
+
+        entry_name = Path(__main__.__file__).stem
+        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        path = self.trace_dir / f"{entry_name}.trace_{timestamp}.json"
+        path.write_text(json.dumps({"traceEvents": events}))
+        return path
+
+    async def flush(self) -> None:
+        self.summarise()
+        traces = list(self._sampled)
+        self._sampled.clear()
+        path = await asyncio.to_thread(self.export_sampled, traces)
+        if path is not None:
+            self.logger.info("Exported sampled job traces", path=str(path))
+
+    async def run(self) -> None:
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                await self.flush()
+        finally:
+            await self.flush()
+
+
+def trace_job(route: str, method: str) -> ContextManager:
+    if _tracer is None:
+        return _NULL
+    return _tracer.job(route, method)
+
+
+def span(stage: str) -> ContextManager:
+    # a single contextvar lookup when tracing is off or outside a job
+    trace = _current.get()
+    if trace is None:
+        return _NULL
+    return trace.span(stage)
+
+
+def configure_tracing(
+    *,
+    interval: float = 60.0,
+    sample_rate: float = 0.0,
+    trace_dir: str = ".",
+) -> None:
+    global _tracer
+    _tracer = Tracer(interval=interval, sample_rate=sample_rate, trace_dir=trace_dir)
+
+
+def get_tracer() -> Optional[Tracer]:
+    return _tracer
@@ -1,7 +1,12 @@
+from dataclasses import replace
+from typing import Callable, Optional
 import asyncio
+import time
 
 import httpx
-from riot_api.rate_limit_client import RateLimitClient, RateLimitExceeded
+import structlog
+from riot_api import RateLimitClient
+from riot_api.rate_limit_client import RateLimitExceeded
 from riot_api.exceptions import (
     BadRequestError,
     ForbiddenError,
@@ -12,20 +17,99 @@ from riot_api.exceptions import (
 )
 
 from execution.query_job import QueryJob
+from execution.client import create_client
+from execution.circuit_breaker import CircuitBreaker
+from execution.retry import RetryScheduler, get_retry_policy
+from execution.tracing import trace_job, span
 from logs.config import get_logger
 from logs.limits import log_header_limits, log_client_limits
+from logs.telemetry import get_telemetry
+from metrics.instruments import (
+    REQUESTS,
+    RESPONSE_LATENCY,
+    LIMITER_WAIT,
+    DB_WRITE_LATENCY,
+)
+
+
+async def handle_failure(
+    logger: structlog.BoundLogger,
+    query_job: QueryJob,
+    exc: Exception,
+    retry_scheduler: RetryScheduler,
+):
+    policy = get_retry_policy(exc)
+    try:
+        attempts = await query_job.run_record_failure(logger, exc)
+    except Exception as e:
+        # retry on the in-memory count rather than losing the job
+        logger.critical("Failed to record job failure", exc_info=True, exception=e)
+        attempts = query_job.attempt + 1
+
+    if attempts >= policy.max_attempts:
+        logger.critical(
+            f"Job failed {attempts} times, moving to dead letters",
+            query_job=query_job,
+            attempts=attempts,
+        )
+        try:
+            await query_job.run_on_error(logger, exc)
+            await query_job.run_on_dead_letter(logger, exc, attempts)
+        except Exception as e:
+            # the worker must survive a failing database write
+            logger.critical(
+                "Failed to dead letter job",
+                query_job=query_job,
+                exc_info=True,
+                exception=e,
+            )
+        # dead lettered rows must not be released back to claimers
+        await query_job.complete_lease()
+        return
+
+    delay = policy.backoff(attempts)
+    logger.warning(
+        f"Retrying job in {delay:.2f}s",
+        query_job=query_job,
+        attempts=attempts,
+        retry_after=delay,
+    )
+    retry_scheduler.schedule(replace(query_job, attempt=attempts), delay)
+
+
+async def park_job(
+    logger: structlog.BoundLogger,
+    query_job: QueryJob,
+    job_queue: asyncio.Queue[QueryJob],
+):
+    # route is paused: leased work goes back to the database, jobs without a
+    # lease only live in the queue so they are kept there
+    if query_job.lease is not None:
+        logger.debug("Route paused, releasing job", query_job=query_job)
+        await query_job.abandon_lease()
+    else:
+        logger.debug("Route paused, requeueing job", query_job=query_job)
+        job_queue.put_nowait(query_job)
 
 
 async def worker(
     api_key: str,
     worker_id: int,
     job_queue: asyncio.Queue[QueryJob],
+    retry_scheduler: RetryScheduler,
+    breaker: CircuitBreaker,
     stop_all_workers: asyncio.Event,
-    stop_route_workers: asyncio.Event,
+    stop_worker: Optional[asyncio.Event] = None,
+    observe_latency: Optional[Callable[[float], None]] = None,
     queue_timeout: int = 5,
-    http_error_timeout: int = 10,
+    breaker_poll_interval: float = 1.0,
+    base_url: Optional[str] = None,
+    client: Optional[RateLimitClient] = None,
 ):
-    client = RateLimitClient(api_key)
+    # workers of a process share one client, so they draw on one limiter
+    if client is None:
+        client = create_client(api_key, base_url)
+    telemetry = get_telemetry()
     logger = get_logger().bind(component=f"worker_{worker_id}")
     logger.debug("Worker started")
 
@@ -34,10 +118,15 @@ async def worker(
         if stop_all_workers.is_set():
             logger.info("stop_all_workers is set, stopping worker")
             break
-        if stop_route_workers.is_set():
-            logger.info("stop_platform_workers is set, stopping worker")
+        if stop_worker is not None and stop_worker.is_set():
+            logger.info("Worker scaled down, stopping worker")
             break
 
+        # wait while the route is paused by the circuit breaker
+        if not breaker.accepts_jobs():
+            await asyncio.sleep(breaker_poll_interval)
+            continue
+
         # get next query
         try:
             query_job = await asyncio.wait_for(job_queue.get(), timeout=queue_timeout)
@@ -47,108 +136,181 @@ async def worker(
                 remaining_qsize=job_queue.qsize(),
             )
         except asyncio.TimeoutError:
+            if retry_scheduler.pending:
+                continue
             logger.info("Queue timeout, stopping worker")
             break
 
-        # execute qeury
-        skip_query = False
-        res, headers = None, None  # to prevent pyright possibly unbound error
-        while True:
-            # check stop event
-            if stop_all_workers.is_set() or stop_route_workers.is_set():
-                skip_query = True
-                break
+        # another worker may have taken the half-open probe meanwhile
+        if not breaker.try_acquire():
+            await park_job(logger, query_job, job_queue)
+            continue
 
-            try:
-                res, headers = await query_job.execute(client)
-            except RateLimitExceeded as e:
-                logger.warning(
-                    f"Local rate limit exceeded. Sleeping for {e.retry_after:.2f}s",
-                    retry_after=e.retry_after,
-                    job=query_job,
-                )
-                await asyncio.sleep(e.retry_after)
-                continue
-            except RateLimitError as e:
-                logger.critical(
-                    f"Server side rate limit exceeded. Sleeping for {e.retry_after}s",
-                    job=query_job,
-                )
-                log_header_limits(logger, e.headers)
-                await log_client_limits(logger, client, query_job)
-                await asyncio.sleep(e.retry_after)
-                continue
-            except httpx.HTTPError as e:
-                logger.critical(
-                    f"Encountered unexpected HTTP error, retrying after {http_error_timeout} seconds",
-                    error=str(e),
-                    exc_info=True,
-                )
-                await asyncio.sleep(http_error_timeout)
-                continue
-            except ServerError as e:
-                # stop all platform workers as problem resides in the server
-                logger.critical(
-                    "Encountered server error, stopping all region workers",
-                    status_code=e.status_code,
-                    headers=e.headers,
-                    body=e.body,
-                )
-                # stop_route_workers.set()
-                # skip_query=True
-                await asyncio.sleep(60)
-                continue
-            except UnauthorizedError as e:
-                # stop all workers as API key is invalid
+        route, method = query_job.route_name, query_job.method_name
+        with trace_job(route, method):
+            # execute qeury
+            skip_query = False
+            failure: Exception | None = None
+            res, headers = None, None  # to prevent pyright possibly unbound error
+            latency = 0.0
+            while True:
+                # check stop event
                 if stop_all_workers.is_set():
+                    breaker.release()
+                    skip_query = True
+                    break
+
+                try:
+                    started = time.monotonic()
+                    with span("request"):
+                        res, headers = await query_job.execute(client)
+                    latency = time.monotonic() - started
+                    if observe_latency is not None:
+                        observe_latency(latency)
+                    RESPONSE_LATENCY.observe(latency, route=route, method=method)
+                    REQUESTS.inc(route=route, method=method, status="200")
+                    with span("decode"):
+                        res = query_job.decode(res)
+                except RateLimitExceeded as e:
+                    logger.warning(
+                        f"Local rate limit exceeded. Sleeping for {e.retry_after:.2f}s",
+                        retry_after=e.retry_after,
+                        route=route,
+                        method=method,
+                        job=query_job,
+                    )
+                    LIMITER_WAIT.observe(e.retry_after, route=route, method=method)
+                    with span("limiter"):
+                        await asyncio.sleep(e.retry_after)
                     continue
+                except RateLimitError as e:
+                    logger.critical(
+                        f"Server side rate limit exceeded. Sleeping for {e.retry_after}s",
+                        retry_after=e.retry_after,
+                        route=route,
+                        method=method,
+                        job=query_job,
+                    )
+                    REQUESTS.inc(route=route, method=method, status="429")
+                    telemetry.record_rate_limited(route, method)
+                    log_header_limits(logger, e.headers)
+                    await log_client_limits(logger, client, query_job)
+                    with span("server_backoff"):
+                        await asyncio.sleep(e.retry_after)
+                    continue
+                except httpx.HTTPError as e:
+                    logger.critical(
+                        "Encountered unexpected HTTP error",
+                        error=str(e),
+                        exc_info=True,
+                    )
+                    REQUESTS.inc(route=route, method=method, status="transport_error")
+                    # timeouts and connection failures count against the route,
+                    # other HTTP errors say nothing about its health
+                    if isinstance(e, httpx.TransportError):
+                        breaker.record_failure()
+                    else:
+                        breaker.release()
+                    failure = e
+                except ServerError as e:
+                    # problem resides in the server, let the breaker pause the route
+                    logger.critical(
+                        "Encountered server error",
+                        status_code=e.status_code,
+                        headers=e.headers,
+                        body=e.body,
+                    )
+                    REQUESTS.inc(route=route, method=method, status=e.status_code)
+                    breaker.record_failure()
+                    failure = e
+                except UnauthorizedError as e:
+                    REQUESTS.inc(route=route, method=method, status="401")
+                    breaker.release()
+                    # stop all workers as API key is invalid
+                    if stop_all_workers.is_set():
+                        continue
 
-                stop_all_workers.set()
-                logger.critical(
-                    "Invalid API key, stopping all workers",
-                    api_key=api_key,
-                )
-                skip_query = True
-            except (BadRequestError, ForbiddenError, NotFoundError) as e:
-                # something wrong with query parameter, stopping current worker
-                logger.critical(
-                    "Invalid request, stopping current user",
-                    status_code=e.status_code,
-                    headers=e.headers,
-                    body=e.body,
-                )
-                await query_job.run_on_error(logger, e)
-                skip_query = True
+                    stop_all_workers.set()
+                    logger.critical(
+                        "Invalid API key, stopping all workers",
+                        api_key=api_key,
+                    )
+                    skip_query = True
+                except (BadRequestError, ForbiddenError, NotFoundError) as e:
+                    # something wrong with query parameter, retried as its policy allows
+                    breaker.record_success()
+                    REQUESTS.inc(route=route, method=method, status=e.status_code)
+                    logger.critical(
+                        "Invalid request",
+                        status_code=e.status_code,
+                        headers=e.headers,
+                        body=e.body,
+                    )
+                    failure = e
+                except Exception as e:
+                    logger.critical(
+                        "Encountered unexpected error",
+                        query_job=query_job,
+                        exception=e,
+                    )
+                    breaker.release()
+                    failure = e
+
+                break
+            if failure is not None:
+                if not breaker.accepts_jobs():
+                    # upstream incident, not the job's fault; don't count it
+                    await park_job(logger, query_job, job_queue)
+                    continue
+                await handle_failure(logger, query_job, failure, retry_scheduler)
+                continue
+            if skip_query:
+                # give the claimed row back instead of waiting for lease expiry
+                await query_job.abandon_lease()
+                continue
+
+            # to prevent pyright possibly unbound error
+            assert res is not None and headers is not None
+            breaker.record_success()
+
+            # aggregate limit info, summarised periodically by the telemetry task
+            telemetry.record(route, method, headers)
+
+            # perform run_on_success
+            logger.debug(
+                "Processing job result",
+                route=route,
+                method=method,
+                latency=latency,
+            )
+            try:
+                with (
+                    DB_WRITE_LATENCY.time(route=route, method=method),
+                    span("on_success"),
+                ):
+                    await query_job.run_on_success(logger, res, headers)
             except Exception as e:
+                # a row the database rejects is retried and dead lettered
+                # like a failed request instead of ending the worker
                 logger.critical(
-                    "Encountered unexpected error",
+                    "Failed to process job result",
                     query_job=query_job,
+                    exc_info=True,
                     exception=e,
                 )
-                skip_query = True
-
-            break
-        if skip_query:
-            continue
-
-        # to prevent pyright possibly unbound error
-        assert res is not None and headers is not None
-
-        # log limit info
-        log_header_limits(logger, headers)
-        await log_client_limits(logger, client, query_job)
-
-        # perform run_on_success
-        logger.debug("Processing job result")
-        await query_job.run_on_success(logger, res, headers)
+                job_queue.task_done()
+                await handle_failure(logger, query_job, e, retry_scheduler)
+                continue
 
-        job_queue.task_done()
+            job_queue.task_done()
 
-        # if response is full, add next job
-        next_job = query_job.next(logger, res, headers)
-        if next_job is None:
-            logger.debug("No more pages, stopping pagination")
-            await query_job.run_on_completion(logger)
-        else:
-            logger.debug("Queueing next window")
-            await job_queue.put(next_job)
+            # if response is full, add next job
+            next_job = query_job.next(logger, res, headers)
+            if next_job is None:
+                logger.debug("No more pages, stopping pagination")
+                await query_job.run_on_completion(logger)
+                await query_job.complete_lease()
+            else:
+                # next_job carries the same lease, so it stays held
+                logger.debug("Queueing next window")
+                await job_queue.put(next_job)
@@ -1,11 +1,82 @@
 from datetime import datetime
 from pathlib import Path
+from typing import Callable, Optional
 import __main__
+import atexit
 import logging
+import os
 from logging.handlers import RotatingFileHandler
+import queue
 import structlog
 
+from logs.rotation import CompressedRotatingFileHandler, SegmentArchiver
+from logs.pipeline import (
+    BatchQueueListener,
+    DroppedCounter,
+    EventQueueHandler,
+    OverflowPolicy,
+    PriorityBuffer,
+)
+
 _logger = None
+_listener: Optional[BatchQueueListener] = None
+_archiver: Optional[SegmentArchiver] = None
+_dropped = DroppedCounter()
+
+
+def file_size(path: str | Path) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+class BatchedFlushMixin:
+    # records stay in the stream buffer until the listener flushes its batch.
+    # The stock shouldRollover seeks and tells the stream on every record,
+    # which flushes it, so the file size is counted here instead
+    baseFilename: str
+    maxBytes: int
+    terminator: str
+    format: Callable[[logging.LogRecord], str]
+    _size: Optional[int] = None
+    _pending: int = 0
+
+    def flush(self) -> None:
+        pass
+
+    def flush_batch(self) -> None:
+        super().flush()  # type: ignore[misc]
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if self.maxBytes <= 0:
+            return False
+        if self._size is None:
+            # nothing is buffered yet when the size is first needed
+            self._size = file_size(self.baseFilename)
+        self._pending = len(self.format(record)) + len(self.terminator)
+        # an empty file takes the record whatever its size
+        return 0 < self._size and self._size + self._pending >= self.maxBytes
+
+    def doRollover(self) -> None:
+        super().doRollover()  # type: ignore[misc]
+        # the reopened stream has nothing buffered, so the disk size is exact
+        self._size = file_size(self.baseFilename)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        super().emit(record)  # type: ignore[misc]
+        if self._size is not None:
+            self._size += self._pending
+
+
+class BatchedRotatingFileHandler(BatchedFlushMixin, RotatingFileHandler):
+    pass
+
+
+class BatchedCompressedRotatingFileHandler(
+    BatchedFlushMixin, CompressedRotatingFileHandler
+):
+    pass
 
 
 class PerComponentFileRouter(logging.Handler):
@@ -16,6 +87,8 @@ class PerComponentFileRouter(logging.Handler):
         max_bytes: int,
         backup_count: int,
         formatter: logging.Formatter,
+        batched: bool = False,
+        archiver: Optional[SegmentArchiver] = None,
     ):
         super().__init__()
         self.base_dir = Path(base_dir)
@@ -23,7 +96,11 @@ class PerComponentFileRouter(logging.Handler):
         self.max_bytes = max_bytes
         self.backup_count = backup_count
         self.formatter = formatter
+        self.batched = batched
+        self.archiver = archiver
         self._handlers: dict[str, RotatingFileHandler] = {}
+        if archiver is not None:
+            archiver.add_live(self.live_bytes)
 
     def _get_component(self, record: logging.LogRecord) -> str | None:
         # 1) Preferred: attribute set by ProcessorFormatter.wrap_for_formatter
@@ -47,12 +124,28 @@ class PerComponentFileRouter(logging.Handler):
         h = self._handlers.get(component)
         if h is None:
             file_path = self.base_dir / f"{self.entry_name}.{component}.log"
-            h = RotatingFileHandler(
-                file_path,
-                mode="a",
-                maxBytes=self.max_bytes,
-                backupCount=self.backup_count,
-            )
+            if self.archiver is not None:
+                compressed_class = (
+                    BatchedCompressedRotatingFileHandler
+                    if self.batched
+                    else CompressedRotatingFileHandler
+                )
+                h = compressed_class(
+                    file_path,
+                    component,
+                    self.archiver,
+                    self.max_bytes,
+                )
+            else:
+                handler_class = (
+                    BatchedRotatingFileHandler if self.batched else RotatingFileHandler
+                )
+                h = handler_class(
+                    file_path,
+                    mode="a",
+                    maxBytes=self.max_bytes,
+                    backupCount=self.backup_count,
+                )
             h.setLevel(self.level)
             h.setFormatter(self.formatter)
             # write a small header on creation
@@ -61,7 +154,7 @@ class PerComponentFileRouter(logging.Handler):
                 f"New run (component={component}) at {datetime.now().isoformat()}\n"
             )
             h.stream.write("=" * 80 + "\n\n")
-            h.flush()
+            h.stream.flush()
             self._handlers[component] = h
         return h
 
@@ -72,6 +165,16 @@ class PerComponentFileRouter(logging.Handler):
         handler = self._get_handler_for(component)
         handler.handle(record)
 
+    def live_bytes(self) -> int:
+        return sum(file_size(h.baseFilename) for h in list(self._handlers.values()))
+
+    def flush(self) -> None:
+        for h in self._handlers.values():
+            if isinstance(h, BatchedFlushMixin):
+                h.flush_batch()
+            else:
+                h.flush()
+
     def close(self) -> None:
         for h in self._handlers.values():
             h.close()
@@ -86,8 +189,12 @@ def configure_logging(
     log_file_backup_count: int = 3,
     logger_name: str = "collector",
     level: int = logging.DEBUG,
+    queued: bool = False,
+    queue_size: int = 10_000,
+    overflow: OverflowPolicy = "drop",
+    max_total_bytes: int = 0,
 ) -> None:
-    global _logger
+    global _logger, _listener, _archiver
 
     # Configure structlog
     structlog.configure(
@@ -106,6 +213,7 @@ def configure_logging(
     # Set up stdlib logger
     std_logger = logging.getLogger(logger_name)
     std_logger.setLevel(logging.DEBUG)
+    handlers: list[logging.Handler] = []
 
     # Console handler (human-readable)
     console_handler = logging.StreamHandler()
@@ -119,7 +227,7 @@ def configure_logging(
         ],
     )
     console_handler.setFormatter(console_formatter)
-    std_logger.addHandler(console_handler)
+    handlers.append(console_handler)
 
     # File handler (JSON logs)
     file_formatter = structlog.stdlib.ProcessorFormatter(
@@ -133,32 +241,85 @@ def configure_logging(
 
     # Per worker handler
     entry_name = Path(__main__.__file__).stem
+    if max_total_bytes > 0:
+        # rolled segments are gzipped in the background and the oldest are
+        # deleted once all components together exceed max_total_bytes
+        _archiver = SegmentArchiver(log_dir, entry_name, max_total_bytes)
+        _archiver.start()
     router = PerComponentFileRouter(
         base_dir=log_dir,
         entry_name=entry_name,
         max_bytes=log_file_size,
         backup_count=log_file_backup_count,
         formatter=file_formatter,
+        batched=queued,
+        archiver=_archiver,
     )
     router.setLevel(level)
-    std_logger.addHandler(router)
+    handlers.append(router)
 
     # Critical level logger
-    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    critical_log_file = Path(log_dir) / f"{entry_name}.critical_{timestamp}.log"
+    critical_handler: logging.FileHandler
+    if _archiver is not None:
+        # one file across runs, rotated, compressed and capped with the rest
+        critical_log_file = Path(log_dir) / f"{entry_name}.critical.log"
+        # unbatched: critical records are rare and should reach the disk
+        critical_handler = CompressedRotatingFileHandler(
+            critical_log_file, "critical", _archiver, log_file_size
+        )
+        _archiver.add_live(lambda: file_size(critical_log_file))
+    else:
+        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        critical_log_file = Path(log_dir) / f"{entry_name}.critical_{timestamp}.log"
 
-    critical_handler = logging.FileHandler(
-        critical_log_file,
-        mode="w",
-    )
+        # delayed, so runs without critical records leave no empty file behind
+        critical_handler = logging.FileHandler(
+            critical_log_file,
+            mode="w",
+            delay=True,
+        )
     critical_handler.setLevel(logging.CRITICAL)
     critical_handler.setFormatter(file_formatter)
-    std_logger.addHandler(critical_handler)
+    handlers.append(critical_handler)
+
+    if queued:
+        # the event loop only enqueues; a writer thread renders and writes
+        log_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        priority = PriorityBuffer()
+        queue_handler = EventQueueHandler(log_queue, overflow, _dropped, priority)
+        queue_handler.setLevel(level)
+        std_logger.addHandler(queue_handler)
+
+        _listener = BatchQueueListener(
+            log_queue, handlers, _dropped, priority, logger_name
+        )
+        _listener.start()
+    else:
+        for handler in handlers:
+            std_logger.addHandler(handler)
+    if queued or _archiver is not None:
+        atexit.register(shutdown_logging)
 
     # Create structlog logger
     _logger = structlog.get_logger(logger_name)
 
 
+def shutdown_logging() -> None:
+    global _listener, _archiver
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+    # after the listener, so its final rollovers are compressed too
+    if _archiver is not None:
+        _archiver.stop()
+        _archiver = None
+
+
+def get_dropped_count() -> int:
+    return _dropped.total
+
+
 def get_logger() -> structlog.BoundLogger:
     if _logger is None:
         raise RuntimeError("Logger not configured. Call configure_logging() first.")
@@ -1,5 +1,3 @@
-from datetime import datetime
-
 import structlog
 import httpx
 from riot_api import RateLimitClient
@@ -34,10 +32,8 @@ def log_header_limits(logger: structlog.BoundLogger, headers: httpx.Headers):
         endpoint_limit[0][0], endpoint_limit[0][1], endpoint_count[0][0]
     )
 
-    # time of server when response was sent
-    date_str = headers["date"]
-    dt = datetime.strptime(date_str, "%a, %d %b %Y %H:%M:%S GMT")
-    response_time = dt.strftime("%Y-%m-%d %H:%M.%S")
+    # time of server when response was sent, kept as the raw http date
+    response_time = headers.get("date")
 
     logger.debug(
         "Riot server rate limit status", response_time=response_time, **log_data
@@ -47,10 +43,7 @@ def log_header_limits(logger: structlog.BoundLogger, headers: httpx.Headers):
 async def log_client_limits(
     logger: structlog.BoundLogger, client: RateLimitClient, query_job: QueryJob
 ):
-    route = query_job.params.get("region") or query_job.params.get("platform")
-    if route is None:
-        raise ValueError
-    route_name = route.name
+    route_name = query_job.route_name
 
     # Endpoint window
     keys = (route_name, query_job.method_name)
@@ -0,0 +1,163 @@
+from collections import deque
+from logging.handlers import QueueHandler
+from typing import Literal
+import logging
+import queue
+import threading
+
+OverflowPolicy = Literal["drop", "degrade"]
+
+_STOP = object()
+# wakes the listener for records that only went to the priority buffer
+_WAKE = object()
+
+
+class DroppedCounter:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.total = 0
+        self.reported = 0
+
+    def increment(self) -> None:
+        with self._lock:
+            self.total += 1
+
+    def take_unreported(self) -> int:
+        with self._lock:
+            count = self.total - self.reported
+            self.reported = self.total
+            return count
+
+
+class PriorityBuffer:
+    # warnings and above that found the log queue full; the listener writes
+    # them before the queue, so they skip the backlog instead of blocking
+    def __init__(self, maxsize: int = 1024) -> None:
+        self._lock = threading.Lock()
+        self._records: deque[logging.LogRecord] = deque()
+        self.maxsize = maxsize
+
+    def offer(self, record: logging.LogRecord) -> bool:
+        with self._lock:
+            if len(self._records) >= self.maxsize:
+                return False
+            self._records.append(record)
+            return True
+
+    def drain(self) -> list[logging.LogRecord]:
+        with self._lock:
+            records = list(self._records)
+            self._records.clear()
+            return records
+
+
+# enqueues structlog event dicts; rendering and I/O happen on the listener thread
+class EventQueueHandler(QueueHandler):
+    def __init__(
+        self,
+        log_queue: queue.Queue,
+        overflow: OverflowPolicy,
+        dropped: DroppedCounter,
+        priority: PriorityBuffer,
+    ):
+        super().__init__(log_queue)
+        self.overflow = overflow
+        self.dropped = dropped
+        self.priority = priority
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # record.msg is still the event dict from wrap_for_formatter, leave it
+        # unrendered so JSON serialisation runs off the event loop
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+            return
+        except queue.Full:
+            pass
+
+        # degrade: shed debug/info, set warnings and above aside. Never block,
+        # this runs on the event loop
+        if (
+            self.overflow == "degrade"
+            and record.levelno >= logging.WARNING
+            and self.priority.offer(record)
+        ):
+            # the listener may have emptied the queue since put_nowait failed
+            try:
+                self.queue.put_nowait(_WAKE)
+            except queue.Full:
+                pass
+            return
+        self.dropped.increment()
+
+
+class BatchQueueListener(threading.Thread):
+    def __init__(
+        self,
+        log_queue: queue.Queue,
+        handlers: list[logging.Handler],
+        dropped: DroppedCounter,
+        priority: PriorityBuffer,
+        logger_name: str,
+        batch_size: int = 256,
+    ):
+        super().__init__(name="log-writer", daemon=True)
+        self.queue = log_queue
+        self.handlers = handlers
+        self.dropped = dropped
+        self.priority = priority
+        self.logger_name = logger_name
+        self.batch_size = batch_size
+
+    def _handle(self, record: logging.LogRecord) -> None:
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def _report_dropped(self) -> None:
+        count = self.dropped.take_unreported()
+        if not count:
+            return
+        self._handle(
+            logging.makeLogRecord(
+                {
+                    "name": self.logger_name,
+                    "levelno": logging.WARNING,
+                    "levelname": "WARNING",
+                    "msg": f"Dropped {count} log events, log queue was full",
+                    "component": "logging",
+                }
+            )
+        )
+
+    def run(self) -> None:
+        stopping = False
+        while not stopping:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            for record in self.priority.drain() + batch:
+                if record is _STOP:
+                    stopping = True
+                    continue
+                if record is _WAKE:
+                    continue
+                self._handle(record)
+            # set aside while this batch was written
+            for record in self.priority.drain():
+                self._handle(record)
+            self._report_dropped()
+
+            # one flush per batch instead of one per record
+            for handler in self.handlers:
+                handler.flush()
+
+    def stop(self) -> None:
+        self.queue.put(_STOP)
+        self.join()
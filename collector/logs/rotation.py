@@ -0,0 +1,196 @@
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from typing import Any, Callable, Optional
+import gzip
+import json
+import logging
+import os
+import queue
+import re
+import shutil
+import sys
+import threading
+import time
+
+SEGMENT_STAMP = "%Y-%m-%d_%H-%M-%S.%f"
+# <entry>.<component>.<stamp>.log once rolled
+ROLLED_SUFFIX = re.compile(
+    r"\.(?P<component>.+)\.(?P<stamp>\d{4}-\d\d-\d\d_\d\d-\d\d-\d\d\.\d{6})\.log"
+)
+SEGMENT_KEYS = {"file", "component", "start_us", "end_us", "bytes", "raw_bytes"}
+
+
+def index_path(base_dir: Path, entry_name: str) -> Path:
+    return base_dir / f"{entry_name}.segments.json"
+
+
+def load_index(path: Path) -> list[dict[str, Any]]:
+    try:
+        segments = json.loads(path.read_text())
+    except (OSError, ValueError):
+        return []
+    # malformed entries and segments removed by hand are forgotten
+    if not isinstance(segments, list):
+        return []
+    return [
+        s
+        for s in segments
+        if isinstance(s, dict)
+        and SEGMENT_KEYS <= s.keys()
+        and (path.parent / str(s["file"])).exists()
+    ]
+
+
+class SegmentArchiver:
+    def __init__(
+        self,
+        base_dir: str,
+        entry_name: str,
+        max_total_bytes: int,
+        compresslevel: int = 6,
+    ) -> None:
+        self.base_dir = Path(base_dir)
+        self.entry_name = entry_name
+        self.index_path = index_path(self.base_dir, entry_name)
+        self.max_total_bytes = max_total_bytes
+        self.compresslevel = compresslevel
+        # sizes of the files still being written, see add_live
+        self._live: list[Callable[[], int]] = []
+
+        self._segments = load_index(self.index_path)
+        self._queue: queue.Queue[Optional[dict[str, Any]]] = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._run, name="log-archiver", daemon=True
+        )
+
+    def add_live(self, source: Callable[[], int]) -> None:
+        # live files count toward max_total_bytes with the archived ones
+        self._live.append(source)
+
+    def live_bytes(self) -> int:
+        return sum(source() for source in self._live)
+
+    def start(self) -> None:
+        self._recover()
+        self._thread.start()
+
+    def stop(self) -> None:
+        # compress whatever was rolled before exiting
+        self._queue.put(None)
+        self._thread.join()
+
+    def submit(self, path: Path, component: str, start: float, end: float) -> None:
+        self._queue.put(
+            {"path": path, "component": component, "start": start, "end": end}
+        )
+
+    def _recover(self) -> None:
+        # partial archives of a crashed run; their segment is still on disk
+        # and compressed again below
+        for partial in self.base_dir.glob(f"{self.entry_name}.*.log.gz.tmp"):
+            partial.unlink(missing_ok=True)
+
+        # segments a crashed run rolled but never compressed; live files have
+        # no timestamp in their name, so they don't match
+        for path in sorted(self.base_dir.glob(f"{self.entry_name}.*.log")):
+            match = ROLLED_SUFFIX.fullmatch(path.name[len(self.entry_name) :])
+            if match is None:
+                continue
+            start = datetime.strptime(match["stamp"], SEGMENT_STAMP).timestamp()
+            self.submit(path, match["component"], start, path.stat().st_mtime)
+
+    def _run(self) -> None:
+        while True:
+            rolled = self._queue.get()
+            if rolled is None:
+                return
+            try:
+                self._segments.append(self._compress(rolled))
+                self._enforce_cap()
+                self._write_index()
+            except Exception as e:
+                # logging from here would feed back into the files being rotated;
+                # the thread keeps going so later segments are still archived
+                print(f"Failed to archive {rolled['path']}: {e!r}", file=sys.stderr)
+
+    def _compress(self, rolled: dict[str, Any]) -> dict[str, Any]:
+        path: Path = rolled["path"]
+        target = path.with_name(path.name + ".gz")
+        partial = path.with_name(path.name + ".gz.tmp")
+        with open(path, "rb") as src, gzip.open(
+            partial, "wb", compresslevel=self.compresslevel
+        ) as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+        os.replace(partial, target)
+        raw_bytes = path.stat().st_size
+        path.unlink()
+
+        return {
+            "file": target.name,
+            "component": rolled["component"],
+            # microseconds since epoch, the unit the analysis tooling uses
+            "start_us": int(rolled["start"] * 1_000_000),
+            "end_us": int(rolled["end"] * 1_000_000),
+            "bytes": target.stat().st_size,
+            "raw_bytes": raw_bytes,
+        }
+
+    def _enforce_cap(self) -> None:
+        # oldest segments go first, whichever component they belong to
+        self._segments.sort(key=lambda segment: segment["end_us"])
+        total = self.live_bytes() + sum(s["bytes"] for s in self._segments)
+        while self._segments and total > self.max_total_bytes:
+            segment = self._segments.pop(0)
+            total -= segment["bytes"]
+            (self.base_dir / segment["file"]).unlink(missing_ok=True)
+
+    def _write_index(self) -> None:
+        partial = self.index_path.with_name(self.index_path.name + ".tmp")
+        partial.write_text(json.dumps(self._segments, indent=1))
+        os.replace(partial, self.index_path)
+
+
+class CompressedRotatingFileHandler(RotatingFileHandler):
+    # rolled segments are renamed by their start time and handed to the
+    # archiver instead of being shifted through numbered backups
+    def __init__(
+        self,
+        filename: Path,
+        component: str,
+        archiver: SegmentArchiver,
+        max_bytes: int,
+    ) -> None:
+        super().__init__(filename, mode="a", maxBytes=max_bytes)
+        self.component = component
+        self.archiver = archiver
+        self.segment_start: Optional[float] = None
+        self.segment_end: Optional[float] = None
+        if os.path.exists(filename) and os.path.getsize(filename) > 0:
+            # appended to an earlier run's file, so the start is unknown
+            self.segment_start = 0.0
+
+    def emit(self, record: logging.LogRecord) -> None:
+        super().emit(record)
+        if self.segment_start is None:
+            self.segment_start = record.created
+        self.segment_end = record.created
+
+    def doRollover(self) -> None:
+        if self.stream:
+            self.stream.close()
+            self.stream = None  # type: ignore[assignment]
+
+        now = time.time()
+        start = self.segment_start if self.segment_start is not None else now
+        end = self.segment_end or now
+        stamp = datetime.fromtimestamp(start or end).strftime(SEGMENT_STAMP)
+        base = Path(self.baseFilename)
+        rolled = base.with_name(f"{base.stem}.{stamp}.log")
+        if base.exists():
+            os.rename(base, rolled)
+            self.archiver.submit(rolled, self.component, start, end)
+
+        self.segment_start = None
+        self.segment_end = None
+        self.stream = self._open()
@@ -0,0 +1,169 @@
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Optional
+import asyncio
+
+import httpx
+import structlog
+from riot_api import RateLimitClient
+
+from logs.limits import limit_str
+
+_telemetry: Optional["RateLimitTelemetry"] = None
+
+
+def parse_limit_header(value: str) -> tuple[tuple[int, int], ...]:
+    # "20:1,100:120" -> ((20, 1), (100, 120))
+    parsed = []
+    for part in value.split(","):
+        count, _, period = part.partition(":")
+        if count and period:
+            parsed.append((int(count), int(period)))
+    return tuple(parsed)
+
+
+@dataclass
+class LimitSeries:
+    buffer_size: int
+    requests: int = 0
+    rate_limited: int = 0
+    app_limit: str = ""
+    method_limit: str = ""
+    # ring buffers of the raw count headers, parsed only when summarising
+    app_counts: deque[str] = field(init=False)
+    method_counts: deque[str] = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.app_counts = deque(maxlen=self.buffer_size)
+        self.method_counts = deque(maxlen=self.buffer_size)
+
+    def reset(self) -> None:
+        self.requests = 0
+        self.rate_limited = 0
+        self.app_counts.clear()
+        self.method_counts.clear()
+
+
+def summarise_counts(limit: str, counts: deque[str]) -> dict[str, str]:
+    # highest count seen per window during the interval, e.g. "18(20)/1"
+    limits = parse_limit_header(limit)
+    peaks = [0] * len(limits)
+    for value in counts:
+        for i, (count, _) in enumerate(parse_limit_header(value)[: len(peaks)]):
+            peaks[i] = max(peaks[i], count)
+
+    return {
+        f"{rate}/{period}s": limit_str(rate, period, peak)
+        for (rate, period), peak in zip(limits, peaks)
+    }
+
+
+class RateLimitTelemetry:
+    def __init__(
+        self,
+        interval: float = 60.0,
+        sample_every: int = 0,
+        buffer_size: int = 1024,
+    ) -> None:
+        self.interval = interval
+        self.sample_every = sample_every
+        self.buffer_size = buffer_size
+        self._series: dict[tuple[str, str], LimitSeries] = {}
+        self._seen = 0
+        self.logger = structlog.get_logger("collector").bind(component="telemetry")
+
+    def _get_series(self, route: str, method: str) -> LimitSeries:
+        series = self._series.get((route, method))
+        if series is None:
+            series = LimitSeries(self.buffer_size)
+            self._series[(route, method)] = series
+        return series
+
+    def record(self, route: str, method: str, headers: httpx.Headers) -> None:
+        series = self._get_series(route, method)
+        series.requests += 1
+        series.app_limit = headers.get("X-App-Rate-Limit", series.app_limit)
+        series.method_limit = headers.get("X-Method-Rate-Limit", series.method_limit)
+        series.app_counts.append(headers.get("X-App-Rate-Limit-Count", ""))
+        series.method_counts.append(headers.get("X-Method-Rate-Limit-Count", ""))
+
+        # optional 1-in-N raw sample
+        self._seen += 1
+        if self.sample_every and self._seen % self.sample_every == 0:
+            self.logger.debug(
+                "Riot server rate limit sample",
+                route=route,
+                method=method,
+                app_limit=series.app_limit,
+                app_count=series.app_counts[-1],
+                method_limit=series.method_limit,
+                method_count=series.method_counts[-1],
+                response_time=headers.get("date"),
+            )
+
+    def record_rate_limited(self, route: str, method: str) -> None:
+        self._get_series(route, method).rate_limited += 1
+
+    async def get_client_usage(
+        self, client: RateLimitClient, route: str, method: str
+    ) -> dict[str, str]:
+        usage = {}
+        for name, keys in [
+            ("endpoint", (route, method)),
+            ("route_long", (route, "route_long")),
+            ("route_short", (route, "route_short")),
+        ]:
+            limit = client.limits.get(keys)
+            if limit is None:
+                continue
+            window = await client.limiter.get_window_stats(limit, *keys)
+            usage[name] = limit_str(
+                limit.amount,
+                limit.multiples,
+                limit.amount - window.remaining,
+            )
+        return usage
+
+    async def flush(self, client: RateLimitClient) -> None:
+        for (route, method), series in self._series.items():
+            if not series.requests and not series.rate_limited:
+                continue
+
+            self.logger.info(
+                "Rate limit summary",
+                route=route,
+                method=method,
+                interval=self.interval,
+                requests=series.requests,
+                rate_limited=series.rate_limited,
+                server_route=summarise_counts(series.app_limit, series.app_counts),
+                server_endpoint=summarise_counts(
+                    series.method_limit, series.method_counts
+                ),
+                client=await self.get_client_usage(client, route, method),
+            )
+            series.reset()
+
+    async def run(self, client: RateLimitClient) -> None:
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                await self.flush(client)
+        finally:
+            # don't lose the last partial interval on shutdown
+            await self.flush(client)
+
+
+def configure_telemetry(
+    *,
+    interval: float = 60.0,
+    sample_every: int = 0,
+) -> None:
+    global _telemetry
+    _telemetry = RateLimitTelemetry(interval=interval, sample_every=sample_every)
+
+
+def get_telemetry() -> RateLimitTelemetry:
+    if _telemetry is None:
+        raise RuntimeError("Telemetry not configured. Call configure_telemetry() first.")
+    return _telemetry
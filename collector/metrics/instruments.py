@@ -0,0 +1,171 @@
+from datetime import timedelta
+from typing import Optional
+import asyncio
+
+import structlog
+
+from metrics.registry import REGISTRY, Counter, Gauge, Histogram
+from execution.autoscale import Autoscaler
+from logs.config import get_dropped_count
+from db.pool import CLAIM_POOL, InstrumentedPool, get_pool
+from db.matches import count_match_backlog
+from db.users import count_user_backlog
+
+REQUESTS = REGISTRY.register(
+    Counter(
+        "collector_requests_total",
+        "Riot API responses by route, method and status",
+        ("route", "method", "status"),
+    )
+)
+RESPONSE_LATENCY = REGISTRY.register(
+    Histogram(
+        "collector_response_latency_seconds",
+        "Riot API response latency",
+        ("route", "method"),
+    )
+)
+LIMITER_WAIT = REGISTRY.register(
+    Histogram(
+        "collector_limiter_wait_seconds",
+        "Time spent sleeping on the local rate limiter",
+        ("route", "method"),
+        buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0),
+    )
+)
+DB_WRITE_LATENCY = REGISTRY.register(
+    Histogram(
+        "collector_db_write_seconds",
+        "Time spent persisting a response",
+        ("route", "method"),
+    )
+)
+QUEUE_DEPTH = REGISTRY.register(
+    Gauge("collector_queue_depth", "Jobs waiting in the route queue", ("route",))
+)
+WORKERS = REGISTRY.register(
+    Gauge("collector_workers", "Active worker coroutines", ("route",))
+)
+BUDGET_RATE = REGISTRY.register(
+    Gauge(
+        "collector_budget_rate",
+        "Requests/sec the tightest local limit window allows",
+        ("route",),
+    )
+)
+BACKLOG = REGISTRY.register(
+    Gauge("collector_backlog", "Rows waiting to be queried", ("table", "route"))
+)
+POOL_SIZE = REGISTRY.register(
+    Gauge("collector_db_pool_size", "Open connections in the psycopg pool", ("pool",))
+)
+POOL_MAX_SIZE = REGISTRY.register(
+    Gauge(
+        "collector_db_pool_max_size",
+        "Current connection limit of the psycopg pool",
+        ("pool",),
+    )
+)
+POOL_AVAILABLE = REGISTRY.register(
+    Gauge(
+        "collector_db_pool_available",
+        "Idle connections in the psycopg pool",
+        ("pool",),
+    )
+)
+POOL_WAITING = REGISTRY.register(
+    Gauge(
+        "collector_db_pool_waiting",
+        "Requests waiting for a pool connection",
+        ("pool",),
+    )
+)
+POOL_WAIT = REGISTRY.register(
+    Counter(
+        "collector_db_pool_wait_seconds_total",
+        "Total time requests waited for a pool connection",
+        ("pool",),
+    )
+)
+POOL_REQUESTS = REGISTRY.register(
+    Counter(
+        "collector_db_pool_requests_total",
+        "Connections handed out by the pool",
+        ("pool",),
+    )
+)
+POOL_ACQUIRE = REGISTRY.register(
+    Histogram(
+        "collector_db_pool_acquire_seconds",
+        "Time spent waiting for a pool connection",
+        ("pool",),
+        buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0, 30.0),
+    )
+)
+POOL_HOLD = REGISTRY.register(
+    Histogram(
+        "collector_db_pool_hold_seconds",
+        "Time a pool connection was checked out",
+        ("pool",),
+    )
+)
+LOG_DROPPED = REGISTRY.register(
+    Counter("collector_log_events_dropped_total", "Log events shed by a full queue")
+)
+LOG_DROPPED.set_function(get_dropped_count)
+
+logger = structlog.get_logger("collector").bind(component="metrics")
+
+
+def observe_queue(route: str, job_queue: asyncio.Queue) -> None:
+    # one series per label, a second queue with the same route replaces it
+    QUEUE_DEPTH.set_function(job_queue.qsize, route=route)
+
+
+def observe_autoscaler(autoscaler: Autoscaler) -> None:
+    # pools are named after the platform (or region) they serve
+    route = autoscaler.pool.name
+    WORKERS.set_function(lambda: len(autoscaler.pool), route=route)
+    BUDGET_RATE.set_function(
+        lambda: autoscaler.budget_rate if autoscaler.budget_rate is not None else 0,
+        route=route,
+    )
+
+
+def observe_pool(pool: InstrumentedPool) -> None:
+    # get_stats() keeps the counters cumulative, unlike pop_stats()
+    name = pool.name
+    stats = pool.get_stats
+    POOL_SIZE.set_function(lambda: stats().get("pool_size", 0), pool=name)
+    POOL_MAX_SIZE.set_function(lambda: pool.max_size, pool=name)
+    POOL_AVAILABLE.set_function(lambda: stats().get("pool_available", 0), pool=name)
+    POOL_WAITING.set_function(lambda: stats().get("requests_waiting", 0), pool=name)
+    POOL_WAIT.set_function(lambda: stats().get("requests_wait_ms", 0) / 1000, pool=name)
+    POOL_REQUESTS.set_function(lambda: stats().get("requests_num", 0), pool=name)
+    pool.on_wait = lambda pool_name, seconds: POOL_ACQUIRE.observe(
+        seconds, pool=pool_name
+    )
+    pool.on_usage = lambda pool_name, seconds: POOL_HOLD.observe(
+        seconds, pool=pool_name
+    )
+
+
+async def poll_backlog(
+    interval: float = 60.0,
+    matches: bool = True,
+    users_last_queried: Optional[timedelta] = None,
+    pool_name: str = CLAIM_POOL,
+) -> None:
+    while True:
+        try:
+            pool = get_pool(pool_name)
+            if matches:
+                for region, count in (await count_match_backlog(pool)).items():
+                    BACKLOG.set(count, table="match_ids", route=region)
+            if users_last_queried is not None:
+                backlog = await count_user_backlog(pool, users_last_queried)
+                for platform, count in backlog.items():
+                    BACKLOG.set(count, table="users", route=platform)
+        except Exception as e:
+            logger.warning("Failed to poll backlog", exc_info=True, exception=e)
+        await asyncio.sleep(interval)
@@ -0,0 +1,73 @@
+from typing import Awaitable, Callable, Optional
+import asyncio
+
+import structlog
+
+from metrics.registry import REGISTRY
+
+logger = structlog.get_logger("collector").bind(component="metrics")
+
+# path -> (content type, body); later modules may add their own pages
+Route = Callable[[], Awaitable[tuple[str, bytes]]]
+_routes: dict[str, Route] = {}
+
+
+async def render_metrics() -> tuple[str, bytes]:
+    return "text/plain; version=0.0.4", REGISTRY.render().encode()
+
+
+def add_route(path: str, route: Route) -> None:
+    _routes[path] = route
+
+
+add_route("/metrics", render_metrics)
+
+
+def response(status: str, content_type: str, body: bytes) -> bytes:
+    head = (
+        f"HTTP/1.1 {status}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        "Connection: close\r\n\r\n"
+    )
+    return head.encode() + body
+
+
+async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # drain headers, requests never carry a body
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (
+            b"\r\n",
+            b"\n",
+            b"",
+        ):
+            pass
+
+        method, _, rest = request_line.decode("latin-1").partition(" ")
+        path = rest.split(" ", 1)[0].split("?", 1)[0]
+        route = _routes.get(path)
+        if method != "GET":
+            writer.write(response("405 Method Not Allowed", "text/plain", b""))
+        elif route is None:
+            writer.write(response("404 Not Found", "text/plain", b""))
+        else:
+            content_type, body = await route()
+            writer.write(response("200 OK", content_type, body))
+        await writer.drain()
+    except Exception as e:
+        logger.warning("Failed to serve metrics request", exception=e)
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(
+    port: int,
+    host: str = "127.0.0.1",
+) -> Optional[asyncio.Server]:
+    # port 0 keeps the endpoint disabled
+    if not port:
+        return None
+    server = await asyncio.start_server(handle, host, port)
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
@@ -1,5 +1,7 @@
 from datetime import timedelta
+from functools import partial
 import asyncio
+import itertools
 import os
 
 from dotenv import load_dotenv
@@ -16,10 +18,40 @@ from riot_api.rate_limit_client import (
 )
 
 from logs.config import get_logger, configure_logging
+from logs.telemetry import get_telemetry, configure_telemetry
 from execution.query_job import BaseJobFactory, QueryJob, refill_queue
 from execution.worker import worker
-from db.pool import get_pool, init_pool, close_pool
-from db.matches import claim_matches, insert_match, set_match_id_queried
+from execution.client import create_client
+from execution.tracing import configure_tracing, get_tracer, span
+from execution.profiling import configure_profiling, get_profiler
+from execution.autoscale import Autoscaler, WorkerPool
+from execution.lease import LeaseTracker
+from execution.retry import RetryScheduler, error_payload, params_payload
+from execution.circuit_breaker import CircuitBreaker, release_route_work
+from metrics.instruments import (
+    observe_pool,
+    observe_queue,
+    observe_autoscaler,
+    poll_backlog,
+)
+from metrics.server import start_metrics_server
+from db.pool import (
+    CLAIM_POOL,
+    WRITE_POOL,
+    PoolSizer,
+    get_pool,
+    init_pool,
+    close_pool,
+)
+from db.matches import (
+    claim_matches,
+    insert_match,
+    set_match_id_queried,
+    release_matches,
+    renew_match_leases,
+    record_match_failure,
+    dead_letter_match,
+)
 from db.simplified_match_dto import MatchDTO
 
 load_dotenv()
@@ -27,12 +59,23 @@ install()
 
 
 API_KEY = os.getenv("RIOT_API_KEY", "")
+RIOT_API_BASE_URL = os.getenv("RIOT_API_BASE_URL", "")
 POSTGRES_DSN = os.getenv("POSTGRES_DSN", "")
-PSYCOPG_POOL_MAX_SIZE = 10
-WORKER_PER_REGION = 1
+CLAIM_POOL_MAX_SIZE = 4
+WRITE_POOL_MIN_SIZE = 4
+WRITE_POOL_MAX_SIZE = 16
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+TRACING = os.getenv("TRACING", "0") == "1"
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+PROFILING = os.getenv("PROFILING", "0") == "1"
+# 0 keeps plain per-file rotation, otherwise gzip rolled logs under this cap
+LOG_MAX_TOTAL_BYTES = int(os.getenv("LOG_MAX_TOTAL_BYTES", "0"))
+MIN_WORKER_PER_REGION = 1
+MAX_WORKER_PER_REGION = 8
 
 REFILL_QUEUE_THRESHOLD = 100
 JOB_FACTORY_BATCH_SIZE = 20
+LEASE_DURATION = timedelta(minutes=30)
 
 
 async def on_success(
@@ -41,13 +84,15 @@ async def on_success(
     result: MatchDTO,
     headers: httpx.Headers,
 ):
-    pool = get_pool()
+    pool = get_pool(WRITE_POOL)
     match_id = result.metadata.matchId
     try:
-        await insert_match(pool, result)
+        with span("db.insert_match"):
+            await insert_match(pool, result)
         logger.info("Inserted match", match_id=match_id)
 
-        await set_match_id_queried(pool, match_id)
+        with span("db.set_match_id_queried"):
+            await set_match_id_queried(pool, match_id)
         logger.info("Marked match as queried", match_id=match_id)
 
     except Exception as e:
@@ -59,24 +104,59 @@ async def on_success(
         )
 
 
+async def record_failure(
+    logger: structlog.BoundLogger,
+    query_job: QueryJob[MatchDTO],
+    exc: Exception,
+) -> int:
+    match_id = query_job.params["match_id"]
+    return await record_match_failure(get_pool(CLAIM_POOL), match_id)
+
+
+async def on_dead_letter(
+    logger: structlog.BoundLogger,
+    query_job: QueryJob[MatchDTO],
+    exc: Exception,
+    attempts: int,
+):
+    match_id = query_job.params["match_id"]
+    await dead_letter_match(
+        get_pool(CLAIM_POOL),
+        match_id,
+        query_job.method_name,
+        params_payload(query_job.params),
+        error_payload(exc),
+        attempts,
+    )
+    logger.critical("Moved match to dead letters", match_id=match_id)
+
+
+async def release(match_ids: list[str]):
+    await release_matches(get_pool(CLAIM_POOL), match_ids)
+
+
+async def renew(match_ids: list[str], lease_duration: timedelta):
+    await renew_match_leases(get_pool(CLAIM_POOL), match_ids, lease_duration)
+
+
 class JobFactory(BaseJobFactory[MatchDTO]):
     def __init__(
         self,
         region: RouteRegion,
         batch_size: int,
-        lease_duration: timedelta,
+        leases: LeaseTracker,
     ) -> None:
         self.region = region
         self.batch_size = batch_size
-        self.lease_duration = lease_duration
+        self.leases = leases
 
     async def produce(self) -> list[QueryJob[MatchDTO]]:
-        pool = get_pool()
+        pool = get_pool(CLAIM_POOL)
         match_ids = await claim_matches(
             pool,
             self.region,
             self.batch_size,
-            self.lease_duration,
+            self.leases.lease_duration,
         )
 
         query_jobs = []
@@ -86,9 +166,12 @@ class JobFactory(BaseJobFactory[MatchDTO]):
                 params={
                     "region": self.region,
                     "match_id": match_id,
-                    "response_model": MatchDTO,
                 },
+                response_model=MatchDTO,
                 on_success=on_success,
+                record_failure=record_failure,
+                on_dead_letter=on_dead_letter,
+                lease=self.leases.acquire(match_id),
             )
             query_jobs.append(query_job)
 
@@ -96,16 +179,40 @@ class JobFactory(BaseJobFactory[MatchDTO]):
 
 
 async def main():
-    configure_logging()
+    configure_logging(
+        queued=True,
+        overflow="degrade",
+        max_total_bytes=LOG_MAX_TOTAL_BYTES,
+    )
+    configure_telemetry()
+    if TRACING:
+        configure_tracing(sample_rate=TRACE_SAMPLE_RATE)
+    if PROFILING:
+        configure_profiling()
     logger = get_logger()
 
     logger.info(f"RIOT_API_KEY: {API_KEY}")
+    logger.info(f"RIOT_API_BASE_URL: {RIOT_API_BASE_URL}")
     logger.info(f"POSTGRES_DSN: {POSTGRES_DSN}")
-    logger.info(f"PSYCOPG_POOL_MAX_SIZE: {PSYCOPG_POOL_MAX_SIZE}")
-    logger.info(f"WORKER_PER_REGION: {WORKER_PER_REGION}")
-
-    # Initialize psycopg pool
-    await init_pool(POSTGRES_DSN, PSYCOPG_POOL_MAX_SIZE)
+    logger.info(f"CLAIM_POOL_MAX_SIZE: {CLAIM_POOL_MAX_SIZE}")
+    logger.info(f"WRITE_POOL_MIN_SIZE: {WRITE_POOL_MIN_SIZE}")
+    logger.info(f"WRITE_POOL_MAX_SIZE: {WRITE_POOL_MAX_SIZE}")
+    logger.info(f"METRICS_PORT: {METRICS_PORT}")
+    logger.info(f"TRACING: {TRACING}")
+    logger.info(f"TRACE_SAMPLE_RATE: {TRACE_SAMPLE_RATE}")
+    logger.info(f"PROFILING: {PROFILING}")
+    logger.info(f"LOG_MAX_TOTAL_BYTES: {LOG_MAX_TOTAL_BYTES}")
+    logger.info(f"MIN_WORKER_PER_REGION: {MIN_WORKER_PER_REGION}")
+    logger.info(f"MAX_WORKER_PER_REGION: {MAX_WORKER_PER_REGION}")
+
+    # Initialize psycopg pools
+    await init_pool(POSTGRES_DSN, CLAIM_POOL_MAX_SIZE, name=CLAIM_POOL)
+    await init_pool(POSTGRES_DSN, WRITE_POOL_MIN_SIZE, name=WRITE_POOL)
+    observe_pool(get_pool(CLAIM_POOL))
+    observe_pool(get_pool(WRITE_POOL))
+
+    # optional prometheus endpoint, disabled unless METRICS_PORT is set
+    metrics_server = await start_metrics_server(METRICS_PORT)
 
     # Query Parameters
     regions: list[RouteRegion] = [
@@ -117,15 +224,42 @@ async def main():
 
     logger.info("Creating workers...")
     queue_list = []
-    worker_id = 0
-    worker_list = []
+    worker_ids = itertools.count()
+    worker_pools: list[WorkerPool] = []
+    lease_trackers: list[LeaseTracker] = []
+    retry_schedulers: list[RetryScheduler] = []
+    background_tasks: list[asyncio.Task] = []
     stop_all_workers = asyncio.Event()
-    for region in regions:
-        stop_route_workers = asyncio.Event()
 
+    # one client for the process, so workers, autoscalers and telemetry all
+    # see the same limiter
+    client = create_client(API_KEY, RIOT_API_BASE_URL)
+
+    # summarise rate limit usage instead of logging it per request
+    telemetry = get_telemetry().run(client)
+    background_tasks.append(asyncio.create_task(telemetry))
+
+    # per-stage latency summaries and sampled traces, only when enabled
+    tracer = get_tracer()
+    if tracer is not None:
+        background_tasks.append(asyncio.create_task(tracer.run()))
+
+    # grow the write pool while writers queue for connections
+    pool_sizer = PoolSizer(
+        get_pool(WRITE_POOL), WRITE_POOL_MIN_SIZE, WRITE_POOL_MAX_SIZE
+    )
+    background_tasks.append(asyncio.create_task(pool_sizer.run()))
+
+    # backlog gauges from cheap periodic count queries
+    background_tasks.append(asyncio.create_task(poll_backlog()))
+
+    for region in regions:
         # Create new queue
         job_queue = asyncio.Queue()
+        observe_queue(region.name, job_queue)
         queue_list.append(job_queue)
+        retry_scheduler = RetryScheduler(job_queue)
+        retry_schedulers.append(retry_scheduler)
 
         # add margin to local limits
         key = (region.name, "get_match_by_match_id")
@@ -135,36 +269,89 @@ async def main():
         key = (region.name, "route_long")
         RiotClient.limits[key] = RateLimitItemPerSecond(95, 123, "RIOT_API")
 
+        # track leases of claimed match ids
+        leases = LeaseTracker(region.name, release, renew, LEASE_DURATION)
+        lease_trackers.append(leases)
+        background_tasks.append(asyncio.create_task(leases.heartbeat()))
+
+        # pause claiming and hand back leased work during upstream incidents
+        breaker = CircuitBreaker(
+            region.name,
+            on_open=partial(release_route_work, job_queue, retry_scheduler, leases),
+        )
+
         # add jobs to the queue
         job_factory = JobFactory(
             region,
             JOB_FACTORY_BATCH_SIZE,
-            timedelta(minutes=30),
+            leases,
         )
-        refill = refill_queue(job_factory, job_queue, REFILL_QUEUE_THRESHOLD, 1)
-        asyncio.create_task(refill)
-
-        # Create workers
-        for _ in range(WORKER_PER_REGION):
-            w = worker(
-                API_KEY,
-                worker_id,
-                job_queue,
-                stop_all_workers,
-                stop_route_workers,
-            )
-            worker_id += 1
-            worker_list.append(w)
-
-    logger.info(f"Created {len(worker_list)} workers")
-    await asyncio.gather(*worker_list)
-
-    if stop_all_workers.is_set():
-        logger.info("All workers stopped.")
-    else:
-        logger.info("All workers completed.")
-
-    await close_pool()
+        refill = refill_queue(
+            job_factory,
+            job_queue,
+            REFILL_QUEUE_THRESHOLD,
+            1,
+            paused=breaker.is_open,
+        )
+        background_tasks.append(asyncio.create_task(refill))
+
+        # Create workers, resized at runtime by the autoscaler
+        spawn = partial(
+            worker,
+            API_KEY,
+            job_queue=job_queue,
+            retry_scheduler=retry_scheduler,
+            breaker=breaker,
+            stop_all_workers=stop_all_workers,
+            client=client,
+        )
+        worker_pool = WorkerPool(
+            region.name,
+            spawn,
+            worker_ids,
+            MIN_WORKER_PER_REGION,
+            MAX_WORKER_PER_REGION,
+        )
+        worker_pool.scale_to(MIN_WORKER_PER_REGION)
+        worker_pools.append(worker_pool)
+
+        limit_keys = [
+            (region.name, "get_match_by_match_id"),
+            (region.name, "route_short"),
+            (region.name, "route_long"),
+        ]
+        autoscaler = Autoscaler(worker_pool, client, limit_keys)
+        observe_autoscaler(autoscaler)
+        background_tasks.append(asyncio.create_task(autoscaler.run()))
+
+    logger.info(f"Created {len(worker_pools)} worker pools")
+    try:
+        await asyncio.gather(*(pool.wait() for pool in worker_pools))
+
+        if stop_all_workers.is_set():
+            logger.info("All workers stopped.")
+        else:
+            logger.info("All workers completed.")
+    finally:
+        # stop claiming, then hand back everything still leased,
+        # including jobs left in the queues
+        for task in background_tasks:
+            task.cancel()
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+        for worker_pool in worker_pools:
+            await worker_pool.cancel()
+        for retry_scheduler in retry_schedulers:
+            retry_scheduler.cancel_all()
+        for leases in lease_trackers:
+            await leases.release_all()
+
+        # keep whatever an in-flight profile has collected
+        profiler = get_profiler()
+        if profiler is not None:
+            await profiler.stop()
+        if metrics_server is not None:
+            metrics_server.close()
+        await close_pool()
 
 
 if __name__ == "__main__":
@@ -1,7 +1,9 @@
 from dataclasses import replace
 from datetime import timedelta
 from typing import Optional
+from functools import partial
 import asyncio
+import itertools
 import os
 
 from dotenv import load_dotenv
@@ -21,10 +23,39 @@ from riot_api.types.request import (
 )
 
 from logs.config import get_logger, configure_logging
+from logs.telemetry import get_telemetry, configure_telemetry
 from execution.query_job import BaseJobFactory, QueryJob, refill_queue
 from execution.worker import worker
-from db.pool import get_pool, init_pool, close_pool
-from db.users import claim_users, update_match_id_query_date
+from execution.client import create_client
+from execution.tracing import configure_tracing, get_tracer
+from execution.profiling import configure_profiling, get_profiler
+from execution.autoscale import Autoscaler, WorkerPool
+from execution.lease import LeaseTracker
+from execution.retry import RetryScheduler, error_payload, params_payload
+from execution.circuit_breaker import CircuitBreaker, release_route_work
+from metrics.instruments import (
+    observe_pool,
+    observe_queue,
+    observe_autoscaler,
+    poll_backlog,
+)
+from metrics.server import start_metrics_server
+from db.pool import (
+    CLAIM_POOL,
+    WRITE_POOL,
+    PoolSizer,
+    get_pool,
+    init_pool,
+    close_pool,
+)
+from db.users import (
+    claim_users,
+    update_match_id_query_date,
+    release_users,
+    renew_user_leases,
+    record_user_failure,
+    dead_letter_user,
+)
 from db.matches import insert_match_ids
 
 load_dotenv()
@@ -32,13 +63,25 @@ install()
 
 
 API_KEY = os.getenv("RIOT_API_KEY", "")
+RIOT_API_BASE_URL = os.getenv("RIOT_API_BASE_URL", "")
 POSTGRES_DSN = os.getenv("POSTGRES_DSN", "")
 REDIS_DSN = os.getenv("REDIS_DSN", "")
-PSYCOPG_POOL_MAX_SIZE = 10
-WORKER_PER_REGION = 1
+CLAIM_POOL_MAX_SIZE = 4
+WRITE_POOL_MIN_SIZE = 4
+WRITE_POOL_MAX_SIZE = 16
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+TRACING = os.getenv("TRACING", "0") == "1"
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+PROFILING = os.getenv("PROFILING", "0") == "1"
+# 0 keeps plain per-file rotation, otherwise gzip rolled logs under this cap
+LOG_MAX_TOTAL_BYTES = int(os.getenv("LOG_MAX_TOTAL_BYTES", "0"))
+MIN_WORKER_PER_REGION = 1
+MAX_WORKER_PER_REGION = 8
 
 REFILL_QUEUE_THRESHOLD = 30
 JOB_FACTORY_BATCH_SIZE = 10
+LEASE_DURATION = timedelta(minutes=100)
+LAST_QUERIED = timedelta(days=100)
 
 
 def increment(
@@ -65,7 +108,7 @@ async def on_success(
     result: MatchIdListDTO,
     headers: httpx.Headers,
 ):
-    pool = get_pool()
+    pool = get_pool(WRITE_POOL)
 
     region = query_job.params.get("region")
     assert region is not None
@@ -82,33 +125,68 @@ async def on_completion(
     puuid = query_job.params.get("puuid")
     assert puuid
 
-    pool = get_pool()
+    pool = get_pool(WRITE_POOL)
     await update_match_id_query_date(pool, puuid)
 
     logger.info("Updated user's query date", puuid=puuid)
 
 
+async def record_failure(
+    logger: structlog.BoundLogger,
+    query_job: QueryJob[MatchIdListDTO],
+    exc: Exception,
+) -> int:
+    puuid = query_job.params["puuid"]
+    return await record_user_failure(get_pool(CLAIM_POOL), puuid)
+
+
+async def on_dead_letter(
+    logger: structlog.BoundLogger,
+    query_job: QueryJob[MatchIdListDTO],
+    exc: Exception,
+    attempts: int,
+):
+    puuid = query_job.params["puuid"]
+    await dead_letter_user(
+        get_pool(CLAIM_POOL),
+        puuid,
+        query_job.method_name,
+        params_payload(query_job.params),
+        error_payload(exc),
+        attempts,
+    )
+    logger.critical("Moved user to dead letters", puuid=puuid)
+
+
+async def release(puuids: list[str]):
+    await release_users(get_pool(CLAIM_POOL), puuids)
+
+
+async def renew(puuids: list[str], lease_duration: timedelta):
+    await renew_user_leases(get_pool(CLAIM_POOL), puuids, lease_duration)
+
+
 class JobFactory(BaseJobFactory[MatchIdListDTO]):
     def __init__(
         self,
         platform: RoutePlatform,
         batch_size: int,
         last_queried: timedelta,
-        lease_duration: timedelta,
+        leases: LeaseTracker,
     ) -> None:
         self.platform = platform
         self.batch_size = batch_size
         self.last_queried = last_queried
-        self.lease_duration = lease_duration
+        self.leases = leases
 
     async def produce(self) -> list[QueryJob[MatchIdListDTO]]:
-        pool = get_pool()
+        pool = get_pool(CLAIM_POOL)
         puuids = await claim_users(
             pool,
             self.platform,
             self.batch_size,
             self.last_queried,
-            self.lease_duration,
+            self.leases.lease_duration,
         )
 
         query_jobs = []
@@ -126,6 +204,9 @@ class JobFactory(BaseJobFactory[MatchIdListDTO]):
                 increment=increment,
                 on_success=on_success,
                 on_completion=on_completion,
+                record_failure=record_failure,
+                on_dead_letter=on_dead_letter,
+                lease=self.leases.acquire(puuid),
             )
             query_jobs.append(query_job)
 
@@ -141,6 +222,9 @@ class JobFactory(BaseJobFactory[MatchIdListDTO]):
                 increment=increment,
                 on_success=on_success,
                 on_completion=on_completion,
+                record_failure=record_failure,
+                on_dead_letter=on_dead_letter,
+                lease=self.leases.acquire(puuid),
             )
             query_jobs.append(query_job)
 
@@ -148,17 +232,41 @@ class JobFactory(BaseJobFactory[MatchIdListDTO]):
 
 
 async def main():
-    configure_logging()
+    configure_logging(
+        queued=True,
+        overflow="degrade",
+        max_total_bytes=LOG_MAX_TOTAL_BYTES,
+    )
+    configure_telemetry()
+    if TRACING:
+        configure_tracing(sample_rate=TRACE_SAMPLE_RATE)
+    if PROFILING:
+        configure_profiling()
     logger = get_logger()
 
     logger.info(f"RIOT_API_KEY: {API_KEY}")
+    logger.info(f"RIOT_API_BASE_URL: {RIOT_API_BASE_URL}")
     logger.info(f"POSTGRES_DSN: {POSTGRES_DSN}")
-    logger.info(f"PSYCOPG_POOL_MAX_SIZE: {PSYCOPG_POOL_MAX_SIZE}")
+    logger.info(f"CLAIM_POOL_MAX_SIZE: {CLAIM_POOL_MAX_SIZE}")
+    logger.info(f"WRITE_POOL_MIN_SIZE: {WRITE_POOL_MIN_SIZE}")
+    logger.info(f"WRITE_POOL_MAX_SIZE: {WRITE_POOL_MAX_SIZE}")
+    logger.info(f"METRICS_PORT: {METRICS_PORT}")
+    logger.info(f"TRACING: {TRACING}")
+    logger.info(f"TRACE_SAMPLE_RATE: {TRACE_SAMPLE_RATE}")
+    logger.info(f"PROFILING: {PROFILING}")
+    logger.info(f"LOG_MAX_TOTAL_BYTES: {LOG_MAX_TOTAL_BYTES}")
     logger.info(f"REDIS_DSN: {REDIS_DSN}")
-    logger.info(f"WORKER_PER_REGION: {WORKER_PER_REGION}")
+    logger.info(f"MIN_WORKER_PER_REGION: {MIN_WORKER_PER_REGION}")
+    logger.info(f"MAX_WORKER_PER_REGION: {MAX_WORKER_PER_REGION}")
+
+    # Initialize psycopg pools
+    await init_pool(POSTGRES_DSN, CLAIM_POOL_MAX_SIZE, name=CLAIM_POOL)
+    await init_pool(POSTGRES_DSN, WRITE_POOL_MIN_SIZE, name=WRITE_POOL)
+    observe_pool(get_pool(CLAIM_POOL))
+    observe_pool(get_pool(WRITE_POOL))
 
-    # Initialize psycopg pool
-    await init_pool(POSTGRES_DSN, PSYCOPG_POOL_MAX_SIZE)
+    # optional prometheus endpoint, disabled unless METRICS_PORT is set
+    metrics_server = await start_metrics_server(METRICS_PORT)
 
     # Query Parameters
     platforms: list[RoutePlatform] = [
@@ -192,18 +300,46 @@ async def main():
 
     logger.info("Creating workers...")
     queue_list = []
-    worker_id = 0
-    worker_list = []
+    worker_ids = itertools.count()
+    worker_pools: list[WorkerPool] = []
+    lease_trackers: list[LeaseTracker] = []
+    retry_schedulers: list[RetryScheduler] = []
+    background_tasks: list[asyncio.Task] = []
     stop_all_workers = asyncio.Event()
-    for platform in platforms:
-        stop_route_workers = asyncio.Event()
 
+    # one client for the process, so workers, autoscalers and telemetry all
+    # see the same limiter
+    client = create_client(API_KEY, RIOT_API_BASE_URL)
+
+    # summarise rate limit usage instead of logging it per request
+    telemetry = get_telemetry().run(client)
+    background_tasks.append(asyncio.create_task(telemetry))
+
+    # per-stage latency summaries and sampled traces, only when enabled
+    tracer = get_tracer()
+    if tracer is not None:
+        background_tasks.append(asyncio.create_task(tracer.run()))
+
+    # grow the write pool while writers queue for connections
+    pool_sizer = PoolSizer(
+        get_pool(WRITE_POOL), WRITE_POOL_MIN_SIZE, WRITE_POOL_MAX_SIZE
+    )
+    background_tasks.append(asyncio.create_task(pool_sizer.run()))
+
+    # backlog gauges from cheap periodic count queries
+    backlog = poll_backlog(matches=False, users_last_queried=LAST_QUERIED)
+    background_tasks.append(asyncio.create_task(backlog))
+
+    for platform in platforms:
         # Create new queue
         job_queue = asyncio.Queue()
         queue_list.append(job_queue)
+        retry_scheduler = RetryScheduler(job_queue)
+        retry_schedulers.append(retry_scheduler)
 
         # add margin to local limits
         region = platform.to_region()
+        observe_queue(platform.name, job_queue)
         key = (region.name, "get_match_ids_by_puuid")
         RiotClient.limits[key] = RateLimitItemPerSecond(45, 13, "RIOT_API")
         key = (region.name, "route_short")
@@ -211,37 +347,90 @@ async def main():
         key = (region.name, "route_long")
         RiotClient.limits[key] = RateLimitItemPerSecond(95, 123, "RIOT_API")
 
+        # track leases of claimed users
+        leases = LeaseTracker(platform.name, release, renew, LEASE_DURATION)
+        lease_trackers.append(leases)
+        background_tasks.append(asyncio.create_task(leases.heartbeat()))
+
+        # pause claiming and hand back leased work during upstream incidents
+        breaker = CircuitBreaker(
+            platform.name,
+            on_open=partial(release_route_work, job_queue, retry_scheduler, leases),
+        )
+
         # add jobs to the queue
         job_factory = JobFactory(
             platform,
             JOB_FACTORY_BATCH_SIZE,
-            timedelta(days=100),
-            timedelta(minutes=100),
+            LAST_QUERIED,
+            leases,
         )
-        refill = refill_queue(job_factory, job_queue, REFILL_QUEUE_THRESHOLD, 1)
-        asyncio.create_task(refill)
-
-        # Create workers
-        for _ in range(WORKER_PER_REGION):
-            w = worker(
-                API_KEY,
-                worker_id,
-                job_queue,
-                stop_all_workers,
-                stop_route_workers,
-            )
-            worker_id += 1
-            worker_list.append(w)
-
-    logger.info(f"Created {len(worker_list)} workers")
-    await asyncio.gather(*worker_list)
-
-    if stop_all_workers.is_set():
-        logger.info("All workers stopped.")
-    else:
-        logger.info("All workers completed.")
-
-    await close_pool()
+        refill = refill_queue(
+            job_factory,
+            job_queue,
+            REFILL_QUEUE_THRESHOLD,
+            1,
+            paused=breaker.is_open,
+        )
+        background_tasks.append(asyncio.create_task(refill))
+
+        # Create workers, resized at runtime by the autoscaler
+        spawn = partial(
+            worker,
+            API_KEY,
+            job_queue=job_queue,
+            retry_scheduler=retry_scheduler,
+            breaker=breaker,
+            stop_all_workers=stop_all_workers,
+            client=client,
+        )
+        worker_pool = WorkerPool(
+            platform.name,
+            spawn,
+            worker_ids,
+            MIN_WORKER_PER_REGION,
+            MAX_WORKER_PER_REGION,
+        )
+        worker_pool.scale_to(MIN_WORKER_PER_REGION)
+        worker_pools.append(worker_pool)
+
+        limit_keys = [
+            (region.name, "get_match_ids_by_puuid"),
+            (region.name, "route_short"),
+            (region.name, "route_long"),
+        ]
+        autoscaler = Autoscaler(worker_pool, client, limit_keys)
+        observe_autoscaler(autoscaler)
+        background_tasks.append(asyncio.create_task(autoscaler.run()))
+
+    logger.info(f"Created {len(worker_pools)} worker pools")
+    try:
+        await asyncio.gather(*(pool.wait() for pool in worker_pools))
+
+        if stop_all_workers.is_set():
+            logger.info("All workers stopped.")
+        else:
+            logger.info("All workers completed.")
+    finally:
+        # stop claiming, then hand back everything still leased,
+        # including jobs left in the queues
+        for task in background_tasks:
+            task.cancel()
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+        for worker_pool in worker_pools:
+            await worker_pool.cancel()
+        for retry_scheduler in retry_schedulers:
+            retry_scheduler.cancel_all()
+        for leases in lease_trackers:
+            await leases.release_all()
+
+        # keep whatever an in-flight profile has collected
+        profiler = get_profiler()
+        if profiler is not None:
+            await profiler.stop()
+        if metrics_server is not None:
+            metrics_server.close()
+        await close_pool()
 
 
 if __name__ == "__main__":
@@ -1,3 +1,4 @@
+from functools import partial
 import asyncio
 import itertools
 import os
@@ -5,13 +6,31 @@ import os
 from pydantic import BaseModel
 from dotenv import load_dotenv
 from rich.traceback import install
+import httpx
 
-from riot_api.rate_limit_client import Client as RiotClient
+import structlog
+import structlog.stdlib
+
+from riot_api.rate_limit_client import (
+    RateLimitClient as RiotClient,
+    RateLimitItemPerSecond,
+)
 from riot_api.types import Puuid
 from riot_api.types.request import RoutePlatform, RankedQueue
 
 from logs.config import get_logger, configure_logging
-from db.pool import get_pool, init_pool, close_pool
+from logs.telemetry import get_telemetry, configure_telemetry
+from execution.query_job import QueryJob
+from execution.worker import worker
+from execution.client import create_client
+from execution.tracing import configure_tracing, get_tracer
+from execution.profiling import configure_profiling, get_profiler
+from execution.autoscale import WorkerPool
+from execution.retry import RetryScheduler
+from execution.circuit_breaker import CircuitBreaker
+from metrics.instruments import observe_pool, observe_queue
+from metrics.server import start_metrics_server
+from db.pool import WRITE_POOL, PoolSizer, get_pool, init_pool, close_pool
 from db.users import insert_user
 
 load_dotenv()
@@ -27,23 +46,77 @@ class LeagueItemDTO(BaseModel):
 
 
 API_KEY = os.getenv("RIOT_API_KEY", "")
+RIOT_API_BASE_URL = os.getenv("RIOT_API_BASE_URL", "")
 POSTGRES_DSN = os.getenv("POSTGRES_DSN", "")
 REDIS_DSN = os.getenv("REDIS_DSN", "")
-PSYCOPG_POOL_MAX_SIZE = 10
+WRITE_POOL_MIN_SIZE = 4
+WRITE_POOL_MAX_SIZE = 16
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+TRACING = os.getenv("TRACING", "0") == "1"
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+PROFILING = os.getenv("PROFILING", "0") == "1"
+# 0 keeps plain per-file rotation, otherwise gzip rolled logs under this cap
+LOG_MAX_TOTAL_BYTES = int(os.getenv("LOG_MAX_TOTAL_BYTES", "0"))
 WORKER_PER_PLATFORM = 1
 
+LEAGUE_METHODS = [
+    "get_master_league",
+    "get_grandmaster_league",
+    "get_challenger_league",
+]
+
+
+async def on_success(
+    logger: structlog.BoundLogger,
+    query_job: QueryJob[LeagueListDTO],
+    result: LeagueListDTO,
+    headers: httpx.Headers,
+):
+    pool = get_pool(WRITE_POOL)
+    platform: RoutePlatform = query_job.params["platform"]
+
+    puuids = [e.puuid for e in result.entries]
+    await insert_user(pool, platform, puuids)
+    logger.debug(
+        "Inserted league to DB",
+        method=query_job.method_name,
+        queue=query_job.params["queue"].value,
+        users=len(puuids),
+        platform=platform.name,
+    )
+
 
 async def main():
-    configure_logging()
+    configure_logging(
+        queued=True,
+        overflow="degrade",
+        max_total_bytes=LOG_MAX_TOTAL_BYTES,
+    )
+    configure_telemetry()
+    if TRACING:
+        configure_tracing(sample_rate=TRACE_SAMPLE_RATE)
+    if PROFILING:
+        configure_profiling()
     logger = get_logger()
 
     logger.info(f"RIOT_API_KEY: {API_KEY}")
+    logger.info(f"RIOT_API_BASE_URL: {RIOT_API_BASE_URL}")
     logger.info(f"POSTGRES_DSN: {POSTGRES_DSN}")
-    logger.info(f"PSYCOPG_POOL_MAX_SIZE: {PSYCOPG_POOL_MAX_SIZE}")
+    logger.info(f"WRITE_POOL_MIN_SIZE: {WRITE_POOL_MIN_SIZE}")
+    logger.info(f"WRITE_POOL_MAX_SIZE: {WRITE_POOL_MAX_SIZE}")
+    logger.info(f"METRICS_PORT: {METRICS_PORT}")
+    logger.info(f"TRACING: {TRACING}")
+    logger.info(f"TRACE_SAMPLE_RATE: {TRACE_SAMPLE_RATE}")
+    logger.info(f"PROFILING: {PROFILING}")
+    logger.info(f"LOG_MAX_TOTAL_BYTES: {LOG_MAX_TOTAL_BYTES}")
     logger.info(f"REDIS_DSN: {REDIS_DSN}")
+    logger.info(f"WORKER_PER_PLATFORM: {WORKER_PER_PLATFORM}")
+
+    await init_pool(POSTGRES_DSN, WRITE_POOL_MIN_SIZE, name=WRITE_POOL)
+    observe_pool(get_pool(WRITE_POOL))
 
-    await init_pool(POSTGRES_DSN, PSYCOPG_POOL_MAX_SIZE)
-    pool = get_pool()
+    # optional prometheus endpoint, disabled unless METRICS_PORT is set
+    metrics_server = await start_metrics_server(METRICS_PORT)
 
     platforms = [
         RoutePlatform.NA1,
@@ -63,50 +136,106 @@ async def main():
     ]
     queues = [RankedQueue.RANKED_SOLO_5x5, RankedQueue.RANKED_FLEX_SR]
 
-    client = RiotClient(API_KEY)
-    logger.info("Starting queries")
-    for platform, queue in itertools.product(platforms, queues):
-        logger = logger.bind(platform=platform.name, queue=queue.value)
-
-        # master
-        res, headers = await client.get_master_league(platform, queue, LeagueListDTO)
-        puuids = [e.puuid for e in res.entries]
-        await insert_user(pool, platform, puuids)
-        logger.debug(
-            "Inserted master league to DB",
-            users=len(puuids),
-            platform=platform.name,
-        )
-
-        # grandmaster
-        res, headers = await client.get_grandmaster_league(
-            platform,
-            queue,
-            LeagueListDTO,
+    # every platform has its own rate limit, so each gets its own queue and
+    # workers and all platforms are seeded concurrently
+    logger.info("Creating workers...")
+    worker_ids = itertools.count()
+    worker_pools: list[WorkerPool] = []
+    background_tasks: list[asyncio.Task] = []
+    stop_all_workers = asyncio.Event()
+
+    # one client for the process, so workers and telemetry see the same limiter
+    client = create_client(API_KEY, RIOT_API_BASE_URL)
+
+    # summarise rate limit usage instead of logging it per request
+    telemetry = get_telemetry().run(client)
+    background_tasks.append(asyncio.create_task(telemetry))
+
+    # per-stage latency summaries and sampled traces, only when enabled
+    tracer = get_tracer()
+    if tracer is not None:
+        background_tasks.append(asyncio.create_task(tracer.run()))
+
+    # grow the write pool while writers queue for connections
+    pool_sizer = PoolSizer(
+        get_pool(WRITE_POOL), WRITE_POOL_MIN_SIZE, WRITE_POOL_MAX_SIZE
+    )
+    background_tasks.append(asyncio.create_task(pool_sizer.run()))
+
+    for platform in platforms:
+        # Create new queue
+        job_queue = asyncio.Queue()
+        observe_queue(platform.name, job_queue)
+        retry_scheduler = RetryScheduler(job_queue)
+
+        # jobs are not leased, so an open circuit only pauses the workers
+        breaker = CircuitBreaker(platform.name)
+
+        # add margin to local limits
+        for method_name in LEAGUE_METHODS:
+            key = (platform.name, method_name)
+            RiotClient.limits[key] = RateLimitItemPerSecond(28, 10, "RIOT_API")
+        key = (platform.name, "route_short")
+        RiotClient.limits[key] = RateLimitItemPerSecond(10, 1, "RIOT_API")
+        key = (platform.name, "route_long")
+        RiotClient.limits[key] = RateLimitItemPerSecond(95, 123, "RIOT_API")
+
+        # add jobs to the queue
+        for queue, method_name in itertools.product(queues, LEAGUE_METHODS):
+            await job_queue.put(
+                QueryJob[LeagueListDTO](
+                    method_name=method_name,
+                    params={
+                        "platform": platform,
+                        "queue": queue,
+                        "response_model": LeagueListDTO,
+                    },
+                    on_success=on_success,
+                )
+            )
+
+        # Create workers
+        spawn = partial(
+            worker,
+            API_KEY,
+            job_queue=job_queue,
+            retry_scheduler=retry_scheduler,
+            breaker=breaker,
+            stop_all_workers=stop_all_workers,
+            client=client,
         )
-        puuids = [e.puuid for e in res.entries]
-        await insert_user(pool, platform, puuids)
-        logger.debug(
-            "Inserted grandmaster league to DB",
-            users=len(res.entries),
-            platform=platform.name,
+        worker_pool = WorkerPool(
+            platform.name,
+            spawn,
+            worker_ids,
+            WORKER_PER_PLATFORM,
+            WORKER_PER_PLATFORM,
         )
+        worker_pool.scale_to(WORKER_PER_PLATFORM)
+        worker_pools.append(worker_pool)
 
-        # challenger
-        res, headers = await client.get_challenger_league(
-            platform, queue, LeagueListDTO
-        )
-        puuids = [e.puuid for e in res.entries]
-        await insert_user(pool, platform, puuids)
-        logger.debug(
-            "Inserted challenger league to DB",
-            users=len(res.entries),
-            platform=platform.name,
-        )
-
-    logger.info("Query complete!")
-
-    await close_pool()
+    logger.info("Starting queries")
+    try:
+        await asyncio.gather(*(pool.wait() for pool in worker_pools))
+
+        if stop_all_workers.is_set():
+            logger.info("All workers stopped.")
+        else:
+            logger.info("Query complete!")
+    finally:
+        for task in background_tasks:
+            task.cancel()
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+        for worker_pool in worker_pools:
+            await worker_pool.cancel()
+
+        # keep whatever an in-flight profile has collected
+        profiler = get_profiler()
+        if profiler is not None:
+            await profiler.stop()
+        if metrics_server is not None:
+            metrics_server.close()
+        await close_pool()
 
 
 if __name__ == "__main__":
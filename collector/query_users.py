@@ -1,5 +1,6 @@
 from dataclasses import replace
 from typing import Optional
+from functools import partial
 import asyncio
 import itertools
 import os
@@ -25,9 +26,18 @@ from riot_api.types.request import (
 )
 
 from logs.config import get_logger, configure_logging
+from logs.telemetry import get_telemetry, configure_telemetry
 from execution.query_job import QueryJob
+from execution.retry import RetryScheduler
+from execution.circuit_breaker import CircuitBreaker
 from execution.worker import worker
-from db.pool import get_pool, init_pool, close_pool
+from execution.client import create_client
+from execution.tracing import configure_tracing, get_tracer
+from execution.profiling import configure_profiling, get_profiler
+from execution.autoscale import WorkerPool
+from metrics.instruments import observe_pool, observe_queue
+from metrics.server import start_metrics_server
+from db.pool import WRITE_POOL, PoolSizer, get_pool, init_pool, close_pool
 from db.users import insert_user
 
 load_dotenv()
@@ -35,9 +45,19 @@ install()
 
 
 API_KEY = os.getenv("RIOT_API_KEY", "")
+RIOT_API_BASE_URL = os.getenv("RIOT_API_BASE_URL", "")
 POSTGRES_DSN = os.getenv("POSTGRES_DSN", "")
 REDIS_DSN = os.getenv("REDIS_DSN", "")
-PSYCOPG_POOL_MAX_SIZE = 10
+WRITE_POOL_MIN_SIZE = 4
+WRITE_POOL_MAX_SIZE = 16
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+TRACING = os.getenv("TRACING", "0") == "1"
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+PROFILING = os.getenv("PROFILING", "0") == "1"
+# 0 keeps plain per-file rotation, otherwise gzip rolled logs under this cap
+LOG_MAX_TOTAL_BYTES = int(os.getenv("LOG_MAX_TOTAL_BYTES", "0"))
+# a page is only queued once the previous one was read, so extra workers
+# would mostly wait for jobs; the route is not autoscaled
 WORKER_PER_PLATFORM = 1
 
 
@@ -71,7 +91,7 @@ async def on_success(
     result: PuuidListDTO,
     headers: httpx.Headers,
 ):
-    pool = get_pool()
+    pool = get_pool(WRITE_POOL)
     platform: Optional[RoutePlatform] = query_job.params.get("platform")
     if not platform:
         raise ValueError
@@ -83,17 +103,37 @@ async def on_success(
 
 
 async def main():
-    configure_logging()
+    configure_logging(
+        queued=True,
+        overflow="degrade",
+        max_total_bytes=LOG_MAX_TOTAL_BYTES,
+    )
+    configure_telemetry()
+    if TRACING:
+        configure_tracing(sample_rate=TRACE_SAMPLE_RATE)
+    if PROFILING:
+        configure_profiling()
     logger = get_logger()
 
     logger.info(f"RIOT_API_KEY: {API_KEY}")
+    logger.info(f"RIOT_API_BASE_URL: {RIOT_API_BASE_URL}")
     logger.info(f"POSTGRES_DSN: {POSTGRES_DSN}")
-    logger.info(f"PSYCOPG_POOL_MAX_SIZE: {PSYCOPG_POOL_MAX_SIZE}")
+    logger.info(f"WRITE_POOL_MIN_SIZE: {WRITE_POOL_MIN_SIZE}")
+    logger.info(f"WRITE_POOL_MAX_SIZE: {WRITE_POOL_MAX_SIZE}")
+    logger.info(f"METRICS_PORT: {METRICS_PORT}")
+    logger.info(f"TRACING: {TRACING}")
+    logger.info(f"TRACE_SAMPLE_RATE: {TRACE_SAMPLE_RATE}")
+    logger.info(f"PROFILING: {PROFILING}")
+    logger.info(f"LOG_MAX_TOTAL_BYTES: {LOG_MAX_TOTAL_BYTES}")
     logger.info(f"REDIS_DSN: {REDIS_DSN}")
     logger.info(f"WORKER_PER_PLATFORM: {WORKER_PER_PLATFORM}")
 
     # Initialize psycopg pool
-    await init_pool(POSTGRES_DSN, PSYCOPG_POOL_MAX_SIZE)
+    await init_pool(POSTGRES_DSN, WRITE_POOL_MIN_SIZE, name=WRITE_POOL)
+    observe_pool(get_pool(WRITE_POOL))
+
+    # optional prometheus endpoint, disabled unless METRICS_PORT is set
+    metrics_server = await start_metrics_server(METRICS_PORT)
 
     # Query Parameters
     platforms: list[tuple[RoutePlatform, int]] = [
@@ -129,15 +169,39 @@ async def main():
 
     logger.info("Creating workers...")
     queue_list = []
-    worker_id = 0
-    worker_list = []
+    worker_ids = itertools.count()
+    worker_pools: list[WorkerPool] = []
+    background_tasks: list[asyncio.Task] = []
     stop_all_workers = asyncio.Event()
-    for platform, start_page in platforms:
-        stop_route_workers = asyncio.Event()
 
+    # one client for the process, so workers and telemetry all
+    # see the same limiter
+    client = create_client(API_KEY, RIOT_API_BASE_URL)
+
+    # summarise rate limit usage instead of logging it per request
+    telemetry = get_telemetry().run(client)
+    background_tasks.append(asyncio.create_task(telemetry))
+
+    # per-stage latency summaries and sampled traces, only when enabled
+    tracer = get_tracer()
+    if tracer is not None:
+        background_tasks.append(asyncio.create_task(tracer.run()))
+
+    # grow the write pool while writers queue for connections
+    pool_sizer = PoolSizer(
+        get_pool(WRITE_POOL), WRITE_POOL_MIN_SIZE, WRITE_POOL_MAX_SIZE
+    )
+    background_tasks.append(asyncio.create_task(pool_sizer.run()))
+
+    for platform, start_page in platforms:
         # Create new queue
         job_queue = asyncio.Queue()
+        observe_queue(platform.name, job_queue)
         queue_list.append(job_queue)
+        retry_scheduler = RetryScheduler(job_queue)
+
+        # jobs are not leased, so an open circuit only pauses the workers
+        breaker = CircuitBreaker(platform.name)
 
         # add margin to local limits
         key = (platform.name, "get_league_entries_by_tier")
@@ -168,26 +232,47 @@ async def main():
             )
 
         # Create workers
-        for _ in range(WORKER_PER_PLATFORM):
-            w = worker(
-                API_KEY,
-                worker_id,
-                job_queue,
-                stop_all_workers,
-                stop_route_workers,
-            )
-            worker_id += 1
-            worker_list.append(w)
-
-    logger.info(f"Created {len(worker_list)} workers")
-    await asyncio.gather(*worker_list)
-
-    if stop_all_workers.is_set():
-        logger.info("All workers stopped.")
-    else:
-        logger.info("All workers completed.")
-
-    await close_pool()
+        spawn = partial(
+            worker,
+            API_KEY,
+            job_queue=job_queue,
+            retry_scheduler=retry_scheduler,
+            breaker=breaker,
+            stop_all_workers=stop_all_workers,
+            client=client,
+        )
+        worker_pool = WorkerPool(
+            platform.name,
+            spawn,
+            worker_ids,
+            WORKER_PER_PLATFORM,
+            WORKER_PER_PLATFORM,
+        )
+        worker_pool.scale_to(WORKER_PER_PLATFORM)
+        worker_pools.append(worker_pool)
+
+    logger.info(f"Created {len(worker_pools)} worker pools")
+    try:
+        await asyncio.gather(*(pool.wait() for pool in worker_pools))
+
+        if stop_all_workers.is_set():
+            logger.info("All workers stopped.")
+        else:
+            logger.info("All workers completed.")
+    finally:
+        for task in background_tasks:
+            task.cancel()
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+        for worker_pool in worker_pools:
+            await worker_pool.cancel()
+
+        # keep whatever an in-flight profile has collected
+        profiler = get_profiler()
+        if profiler is not None:
+            await profiler.stop()
+        if metrics_server is not None:
+            metrics_server.close()
+        await close_pool()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,275 @@
+from typing import Any
+import hashlib
+import random
+
+# champion, summoner spell and perk ids that exist in the static data tables
+CHAMPION_IDS = [
+    1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20,
+    21, 22, 23, 24, 25, 26, 27, 28, 29, 30, 31, 32, 33, 34, 35, 36, 37, 38,
+    39, 40, 41, 42, 43, 44, 45, 48, 50, 51, 53, 54, 55, 56, 57, 58, 59, 60,
+    61, 62, 63, 64, 67, 68, 69, 72, 74, 75, 76, 77, 78, 79, 80, 81, 82, 83,
+    84, 85, 86, 89, 90, 91, 92, 96, 98, 99, 101, 102, 103, 104, 105, 106,
+    107, 110, 111, 112, 113, 114, 115, 117, 119, 120, 121, 122, 126, 127,
+    131, 133, 134, 136, 141, 142, 143, 145, 150, 154, 157, 161, 163, 164,
+    201, 202, 203, 222, 223, 234, 235, 236, 238, 240, 245, 254, 266, 267,
+    268, 412, 420, 421, 429, 432, 497, 498, 516, 517, 518, 523, 555, 777,
+]  # fmt: skip
+SUMMONER_SPELLS = {
+    "TOP": (4, 12),
+    "JUNGLE": (4, 11),
+    "MIDDLE": (4, 14),
+    "BOTTOM": (4, 7),
+    "UTILITY": (4, 14),
+}
+POSITIONS = list(SUMMONER_SPELLS)
+
+# (style, description, selections with their var counts)
+PRIMARY_STYLE = (8000, [8010, 9111, 9104, 8299])
+SECONDARY_STYLE = (8100, [8143, 8106])
+STAT_PERKS = {"defense": 5011, "flex": 5008, "offense": 5008}
+
+COUNT_FIELDS = [
+    "allInPings", "assistMePings", "baronKills", "bountyLevel", "commandPings",
+    "consumablesPurchased", "detectorWardsPlaced", "doubleKills", "dragonKills",
+    "enemyMissingPings", "enemyVisionPings", "holdPings", "getBackPings",
+    "inhibitorKills", "inhibitorTakedowns", "inhibitorsLost", "itemsPurchased",
+    "killingSprees", "largestKillingSpree", "largestMultiKill",
+    "neutralMinionsKilled", "needVisionPings", "objectivesStolen",
+    "objectivesStolenAssists", "onMyWayPings", "pentaKills", "pushPings",
+    "quadraKills", "sightWardsBoughtInGame", "summoner1Casts", "summoner2Casts",
+    "totalAllyJungleMinionsKilled", "totalEnemyJungleMinionsKilled",
+    "tripleKills", "turretKills", "turretTakedowns", "turretsLost",
+    "visionClearedPings", "visionWardsBoughtInGame", "wardsKilled",
+    "wardsPlaced",
+]  # fmt: skip
+AMOUNT_FIELDS = [
+    "champExperience", "damageDealtToBuildings", "damageDealtToObjectives",
+    "damageDealtToTurrets", "damageSelfMitigated", "goldSpent",
+    "largestCriticalStrike", "magicDamageDealt", "magicDamageDealtToChampions",
+    "magicDamageTaken", "physicalDamageDealt", "physicalDamageDealtToChampions",
+    "physicalDamageTaken", "timeCCingOthers", "totalDamageDealt",
+    "totalDamageDealtToChampions", "totalDamageShieldedOnTeammates",
+    "totalDamageTaken", "totalHeal", "totalHealsOnTeammates", "totalUnitsHealed",
+    "trueDamageDealt", "trueDamageDealtToChampions", "trueDamageTaken",
+    "totalTimeCCDealt",
+]  # fmt: skip
+CHALLENGE_COUNT_FIELDS = [
+    "acesBefore15Minutes", "buffsStolen", "dodgeSkillShotsSmallWindow",
+    "epicMonsterSteals", "initialBuffCount", "initialCrabCount",
+    "killAfterHiddenWithAlly", "killsNearEnemyTurret",
+    "multikillsAfterAggressiveFlash", "multiTurretRiftHeraldCount",
+    "outnumberedKills", "quickSoloKills", "riftHeraldTakedowns",
+    "saveAllyFromDeath", "soloBaronKills", "soloKills",
+    "takedownsBeforeJungleMinionSpawn", "tookLargeDamageSurvived",
+    "turretPlatesTaken", "turretsTakenWithRiftHerald", "wardsGuarded",
+    "wardTakedowns", "wardTakedownsBefore20M", "elderDragonKillsWithOpposingSoul",
+    "enemyChampionImmobilizations", "flawlessAces", "immobilizeAndKillWithAlly",
+    "killsUnderOwnTurret", "killsWithHelpFromEpicMonster",
+    "knockEnemyIntoTeamAndKill", "kTurretsDestroyedBeforePlatesFall",
+    "landSkillShotsEarlyGame", "laneMinionsFirst10Minutes",
+    "pickKillWithAlly", "quickFirstTurret", "skillshotsDodged", "skillshotsHit",
+    "takedownOnFirstTurret", "takedownsAfterGainingLevelAdvantage",
+    "takedownsFirst25Minutes", "maxLevelLeadLaneOpponent",
+]  # fmt: skip
+CHALLENGE_FLOAT_FIELDS = [
+    "controlWardTimeCoverageInRiverOrEnemyHalf", "maxCsAdvantageOnLaneOpponent",
+    "visionScoreAdvantageLaneOpponent", "alliedJungleMonsterKills",
+    "bountyGold", "effectiveHealAndShielding", "enemyJungleMonsterKills",
+    "jungleCsBefore10Minutes", "moreEnemyJungleThanOpponent",
+]  # fmt: skip
+
+
+def make_puuid(platform: str, index: int) -> str:
+    # real puuids are 78 characters
+    digest = hashlib.sha512(f"{platform}:{index}".encode()).hexdigest()
+    return digest[:78]
+
+
+def match_id_for(platform: str, seed: str, index: int) -> str:
+    digest = hashlib.sha1(f"{seed}:{index}".encode()).digest()
+    return f"{platform.upper()}_{7_000_000_000 + int.from_bytes(digest[:4], 'big')}"
+
+
+def build_perks(rng: random.Random) -> dict[str, Any]:
+    def selections(perks: list[int]) -> list[dict[str, int]]:
+        return [
+            {
+                "perk": perk,
+                "var1": rng.randint(0, 3000),
+                "var2": rng.randint(0, 100),
+                "var3": 0,
+            }
+            for perk in perks
+        ]
+
+    return {
+        "statPerks": STAT_PERKS,
+        "styles": [
+            {
+                "description": "primaryStyle",
+                "selections": selections(PRIMARY_STYLE[1]),
+                "style": PRIMARY_STYLE[0],
+            },
+            {
+                "description": "subStyle",
+                "selections": selections(SECONDARY_STYLE[1]),
+                "style": SECONDARY_STYLE[0],
+            },
+        ],
+    }
+
+
+def build_participant(
+    rng: random.Random,
+    participant_id: int,
+    team_id: int,
+    position: str,
+    champion_id: int,
+    puuid: str,
+    duration: int,
+    team_won: bool,
+) -> dict[str, Any]:
+    minutes = duration / 60
+    kills, deaths, assists = rng.randint(0, 15), rng.randint(0, 12), rng.randint(0, 20)
+    gold = rng.randint(6000, 18000)
+
+    participant: dict[str, Any] = {
+        field: rng.randint(0, 5) for field in COUNT_FIELDS
+    }
+    participant.update({field: rng.randint(0, 40000) for field in AMOUNT_FIELDS})
+    participant.update(
+        {
+            "participantId": participant_id,
+            "teamId": team_id,
+            "teamPosition": position,
+            "championId": champion_id,
+            "championTransform": 0,
+            "puuid": puuid,
+            "kills": kills,
+            "deaths": deaths,
+            "assists": assists,
+            "champLevel": rng.randint(11, 18),
+            "goldEarned": gold,
+            "visionScore": rng.randint(5, 80),
+            "totalMinionsKilled": rng.randint(10, 300),
+            "spell1Casts": rng.randint(20, 300),
+            "spell2Casts": rng.randint(20, 200),
+            "spell3Casts": rng.randint(10, 200),
+            "spell4Casts": rng.randint(2, 30),
+            "summoner1Id": SUMMONER_SPELLS[position][0],
+            "summoner2Id": SUMMONER_SPELLS[position][1],
+            "firstBloodAssist": False,
+            "firstBloodKill": participant_id == 1,
+            "firstTowerAssist": False,
+            "firstTowerKill": participant_id == 2,
+            "gameEndedInSurrender": False,
+            "longestTimeSpentLiving": rng.randint(60, duration),
+            "totalTimeSpentDead": rng.randint(0, 300),
+            "win": team_won,
+            "perks": build_perks(rng),
+        }
+    )
+    for slot in range(7):
+        participant[f"item{slot}"] = rng.choice([0, 1055, 3006, 3031, 3071, 3340])
+
+    challenges: dict[str, Any] = {
+        field: rng.randint(0, 5) for field in CHALLENGE_COUNT_FIELDS
+    }
+    challenges.update(
+        {field: round(rng.uniform(0, 10), 3) for field in CHALLENGE_FLOAT_FIELDS}
+    )
+    challenges.update(
+        {
+            "damagePerMinute": round(rng.uniform(300, 1200), 3),
+            "goldPerMinute": round(gold / minutes, 3),
+            "kda": round((kills + assists) / max(deaths, 1), 3),
+            "killParticipation": round(rng.uniform(0.2, 0.8), 3),
+            "damageTakenOnTeamPercentage": round(rng.uniform(0.1, 0.3), 3),
+            "teamDamagePercentage": round(rng.uniform(0.1, 0.3), 3),
+            "visionScorePerMinute": round(rng.uniform(0.2, 3), 3),
+            "perfectDragonSoulsTaken": 0,
+        }
+    )
+    participant["challenges"] = challenges
+    return participant
+
+
+def build_team(rng: random.Random, team_id: int, won: bool, bans: list[int]):
+    def objective(first: bool, kills: int) -> dict[str, Any]:
+        return {"first": first, "kills": kills}
+
+    return {
+        "teamId": team_id,
+        "win": won,
+        "bans": [
+            {"championId": champion_id, "pickTurn": turn}
+            for turn, champion_id in enumerate(bans, start=1)
+        ],
+        "feats": {
+            "EPIC_MONSTER_KILL": {"featState": rng.randint(0, 3)},
+            "FIRST_BLOOD": {"featState": rng.randint(0, 1)},
+            "FIRST_TURRET": {"featState": rng.randint(0, 1)},
+        },
+        "objectives": {
+            "atakhan": objective(False, 0),
+            "baron": objective(won, rng.randint(0, 2)),
+            "champion": objective(won, rng.randint(10, 40)),
+            "dragon": objective(won, rng.randint(0, 4)),
+            "horde": objective(False, rng.randint(0, 6)),
+            "inhibitor": objective(won, rng.randint(0, 3)),
+            "riftHerald": objective(won, rng.randint(0, 1)),
+            "tower": objective(won, rng.randint(0, 11)),
+        },
+    }
+
+
+def build_match(match_id: str, player_pool: list[str]) -> dict[str, Any]:
+    # deterministic per match id, so retries see the same payload
+    rng = random.Random(match_id)
+    platform, _, game_id = match_id.partition("_")
+    duration = rng.randint(15 * 60, 45 * 60)
+    blue_won = rng.random() < 0.5
+
+    champions = rng.sample(CHAMPION_IDS, 20)
+    players = rng.sample(player_pool, 10)
+    participants = []
+    for i, (champion_id, puuid) in enumerate(zip(champions[:10], players)):
+        team_id = 100 if i < 5 else 200
+        participants.append(
+            build_participant(
+                rng,
+                participant_id=i + 1,
+                team_id=team_id,
+                position=POSITIONS[i % 5],
+                champion_id=champion_id,
+                puuid=puuid,
+                duration=duration,
+                team_won=blue_won == (team_id == 100),
+            )
+        )
+
+    return {
+        "metadata": {
+            "dataVersion": "2",
+            "matchId": match_id,
+            "participants": players,
+        },
+        "info": {
+            "endOfGameResult": "GameComplete",
+            "gameCreation": 1_700_000_000_000 + int(game_id) % 10**9,
+            "gameDuration": duration,
+            "gameId": int(game_id),
+            "gameMode": "CLASSIC",
+            "gameStartTimestamp": 1_700_000_000_000 + int(game_id) % 10**9,
+            "gameType": "MATCHED_GAME",
+            "gameVersion": "15.1.123.4567",
+            "mapId": 11,
+            "participants": participants,
+            "platformId": platform,
+            "queueId": 420,
+            "teams": [
+                build_team(rng, 100, blue_won, champions[10:15]),
+                build_team(rng, 200, not blue_won, champions[15:20]),
+            ],
+        },
+    }
@@ -0,0 +1,75 @@
+from collections import deque
+from typing import Literal
+import math
+
+WindowMode = Literal["fixed", "sliding"]
+
+
+def parse_limits(value: str) -> list[tuple[int, int]]:
+    # "20:1,100:120" -> [(20, 1), (100, 120)]
+    limits = []
+    for part in value.split(","):
+        count, _, period = part.partition(":")
+        limits.append((int(count), int(period)))
+    return limits
+
+
+class LimitWindow:
+    def __init__(self, limit: int, period: int, mode: WindowMode = "fixed"):
+        self.limit = limit
+        self.period = period
+        self.mode = mode
+        # fixed: riot starts a window on the first request after the previous
+        # one expired, rather than on wall clock boundaries
+        self.started = -math.inf
+        self.count = 0
+        # sliding: timestamps of the requests inside the window
+        self.hits: deque[float] = deque()
+
+    def _expire(self, now: float) -> None:
+        if self.mode == "fixed":
+            if now >= self.started + self.period:
+                self.count = 0
+        else:
+            while self.hits and self.hits[0] <= now - self.period:
+                self.hits.popleft()
+
+    def current(self, now: float) -> int:
+        self._expire(now)
+        return self.count if self.mode == "fixed" else len(self.hits)
+
+    def retry_after(self, now: float) -> float:
+        if self.current(now) < self.limit:
+            return 0.0
+        if self.mode == "fixed":
+            return self.started + self.period - now
+        return self.hits[0] + self.period - now
+
+    def hit(self, now: float) -> None:
+        self._expire(now)
+        if self.mode == "fixed":
+            if self.count == 0:
+                self.started = now
+            self.count += 1
+        else:
+            self.hits.append(now)
+
+
+class LimitGroup:
+    def __init__(self, spec: str, mode: WindowMode = "fixed"):
+        self.spec = spec
+        self.windows = [
+            LimitWindow(limit, period, mode) for limit, period in parse_limits(spec)
+        ]
+
+    def retry_after(self, now: float) -> float:
+        return max(window.retry_after(now) for window in self.windows)
+
+    def hit(self, now: float) -> None:
+        for window in self.windows:
+            window.hit(now)
+
+    def counts(self, now: float) -> str:
+        return ",".join(
+            f"{window.current(now)}:{window.period}" for window in self.windows
+        )
@@ -0,0 +1,367 @@
+"""
+Local stand-in for the Riot API, for offline end to end benchmarks.
+
+    python -m simulator.server --port 8080 --latency 0.05 --error-rate 0.01
+
+Point collectors at it with RIOT_API_BASE_URL=http://127.0.0.1:8080. Requests
+keep their original Host header, which selects the platform or region.
+"""
+
+from dataclasses import dataclass
+from email.utils import formatdate
+from functools import lru_cache
+from typing import Any, Optional
+import argparse
+import asyncio
+import json
+import math
+import random
+import re
+import time
+
+import structlog
+
+from logs.config import get_logger, configure_logging
+from simulator.fixtures import build_match, make_puuid, match_id_for
+from simulator.limits import LimitGroup, WindowMode
+
+REGION_PLATFORMS = {
+    "AMERICAS": ["NA1", "BR1", "LA1", "LA2"],
+    "EUROPE": ["EUN1", "EUW1", "TR1", "RU"],
+    "ASIA": ["KR", "JP1"],
+    "SEA": ["OC1", "SG2", "TW2", "VN2"],
+}
+LEAGUE_PAGE_SIZE = 205
+
+# (path pattern, method name as in the riot_api client, method limit)
+ENDPOINTS = [
+    (
+        re.compile(r"^/lol/match/v5/matches/by-puuid/(?P<puuid>[^/]+)/ids$"),
+        "get_match_ids_by_puuid",
+        "2000:10",
+    ),
+    (
+        re.compile(r"^/lol/match/v5/matches/(?P<match_id>[^/]+)$"),
+        "get_match_by_match_id",
+        "2000:10",
+    ),
+    (
+        re.compile(
+            r"^/lol/league/v4/entries/(?P<queue>[^/]+)"
+            r"/(?P<tier>[^/]+)/(?P<division>[^/]+)$"
+        ),
+        "get_league_entries_by_tier",
+        "50:10",
+    ),
+    (
+        re.compile(
+            r"^/lol/league/v4/(?P<tier>challenger|grandmaster|master)leagues"
+            r"/by-queue/(?P<queue>[^/]+)$"
+        ),
+        "get_{tier}_league",
+        "30:10",
+    ),
+]
+
+
+@dataclass
+class SimulatorConfig:
+    app_limit: str = "20:1,100:120"
+    window_mode: WindowMode = "fixed"
+    latency: float = 0.05
+    jitter: float = 0.02
+    error_rate: float = 0.0
+    api_key: Optional[str] = None
+    players_per_platform: int = 2000
+    matches_per_player: int = 100
+    league_pages: int = 3
+    seed: int = 0
+
+
+def status_body(message: str, status_code: int) -> dict[str, Any]:
+    return {"status": {"message": message, "status_code": status_code}}
+
+
+class RiotSimulator:
+    def __init__(self, config: SimulatorConfig):
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.app_limits: dict[tuple[str, str], LimitGroup] = {}
+        self.method_limits: dict[tuple[str, str, str], LimitGroup] = {}
+        self.players = {
+            platform: [
+                make_puuid(platform, i) for i in range(config.players_per_platform)
+            ]
+            for platforms in REGION_PLATFORMS.values()
+            for platform in platforms
+        }
+        self.player_platform = {
+            puuid: platform
+            for platform, puuids in self.players.items()
+            for puuid in puuids
+        }
+        self.match_body = lru_cache(maxsize=4096)(self._match_body)
+        self.logger = structlog.get_logger("collector").bind(component="simulator")
+
+    def _match_body(self, match_id: str) -> bytes:
+        platform = match_id.partition("_")[0]
+        return json.dumps(build_match(match_id, self.players[platform])).encode()
+
+    # endpoint handlers return (status, body)
+    def get_match_ids(self, route: str, puuid: str, query: dict[str, str]):
+        platform = self.player_platform.get(puuid, REGION_PLATFORMS[route][0])
+        start = int(query.get("start", 0))
+        count = int(query.get("count", 20))
+        end = min(start + count, self.config.matches_per_player)
+        ids = [match_id_for(platform, puuid, i) for i in range(start, end)]
+        return 200, json.dumps(ids).encode()
+
+    def get_match(self, route: str, match_id: str):
+        platform = match_id.partition("_")[0]
+        if platform not in REGION_PLATFORMS.get(route, []):
+            return 404, json.dumps(status_body("Data not found", 404)).encode()
+        return 200, self.match_body(match_id)
+
+    def get_league_entries(self, platform: str, match: dict, query: dict[str, str]):
+        page = int(query.get("page", 1))
+        if page > self.config.league_pages:
+            return 200, b"[]"
+        offset = (page - 1) * LEAGUE_PAGE_SIZE
+        puuids = self.players[platform][offset : offset + LEAGUE_PAGE_SIZE]
+        entries = [
+            {
+                "leagueId": f"sim-{match['tier']}",
+                "puuid": puuid,
+                "queueType": match["queue"],
+                "tier": match["tier"],
+                "rank": match["division"],
+                "leaguePoints": self.rng.randint(0, 99),
+                "wins": self.rng.randint(10, 200),
+                "losses": self.rng.randint(10, 200),
+                "veteran": False,
+                "inactive": False,
+                "freshBlood": False,
+                "hotStreak": False,
+            }
+            for puuid in puuids
+        ]
+        return 200, json.dumps(entries).encode()
+
+    def get_apex_league(self, platform: str, match: dict):
+        tier = match["tier"].upper()
+        puuids = self.players[platform][:LEAGUE_PAGE_SIZE]
+        league = {
+            "tier": tier,
+            "leagueId": f"sim-{tier}",
+            "queue": match["queue"],
+            "name": "Simulated League",
+            "entries": [
+                {
+                    "puuid": puuid,
+                    "leaguePoints": self.rng.randint(0, 1500),
+                    "rank": "I",
+                    "wins": self.rng.randint(50, 400),
+                    "losses": self.rng.randint(50, 400),
+                }
+                for puuid in puuids
+            ],
+        }
+        return 200, json.dumps(league).encode()
+
+    def dispatch(self, route: str, method: str, match: dict, query: dict[str, str]):
+        if method == "get_match_ids_by_puuid":
+            return self.get_match_ids(route, match["puuid"], query)
+        if method == "get_match_by_match_id":
+            return self.get_match(route, match["match_id"])
+        if method == "get_league_entries_by_tier":
+            return self.get_league_entries(route, match, query)
+        return self.get_apex_league(route, match)
+
+    def resolve(self, path: str):
+        for pattern, method, limit in ENDPOINTS:
+            match = pattern.match(path)
+            if match is not None:
+                groups = match.groupdict()
+                return method.format(**groups), limit, groups
+        return None
+
+    async def handle(
+        self, path: str, query: dict[str, str], headers: dict[str, str]
+    ) -> tuple[int, dict[str, str], bytes]:
+        route = headers.get("host", "").split(".", 1)[0].split(":", 1)[0].upper()
+        api_key = headers.get("x-riot-token")
+        if not api_key:
+            return 401, {}, json.dumps(status_body("Unauthorized", 401)).encode()
+        if self.config.api_key is not None and api_key != self.config.api_key:
+            return 403, {}, json.dumps(status_body("Forbidden", 403)).encode()
+
+        resolved = self.resolve(path)
+        if resolved is None:
+            return 404, {}, json.dumps(status_body("Data not found", 404)).encode()
+        method, method_spec, match = resolved
+        # match-v5 is served per region, league-v4 per platform
+        routes = REGION_PLATFORMS if method.startswith("get_match") else self.players
+        if route not in routes:
+            return 404, {}, json.dumps(status_body("Data not found", 404)).encode()
+
+        now = time.monotonic()
+        app = self.app_limits.setdefault(
+            (api_key, route), LimitGroup(self.config.app_limit, self.config.window_mode)
+        )
+        method_limit = self.method_limits.setdefault(
+            (api_key, route, method), LimitGroup(method_spec, self.config.window_mode)
+        )
+
+        response_headers = {
+            "X-App-Rate-Limit": app.spec,
+            "X-Method-Rate-Limit": method_limit.spec,
+        }
+
+        # rejected requests don't count against the windows
+        app_wait = app.retry_after(now)
+        method_wait = method_limit.retry_after(now)
+        if app_wait > 0 or method_wait > 0:
+            response_headers.update(
+                {
+                    "X-App-Rate-Limit-Count": app.counts(now),
+                    "X-Method-Rate-Limit-Count": method_limit.counts(now),
+                    "Retry-After": str(math.ceil(max(app_wait, method_wait))),
+                    "X-Rate-Limit-Type": "application" if app_wait > 0 else "method",
+                }
+            )
+            body = json.dumps(status_body("Rate limit exceeded", 429)).encode()
+            return 429, response_headers, body
+
+        app.hit(now)
+        method_limit.hit(now)
+        response_headers["X-App-Rate-Limit-Count"] = app.counts(now)
+        response_headers["X-Method-Rate-Limit-Count"] = method_limit.counts(now)
+
+        delay = self.rng.gauss(self.config.latency, self.config.jitter)
+        await asyncio.sleep(max(delay, 0.0))
+
+        if self.rng.random() < self.config.error_rate:
+            status = self.rng.choice([500, 502, 503, 504])
+            body = json.dumps(status_body("Simulated server error", status)).encode()
+            return status, response_headers, body
+
+        status, body = self.dispatch(route, method, match, query)
+        return status, response_headers, body
+
+    async def serve_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        # keep-alive, httpx reuses connections between requests
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers: dict[str, str] = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                # request bodies are never sent, drain one if present
+                length = int(headers.get("content-length", 0))
+                if length:
+                    await reader.readexactly(length)
+
+                _, target, _ = request_line.decode("latin-1").split(" ", 2)
+                path, _, query_string = target.partition("?")
+                query = dict(
+                    pair.partition("=")[::2]
+                    for pair in query_string.split("&")
+                    if pair
+                )
+
+                status, response_headers, body = await self.handle(path, query, headers)
+                head = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}"]
+                response_headers = {
+                    "Content-Type": "application/json;charset=utf-8",
+                    "Content-Length": str(len(body)),
+                    "Date": formatdate(usegmt=True),
+                    **response_headers,
+                }
+                head.extend(f"{k}: {v}" for k, v in response_headers.items())
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + body)
+                await writer.drain()
+
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            self.logger.critical("Simulator failed to serve request", exception=e)
+        finally:
+            writer.close()
+
+
+STATUS_TEXT = {
+    200: "OK",
+    401: "Unauthorized",
+    403: "Forbidden",
+    404: "Not Found",
+    429: "Too Many Requests",
+    500: "Internal Server Error",
+    502: "Bad Gateway",
+    503: "Service Unavailable",
+    504: "Gateway Timeout",
+}
+
+
+async def start_simulator(
+    config: SimulatorConfig,
+    host: str = "127.0.0.1",
+    port: int = 8080,
+) -> asyncio.Server:
+    simulator = RiotSimulator(config)
+    return await asyncio.start_server(simulator.serve_connection, host, port)
+
+
+def parse_args() -> tuple[SimulatorConfig, str, int]:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--app-limit", default="20:1,100:120")
+    parser.add_argument("--window", choices=["fixed", "sliding"], default="fixed")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds")
+    parser.add_argument("--jitter", type=float, default=0.02, help="seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--api-key", help="reject other keys with 403")
+    parser.add_argument("--players", type=int, default=2000)
+    parser.add_argument("--matches-per-player", type=int, default=100)
+    parser.add_argument("--league-pages", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    config = SimulatorConfig(
+        app_limit=args.app_limit,
+        window_mode=args.window,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        api_key=args.api_key,
+        players_per_platform=args.players,
+        matches_per_player=args.matches_per_player,
+        league_pages=args.league_pages,
+        seed=args.seed,
+    )
+    return config, args.host, args.port
+
+
+async def main():
+    configure_logging(queued=True, overflow="degrade")
+    logger = get_logger().bind(component="simulator")
+
+    config, host, port = parse_args()
+    server = await start_simulator(config, host, port)
+    logger.info(f"Riot API simulator listening on http://{host}:{port}", config=config)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,229 @@
+"""
+Export participant rows to Parquet, partitioned by patch and day.
+
+    python db/scripts/export_parquet.py exports/participants
+
+Rows of match_participants, participant_stats, participant_challenges and
+participant_perks are joined on (platform_name, game_id, participant_id)
+together with the match columns and streamed with binary COPY into
+OUT_DIR/patch=<major.minor>/day=<YYYY-MM-DD>/part-0.parquet.
+
+Each run only writes partitions that are new or whose match count changed
+since the last export (late ingested matches), tracked in _manifest.json.
+The current UTC day is skipped until it is complete.
+"""
+
+import argparse
+import json
+import os
+from datetime import date, datetime, timezone
+from pathlib import Path
+
+import psycopg
+import pyarrow as pa
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+
+load_dotenv()
+
+POSTGRES_DSN = os.environ["POSTGRES_DSN"]
+KEY_COLUMNS = ("platform_name", "game_id", "participant_id")
+PARTICIPANT_TABLES = (
+    "match_participants",
+    "participant_stats",
+    "participant_challenges",
+    "participant_perks",
+)
+MATCH_COLUMNS = ("game_start_timestamp", "game_duration", "game_version")
+PATCH_SQL = (
+    "split_part(m.game_version, '.', 1) || '.' || split_part(m.game_version, '.', 2)"
+)
+DAY_SQL = "(m.game_start_timestamp AT TIME ZONE 'UTC')::date"
+
+ARROW_TYPES = {
+    "smallint": pa.int16(),
+    "integer": pa.int32(),
+    "bigint": pa.int64(),
+    "real": pa.float32(),
+    "double precision": pa.float64(),
+    "boolean": pa.bool_(),
+    "text": pa.string(),
+    "timestamp with time zone": pa.timestamp("us", tz="UTC"),
+}
+COPY_TYPES = {
+    "smallint": "int2",
+    "integer": "int4",
+    "bigint": "int8",
+    "real": "float4",
+    "double precision": "float8",
+    "boolean": "bool",
+    "text": "text",
+    "timestamp with time zone": "timestamptz",
+}
+
+
+def table_columns(conn: psycopg.Connection, table: str) -> list[tuple[str, str]]:
+    rows = conn.execute(
+        """
+        SELECT column_name, data_type
+        FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = %s
+        ORDER BY ordinal_position
+        """,
+        (table,),
+    ).fetchall()
+    return [(name, data_type) for name, data_type in rows]
+
+
+def build_select(conn: psycopg.Connection) -> tuple[str, list[tuple[str, str]]]:
+    # keys come from match_participants only, every other column once
+    columns: list[tuple[str, str]] = []
+    select: list[str] = []
+    seen: set[str] = set()
+
+    def add(expression: str, name: str, data_type: str) -> None:
+        # enums and anything without a binary mapping travel as text
+        if data_type not in ARROW_TYPES:
+            expression += "::text"
+            data_type = "text"
+        columns.append((name, data_type))
+        select.append(f"{expression} AS {name}")
+        seen.add(name)
+
+    match_types = dict(table_columns(conn, "matches"))
+    for name in MATCH_COLUMNS:
+        add(f"m.{name}", name, match_types[name])
+
+    for alias, table in enumerate(PARTICIPANT_TABLES):
+        for name, data_type in table_columns(conn, table):
+            if name not in seen:
+                add(f"t{alias}.{name}", name, data_type)
+
+    joins = [f"JOIN {PARTICIPANT_TABLES[0]} t0 USING (platform_name, game_id)"]
+    keys = ", ".join(KEY_COLUMNS)
+    for alias, table in enumerate(PARTICIPANT_TABLES[1:], start=1):
+        joins.append(f"JOIN {table} t{alias} USING ({keys})")
+
+    query = (
+        f"SELECT {', '.join(select)} FROM matches m {' '.join(joins)}"
+        f" WHERE {PATCH_SQL} = %(patch)s AND {DAY_SQL} = %(day)s::date"
+    )
+    return query, columns
+
+
+def list_partitions(
+    conn: psycopg.Connection, since: date | None
+) -> dict[tuple[str, str], int]:
+    rows = conn.execute(
+        f"""
+        SELECT {PATCH_SQL} AS patch, {DAY_SQL} AS day, count(*)
+        FROM matches m
+        WHERE %(since)s::date IS NULL OR {DAY_SQL} >= %(since)s::date
+        GROUP BY 1, 2
+        """,
+        {"since": since},
+    ).fetchall()
+    return {(patch, day.isoformat()): count for patch, day, count in rows}
+
+
+def export_partition(
+    conn: psycopg.Connection,
+    query: str,
+    columns: list[tuple[str, str]],
+    patch: str,
+    day: str,
+    out_dir: Path,
+    compression: str,
+    batch_rows: int,
+) -> int:
+    schema = pa.schema([(name, ARROW_TYPES[data_type]) for name, data_type in columns])
+    target = out_dir / f"patch={patch}" / f"day={day}" / "part-0.parquet"
+    target.parent.mkdir(parents=True, exist_ok=True)
+    partial = target.with_name(target.name + ".tmp")
+
+    copy_sql = f"COPY ({query}) TO STDOUT (FORMAT BINARY)"
+    rows_written = 0
+    with pq.ParquetWriter(partial, schema, compression=compression) as writer:
+        with conn.cursor() as cur:
+            with cur.copy(copy_sql, {"patch": patch, "day": day}) as copy:
+                copy.set_types([COPY_TYPES[data_type] for _, data_type in columns])
+                batch: list[tuple] = []
+                for row in copy.rows():
+                    batch.append(row)
+                    if len(batch) >= batch_rows:
+                        writer.write_batch(to_record_batch(batch, schema))
+                        rows_written += len(batch)
+                        batch = []
+                if batch:
+                    writer.write_batch(to_record_batch(batch, schema))
+                    rows_written += len(batch)
+
+    os.replace(partial, target)
+    return rows_written
+
+
+def to_record_batch(rows: list[tuple], schema: pa.Schema) -> pa.RecordBatch:
+    columns = list(zip(*rows))
+    arrays = [
+        pa.array(values, type=field.type) for values, field in zip(columns, schema)
+    ]
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("out_dir", type=Path)
+    parser.add_argument("--since", type=date.fromisoformat, help="first day, UTC")
+    parser.add_argument("--compression", default="zstd")
+    parser.add_argument("--batch_rows", type=int, default=50_000)
+    parser.add_argument("--include_today", action="store_true")
+    args = parser.parse_args()
+
+    args.out_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = args.out_dir / "_manifest.json"
+    manifest = {}
+    if manifest_path.exists():
+        manifest = json.loads(manifest_path.read_text())
+
+    today = datetime.now(timezone.utc).date().isoformat()
+    with psycopg.connect(POSTGRES_DSN) as conn:
+        # a consistent snapshot, so counts match what is exported
+        conn.isolation_level = psycopg.IsolationLevel.REPEATABLE_READ
+        query, columns = build_select(conn)
+        partitions = list_partitions(conn, args.since)
+
+        # oldest first, so the manifest always covers a prefix of days
+        for (patch, day), matches in sorted(
+            partitions.items(), key=lambda item: item[0][1]
+        ):
+            if day >= today and not args.include_today:
+                continue
+            key = f"{patch}/{day}"
+            if manifest.get(key, {}).get("matches") == matches:
+                continue
+
+            rows = export_partition(
+                conn,
+                query,
+                columns,
+                patch,
+                day,
+                args.out_dir,
+                args.compression,
+                args.batch_rows,
+            )
+            manifest[key] = {
+                "matches": matches,
+                "rows": rows,
+                "exported": datetime.now(timezone.utc).isoformat(),
+            }
+            # written after every partition, so an interrupted run resumes
+            manifest_path.write_text(json.dumps(manifest, indent=1, sort_keys=True))
+            print(f"Exported {rows} rows for patch {patch} on {day}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,7 @@ CREATE TABLE users (
 	puuid TEXT PRIMARY KEY,
 	match_id_queried date DEFAULT 'epoch' :: date NOT NULL,
 	lease_until timestamptz DEFAULT 'epoch' :: timestamptz NOT NULL,
+	attempts SMALLINT DEFAULT 0 NOT NULL,
 	platform_name TEXT NOT NULL,
 	FOREIGN KEY (platform_name) REFERENCES platforms(platform_name)
 );
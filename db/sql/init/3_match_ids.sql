@@ -1,6 +1,7 @@
 CREATE TABLE match_ids (
     lease_until timestamptz NOT NULL DEFAULT 'epoch' :: timestamptz,
     queried bool NOT NULL DEFAULT false,
+    attempts SMALLINT NOT NULL DEFAULT 0,
     match_id TEXT PRIMARY KEY,
     region_name TEXT NOT NULL,
     FOREIGN KEY (region_name) REFERENCES regions(region_name)
@@ -8,6 +8,8 @@ CREATE TABLE matches (
     game_version TEXT NOT NULL,
     end_of_game_result TEXT NOT NULL,
     match_id text NOT NULL REFERENCES match_ids(match_id),
+    -- when the collector stored the match, incremental readers page by it
+    ingested_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
     PRIMARY KEY (platform_name, game_id),
     FOREIGN KEY (platform_name) REFERENCES platforms(platform_name)
 );
@@ -73,6 +75,7 @@ CREATE TABLE match_participants (
     team_id team_enum NOT NULL,
     team_position team_position_enum NOT NULL,
     participant_id SMALLINT NOT NULL,
+    puuid TEXT NOT NULL,
     champion_id SMALLINT NOT NULL REFERENCES champions(champion_id),
     summoner1_id SMALLINT REFERENCES summoners(summoner_id),
     summoner2_id SMALLINT REFERENCES summoners(summoner_id),
@@ -81,6 +84,10 @@ CREATE TABLE match_participants (
     FOREIGN KEY (platform_name, game_id, team_id) REFERENCES teams(platform_name, game_id, team_id) ON DELETE CASCADE
 );
 
+-- a player's games in order, for history features
+CREATE INDEX idx_match_participants_puuid ON match_participants (puuid, platform_name, game_id);
+CREATE INDEX idx_matches_ingested_at ON matches (ingested_at, platform_name, game_id);
+
 CREATE TABLE participant_stats (
     game_id BIGINT NOT NULL,
     champ_experience INT NOT NULL,
@@ -0,0 +1,13 @@
+CREATE TABLE dead_letters (
+    id BIGSERIAL PRIMARY KEY,
+    job_kind TEXT NOT NULL,
+    job_key TEXT NOT NULL,
+    route_name TEXT NOT NULL,
+    method_name TEXT NOT NULL,
+    params JSONB NOT NULL,
+    error JSONB NOT NULL,
+    attempts SMALLINT NOT NULL,
+    created_at timestamptz NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX idx_dead_letters_kind_key ON dead_letters (job_kind, job_key);
@@ -0,0 +1,8 @@
+CREATE TABLE player_ratings (
+    puuid TEXT PRIMARY KEY,
+    mu REAL NOT NULL,
+    sigma REAL NOT NULL,
+    games INT NOT NULL,
+    last_played TIMESTAMPTZ NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);